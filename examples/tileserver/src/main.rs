@@ -2,6 +2,7 @@ use std::future::Future;
 
 use std::num::ParseIntError;
 
+use acog::cache::COGCache;
 use acog::tiler::{extract_tile, TMSTileCoords};
 use bytes::Bytes;
 use http_body_util::Full;
@@ -62,8 +63,9 @@ async fn get_tile(filename: &str, z: u32, x: u64, y: u64) -> Result<HandlerRespo
     println!("get_tile {} {} {} {}", filename, z, x, y);
 
     // SECURITY TODO: Ensure filename contains no '..' / contain it to current directory or well-known files
-    let mut cog = acog::COG::open(filename).await?;
-    let tile_data = extract_tile(&mut cog, TMSTileCoords::from_zxy(z, x, y)).await?;
+    // Most of the traffic goes to a few files, so keep them opened across requests
+    let cog = COGCache::global().open(filename).await?;
+    let tile_data = extract_tile(&cog, TMSTileCoords::from_zxy(z, x, y)).await?;
     // Encode to jpeg using turbojpeg and send back data
     let img = turbojpeg::Image::<&[u8]> {
         pixels: &tile_data.data,
@@ -1,14 +1,15 @@
 import acog
 import asyncio
 import argparse
-import numpy as np
 import pylab as pl
 
 
 async def main(filename, z, x, y):
-  tile_data_buf = await acog.read_tile(filename, z, x, y)
-  # TODO: Hardcoded shape => return a struct from python containing some shape info
-  arr = np.frombuffer(tile_data_buf, dtype=np.uint8).reshape(256, 256, 3)
+  cog = await acog.COG.open(filename)
+  print(f"width={cog.width}, height={cog.height}, nbands={cog.nbands}, overviews={len(cog.overviews)}")
+  arr = await cog.read_tile(z, x, y)
+  print(f"stats: {cog.get_stats()}")
+  print(f"tile shape={arr.shape}, dtype={arr.dtype}")
   pl.imshow(arr)
   pl.show()
 
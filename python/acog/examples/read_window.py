@@ -0,0 +1,29 @@
+import acog
+import asyncio
+import argparse
+import numpy as np
+import pylab as pl
+
+
+async def main(filename, overview, i_from, j_from, i_to, j_to):
+  cog = await acog.COG.open(filename)
+  arr = await cog.read_window(overview, i_from, j_from, i_to, j_to)
+  print(f"window shape={arr.shape}, dtype={arr.dtype}")
+  # Reading into a preallocated array avoids allocating a new one for each window
+  out = np.empty_like(arr)
+  await cog.read_window(overview, i_from, j_from, i_to, j_to, out=out)
+  assert np.array_equal(arr, out)
+  pl.imshow(out[:, :, :3])
+  pl.show()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(prog="acog_example")
+  parser.add_argument('filename')
+  parser.add_argument('overview', type=int)
+  parser.add_argument('i_from', type=int)
+  parser.add_argument('j_from', type=int)
+  parser.add_argument('i_to', type=int)
+  parser.add_argument('j_to', type=int)
+  args = parser.parse_args()
+  asyncio.run(main(args.filename, args.overview, args.i_from, args.j_from, args.i_to, args.j_to))
@@ -1,29 +1,540 @@
-use pyo3::exceptions::PyRuntimeError;
-use pyo3::{prelude::*, types::PyBytes};
+use std::future::Future;
+use std::os::raw::{c_char, c_int, c_void};
+use std::path::PathBuf;
+use std::ptr;
+use std::sync::Arc;
+use std::time::Duration;
 
-#[pyfunction]
-fn read_tile(py: Python, filename: String, z: u32, x: u64, y: u64) -> PyResult<&PyAny> {
-    use ::acog::tiler::{extract_tile, TMSTileCoords};
+use ::acog::cache::{COGCache, COGCacheConfig, SharedCOG};
+use ::acog::tiler::{extract_tile, extract_tiles, TMSTileCoords, TileData, TILE_SIZE};
+use ::acog::{get_http_client_config, set_http_client_config, HttpClientConfig, ImageRect};
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{PyBufferError, PyRuntimeError, PyValueError};
+use pyo3::{ffi, prelude::*};
+
+fn to_py_err(e: ::acog::Error) -> PyErr {
+    PyRuntimeError::new_err(format!("{:?}", e))
+}
+
+/// Exposes pixel data produced by acog through the python buffer protocol. This is what lets us
+/// hand out numpy arrays that directly use the rust `Vec<u8>` instead of copying it
+#[pyclass]
+struct PixelBuffer {
+    data: Vec<u8>,
+    // Those are pointed to by the buffer views we hand out, so they need to live as long as self
+    shape: Vec<ffi::Py_ssize_t>,
+    strides: Vec<ffi::Py_ssize_t>,
+}
 
-    pyo3_asyncio::tokio::future_into_py(py, async move {
-        let mut cog = match ::acog::COG::open(&filename).await {
-            Ok(v) => v,
-            Err(e) => return Err(PyRuntimeError::new_err(format!("{:?}", e))),
+impl PixelBuffer {
+    /// `data` is expected to be packed in C order (e.g. HwC for an image)
+    fn new(data: Vec<u8>, shape: &[usize]) -> PixelBuffer {
+        let shape: Vec<ffi::Py_ssize_t> = shape.iter().map(|v| *v as ffi::Py_ssize_t).collect();
+        let mut strides = vec![1; shape.len()];
+        for i in (0..shape.len().saturating_sub(1)).rev() {
+            strides[i] = strides[i + 1] * shape[i + 1];
+        }
+        PixelBuffer {
+            data,
+            shape,
+            strides,
+        }
+    }
+}
+
+#[pymethods]
+impl PixelBuffer {
+    unsafe fn __getbuffer__(
+        slf: &PyCell<Self>,
+        view: *mut ffi::Py_buffer,
+        flags: c_int,
+    ) -> PyResult<()> {
+        if view.is_null() {
+            return Err(PyBufferError::new_err("View is null"));
+        }
+        if (flags & ffi::PyBUF_ND) != ffi::PyBUF_ND {
+            return Err(PyBufferError::new_err(
+                "PixelBuffer is multi-dimensional, consumers need to request shape information",
+            ));
+        }
+        let mut this = slf.try_borrow_mut()?;
+        // The view keeps a reference on us, which keeps `data`, `shape` and `strides` alive
+        ffi::Py_INCREF(slf.as_ptr());
+        (*view).obj = slf.as_ptr();
+        (*view).buf = this.data.as_mut_ptr() as *mut c_void;
+        (*view).len = this.data.len() as ffi::Py_ssize_t;
+        // We never touch `data` once it has been handed out, so python can freely write to it
+        (*view).readonly = 0;
+        (*view).itemsize = 1;
+        (*view).format = if (flags & ffi::PyBUF_FORMAT) == ffi::PyBUF_FORMAT {
+            b"B\0".as_ptr() as *mut c_char
+        } else {
+            ptr::null_mut()
+        };
+        (*view).ndim = this.shape.len() as c_int;
+        (*view).shape = this.shape.as_mut_ptr();
+        (*view).strides = if (flags & ffi::PyBUF_STRIDES) == ffi::PyBUF_STRIDES {
+            this.strides.as_mut_ptr()
+        } else {
+            ptr::null_mut()
         };
+        (*view).suboffsets = ptr::null_mut();
+        (*view).internal = ptr::null_mut();
+        Ok(())
+    }
+}
+
+/// Wraps `data` into a numpy array of the given shape without copying it
+fn to_numpy(py: Python, data: Vec<u8>, shape: &[usize]) -> PyResult<PyObject> {
+    let buffer = Py::new(py, PixelBuffer::new(data, shape))?;
+    let arr = py.import("numpy")?.call_method1("asarray", (buffer,))?;
+    Ok(arr.to_object(py))
+}
+
+/// A caller-supplied buffer that acog writes pixel data into
+struct OutBuffer {
+    obj: PyObject,
+    // Holding the buffer keeps the underlying memory alive (and the exporter from resizing it)
+    buffer: PyBuffer<u8>,
+}
+
+impl OutBuffer {
+    fn new(obj: &PyAny, shape: &[usize]) -> PyResult<OutBuffer> {
+        let buffer = PyBuffer::<u8>::get(obj)?;
+        if buffer.readonly() {
+            return Err(PyBufferError::new_err("out is not writable"));
+        }
+        if !buffer.is_c_contiguous() {
+            return Err(PyBufferError::new_err("out is not C-contiguous"));
+        }
+        let expected_count: usize = shape.iter().product();
+        if buffer.item_count() != expected_count {
+            return Err(PyValueError::new_err(format!(
+                "out has {} elements, expected {} for shape {:?}",
+                buffer.item_count(),
+                expected_count,
+                shape
+            )));
+        }
+        Ok(OutBuffer {
+            obj: obj.into(),
+            buffer,
+        })
+    }
+
+    fn as_mut_slice(&mut self) -> &mut [u8] {
+        // Safety: `new` checked the buffer is writable and contiguous and we keep it alive as long
+        // as self. As with numpy releasing the GIL, concurrent accesses from python are the
+        // caller's responsibility
+        unsafe {
+            std::slice::from_raw_parts_mut(
+                self.buffer.buf_ptr() as *mut u8,
+                self.buffer.len_bytes(),
+            )
+        }
+    }
+}
+
+/// Stacks the given tiles of a COG with `nbands` bands into a single (N, H, W, C) numpy array
+fn tiles_to_numpy(py: Python, nbands: u64, tiles_data: Vec<TileData>) -> PyResult<PyObject> {
+    let tile_shape = match tiles_data.first() {
+        Some(tile_data) => tile_data.shape(),
+        None => [TILE_SIZE as usize, TILE_SIZE as usize, nbands as usize],
+    };
+    // Concatenating is done without the GIL, only the final array is handed to python
+    let data = py.allow_threads(|| {
+        let mut data = Vec::with_capacity(tiles_data.len() * tile_shape.iter().product::<usize>());
+        for tile_data in tiles_data.iter() {
+            data.extend_from_slice(&tile_data.data);
+        }
+        data
+    });
+    let [height, width, nbands] = tile_shape;
+    to_numpy(py, data, &[tiles_data.len(), height, width, nbands])
+}
+
+fn zxy_to_tms(tiles: &[(u32, u64, u64)]) -> Vec<TMSTileCoords> {
+    tiles
+        .iter()
+        .map(|(z, x, y)| TMSTileCoords::from_zxy(*z, *x, *y))
+        .collect()
+}
 
-        let tile_data = match extract_tile(&mut cog, TMSTileCoords::from_zxy(z, x, y)).await {
-            Ok(v) => v,
-            Err(e) => return Err(PyRuntimeError::new_err(format!("{:?}", e))),
+/// Metadata about a single overview of a COG. overviews[0] is the full resolution image
+#[pyclass(get_all)]
+#[derive(Clone)]
+struct Overview {
+    width: u64,
+    height: u64,
+    tile_width: u64,
+    tile_height: u64,
+    nbands: u64,
+}
+
+/// A handle on an opened COG. Opening parses the TIFF header, IFDs and georeference once so that
+/// subsequent reads only pay for the tiles IO
+#[pyclass(name = "COG")]
+struct PyCOG {
+    // Reads only need `&self`, so concurrent reads on the same handle run in parallel. This may be
+    // shared with the process-wide COG cache
+    cog: SharedCOG,
+    // Python-side copies of the COG metadata
+    width: u64,
+    height: u64,
+    nbands: u64,
+    overviews: Vec<Overview>,
+}
+
+impl PyCOG {
+    /// Validates a window and returns it along with the (H, W, C) shape of its data
+    fn window(
+        &self,
+        i_from: u64,
+        j_from: u64,
+        i_to: u64,
+        j_to: u64,
+    ) -> PyResult<(ImageRect, [usize; 3])> {
+        if i_from > i_to || j_from > j_to {
+            return Err(PyValueError::new_err(format!(
+                "Invalid window i=[{}, {}), j=[{}, {})",
+                i_from, i_to, j_from, j_to
+            )));
+        }
+        let rect = ImageRect {
+            i_from,
+            j_from,
+            i_to,
+            j_to,
         };
-        let tile_data_py =
-            pyo3::Python::with_gil(|py| PyBytes::new(py, &tile_data.data).to_object(py));
-        Ok(tile_data_py)
+        // COG::open checks all overviews have the same nbands
+        let shape = [
+            rect.height() as usize,
+            rect.width() as usize,
+            self.nbands as usize,
+        ];
+        Ok((rect, shape))
+    }
+
+    fn new(cog: ::acog::COG) -> PyCOG {
+        PyCOG::from_shared(Arc::new(cog))
+    }
+
+    fn from_shared(cog: SharedCOG) -> PyCOG {
+        // The COGs opened by the bindings are not lazy, so those are all the overviews
+        let overviews = cog
+            .loaded_overviews()
+            .iter()
+            .map(|o| Overview {
+                width: o.width,
+                height: o.height,
+                tile_width: o.tile_width,
+                tile_height: o.tile_height,
+                nbands: o.nbands,
+            })
+            .collect();
+        PyCOG {
+            width: cog.width(),
+            height: cog.height(),
+            nbands: cog.nbands(),
+            overviews,
+            cog,
+        }
+    }
+}
+
+// The async and sync variants of the python API share the below implementations. The async variants
+// run them through `pyo3_asyncio`, while the sync ones use `block_on`
+
+/// Runs the given future to completion on the process-wide multi-threaded tokio runtime (the one
+/// `pyo3_asyncio` also uses), releasing the GIL meanwhile so other python threads can run or read
+/// in parallel
+fn block_on<F>(py: Python, fut: F) -> F::Output
+where
+    F: Future + Send,
+    F::Output: Send,
+{
+    py.allow_threads(|| pyo3_asyncio::tokio::get_runtime().block_on(fut))
+}
+
+/// If `cached` is true, this goes through the process-wide COG cache
+async fn open_cog(source_spec: String, cached: bool) -> PyResult<PyCOG> {
+    if cached {
+        let cog = COGCache::global()
+            .open(&source_spec)
+            .await
+            .map_err(to_py_err)?;
+        Ok(PyCOG::from_shared(cog))
+    } else {
+        let cog = ::acog::COG::open(&source_spec).await.map_err(to_py_err)?;
+        Ok(PyCOG::new(cog))
+    }
+}
+
+async fn read_tile_impl(cog: SharedCOG, z: u32, x: u64, y: u64) -> PyResult<PyObject> {
+    let tile_data = extract_tile(&cog, TMSTileCoords::from_zxy(z, x, y))
+        .await
+        .map_err(to_py_err)?;
+    let shape = tile_data.shape();
+    pyo3::Python::with_gil(|py| to_numpy(py, tile_data.data, &shape))
+}
+
+async fn read_tiles_impl(cog: SharedCOG, tiles: Vec<(u32, u64, u64)>) -> PyResult<PyObject> {
+    let tiles_data = extract_tiles(&cog, &zxy_to_tms(&tiles))
+        .await
+        .map_err(to_py_err)?;
+    pyo3::Python::with_gil(|py| tiles_to_numpy(py, cog.nbands(), tiles_data))
+}
+
+async fn read_window_impl(
+    cog: SharedCOG,
+    overview: usize,
+    rect: ImageRect,
+    shape: [usize; 3],
+    out: Option<OutBuffer>,
+) -> PyResult<PyObject> {
+    match out {
+        Some(mut out) => {
+            cog.read_image_part_into(overview, &rect, out.as_mut_slice())
+                .await
+                .map_err(to_py_err)?;
+            Ok(out.obj)
+        }
+        None => {
+            let data = cog
+                .read_image_part(overview, &rect)
+                .await
+                .map_err(to_py_err)?;
+            pyo3::Python::with_gil(|py| to_numpy(py, data, &shape))
+        }
+    }
+}
+
+#[pymethods]
+impl PyCOG {
+    /// Opens the given COG. With `cached=True`, this reuses the COG from the process-wide cache
+    /// if it has already been opened
+    #[staticmethod]
+    #[pyo3(signature = (source_spec, cached=false))]
+    fn open(py: Python, source_spec: String, cached: bool) -> PyResult<&PyAny> {
+        pyo3_asyncio::tokio::future_into_py(py, open_cog(source_spec, cached))
+    }
+
+    #[staticmethod]
+    #[pyo3(signature = (source_spec, cached=false))]
+    fn open_sync(py: Python, source_spec: String, cached: bool) -> PyResult<PyCOG> {
+        block_on(py, open_cog(source_spec, cached))
+    }
+
+    fn read_tile<'py>(&self, py: Python<'py>, z: u32, x: u64, y: u64) -> PyResult<&'py PyAny> {
+        pyo3_asyncio::tokio::future_into_py(py, read_tile_impl(self.cog.clone(), z, x, y))
+    }
+
+    fn read_tile_sync(&self, py: Python, z: u32, x: u64, y: u64) -> PyResult<PyObject> {
+        block_on(py, read_tile_impl(self.cog.clone(), z, x, y))
+    }
+
+    /// Reads the `[i_from, i_to) x [j_from, j_to)` pixel window of the given overview as a
+    /// (H, W, C) array. If `out` is given, the window is written into it and `out` is returned.
+    /// `out` must then be a writable C-contiguous uint8 buffer with H * W * C elements
+    #[pyo3(signature = (overview, i_from, j_from, i_to, j_to, out=None))]
+    #[allow(clippy::too_many_arguments)]
+    fn read_window<'py>(
+        &self,
+        py: Python<'py>,
+        overview: usize,
+        i_from: u64,
+        j_from: u64,
+        i_to: u64,
+        j_to: u64,
+        out: Option<&'py PyAny>,
+    ) -> PyResult<&'py PyAny> {
+        let (rect, shape) = self.window(i_from, j_from, i_to, j_to)?;
+        let out = out.map(|obj| OutBuffer::new(obj, &shape)).transpose()?;
+        pyo3_asyncio::tokio::future_into_py(
+            py,
+            read_window_impl(self.cog.clone(), overview, rect, shape, out),
+        )
+    }
+
+    #[pyo3(signature = (overview, i_from, j_from, i_to, j_to, out=None))]
+    #[allow(clippy::too_many_arguments)]
+    fn read_window_sync(
+        &self,
+        py: Python,
+        overview: usize,
+        i_from: u64,
+        j_from: u64,
+        i_to: u64,
+        j_to: u64,
+        out: Option<&PyAny>,
+    ) -> PyResult<PyObject> {
+        let (rect, shape) = self.window(i_from, j_from, i_to, j_to)?;
+        let out = out.map(|obj| OutBuffer::new(obj, &shape)).transpose()?;
+        block_on(
+            py,
+            read_window_impl(self.cog.clone(), overview, rect, shape, out),
+        )
+    }
+
+    /// Reads the given (z, x, y) tiles, returning them stacked as a (N, H, W, C) array
+    fn read_tiles<'py>(
+        &self,
+        py: Python<'py>,
+        tiles: Vec<(u32, u64, u64)>,
+    ) -> PyResult<&'py PyAny> {
+        pyo3_asyncio::tokio::future_into_py(py, read_tiles_impl(self.cog.clone(), tiles))
+    }
+
+    fn read_tiles_sync(&self, py: Python, tiles: Vec<(u32, u64, u64)>) -> PyResult<PyObject> {
+        block_on(py, read_tiles_impl(self.cog.clone(), tiles))
+    }
+
+    #[getter]
+    fn width(&self) -> u64 {
+        self.width
+    }
+
+    #[getter]
+    fn height(&self) -> u64 {
+        self.height
+    }
+
+    #[getter]
+    fn nbands(&self) -> u64 {
+        self.nbands
+    }
+
+    #[getter]
+    fn overviews(&self) -> Vec<Overview> {
+        self.overviews.clone()
+    }
+
+    // Obtain some statistics about the reads done on this COG so far
+    fn get_stats(&self) -> String {
+        self.cog.get_stats()
+    }
+}
+
+async fn open_and_read_tile(filename: String, z: u32, x: u64, y: u64) -> PyResult<PyObject> {
+    let cog = COGCache::global()
+        .open(&filename)
+        .await
+        .map_err(to_py_err)?;
+    read_tile_impl(cog, z, x, y).await
+}
+
+async fn open_and_read_tiles(filename: String, tiles: Vec<(u32, u64, u64)>) -> PyResult<PyObject> {
+    let cog = COGCache::global()
+        .open(&filename)
+        .await
+        .map_err(to_py_err)?;
+    read_tiles_impl(cog, tiles).await
+}
+
+#[pyfunction]
+fn read_tile(py: Python, filename: String, z: u32, x: u64, y: u64) -> PyResult<&PyAny> {
+    pyo3_asyncio::tokio::future_into_py(py, open_and_read_tile(filename, z, x, y))
+}
+
+#[pyfunction]
+fn read_tile_sync(py: Python, filename: String, z: u32, x: u64, y: u64) -> PyResult<PyObject> {
+    block_on(py, open_and_read_tile(filename, z, x, y))
+}
+
+/// Opens the COG once and reads all the given (z, x, y) tiles, stacked as a (N, H, W, C) array
+#[pyfunction]
+fn read_tiles(py: Python, filename: String, tiles: Vec<(u32, u64, u64)>) -> PyResult<&PyAny> {
+    pyo3_asyncio::tokio::future_into_py(py, open_and_read_tiles(filename, tiles))
+}
+
+#[pyfunction]
+fn read_tiles_sync(
+    py: Python,
+    filename: String,
+    tiles: Vec<(u32, u64, u64)>,
+) -> PyResult<PyObject> {
+    block_on(py, open_and_read_tiles(filename, tiles))
+}
+
+/// Configures the process-wide COG cache used by `read_tile`, `read_tiles` and `COG.open(cached=True)`.
+/// If `metadata_cache_dir` is set, the headers of the opened COGs are also cached in this
+/// directory, so they are re-opened without reading their header after a restart. For remote COGs,
+/// this requires `ttl_seconds` to be set. Parameters left to None keep their current value
+#[pyfunction]
+#[pyo3(signature = (max_entries=None, max_bytes=None, ttl_seconds=None, metadata_cache_dir=None))]
+fn configure_cache(
+    max_entries: Option<usize>,
+    max_bytes: Option<usize>,
+    ttl_seconds: Option<f64>,
+    metadata_cache_dir: Option<PathBuf>,
+) -> PyResult<()> {
+    let ttl = match ttl_seconds {
+        Some(v) => Some(
+            Duration::try_from_secs_f64(v)
+                .map_err(|e| PyValueError::new_err(format!("Invalid ttl_seconds={}: {}", v, e)))?,
+        ),
+        None => None,
+    };
+    let cache = COGCache::global();
+    let config = cache.get_config();
+    cache.set_config(COGCacheConfig {
+        max_entries: max_entries.unwrap_or(config.max_entries),
+        max_bytes: max_bytes.unwrap_or(config.max_bytes),
+        ttl: ttl.or(config.ttl),
+        metadata_cache_dir: metadata_cache_dir.or(config.metadata_cache_dir),
+    });
+    Ok(())
+}
+
+#[pyfunction]
+fn clear_cache() {
+    COGCache::global().clear()
+}
+
+#[pyfunction]
+fn get_cache_stats() -> String {
+    COGCache::global().get_stats()
+}
+
+/// Configures the HTTP client shared by all remote sources. This applies to sources opened after
+/// the call. Parameters left to None keep their current value
+#[pyfunction]
+#[pyo3(signature = (pool_max_idle_per_host=None, pool_idle_timeout_seconds=None, tcp_nodelay=None, http2=None))]
+fn configure_http_client(
+    pool_max_idle_per_host: Option<usize>,
+    pool_idle_timeout_seconds: Option<f64>,
+    tcp_nodelay: Option<bool>,
+    http2: Option<bool>,
+) -> PyResult<()> {
+    let pool_idle_timeout = match pool_idle_timeout_seconds {
+        Some(v) => Some(Duration::try_from_secs_f64(v).map_err(|e| {
+            PyValueError::new_err(format!("Invalid pool_idle_timeout_seconds={}: {}", v, e))
+        })?),
+        None => None,
+    };
+    let config = get_http_client_config();
+    set_http_client_config(HttpClientConfig {
+        pool_max_idle_per_host: pool_max_idle_per_host.unwrap_or(config.pool_max_idle_per_host),
+        pool_idle_timeout: pool_idle_timeout.or(config.pool_idle_timeout),
+        tcp_nodelay: tcp_nodelay.unwrap_or(config.tcp_nodelay),
+        http2: http2.unwrap_or(config.http2),
     })
+    .map_err(to_py_err)
 }
 
 /// A Python module implemented in Rust.
 #[pymodule]
 fn acog(_py: Python, m: &PyModule) -> PyResult<()> {
+    m.add_class::<PyCOG>()?;
+    m.add_class::<Overview>()?;
+    m.add_class::<PixelBuffer>()?;
     m.add_function(wrap_pyfunction!(read_tile, m)?)?;
+    m.add_function(wrap_pyfunction!(read_tile_sync, m)?)?;
+    m.add_function(wrap_pyfunction!(read_tiles, m)?)?;
+    m.add_function(wrap_pyfunction!(read_tiles_sync, m)?)?;
+    m.add_function(wrap_pyfunction!(configure_cache, m)?)?;
+    m.add_function(wrap_pyfunction!(clear_cache, m)?)?;
+    m.add_function(wrap_pyfunction!(get_cache_stats, m)?)?;
+    m.add_function(wrap_pyfunction!(configure_http_client, m)?)?;
     Ok(())
 }
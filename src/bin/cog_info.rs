@@ -13,15 +13,15 @@ async fn main() -> Result<(), Error> {
 
     let filename = &args[1];
     let cog = acog::open(filename).await?;
+    let overviews = cog.overviews().await?;
     println!(
         "cog width={}, height={}, nbands={}, overviews={}",
         cog.width(),
         cog.height(),
         cog.nbands(),
-        cog.overviews.len()
+        overviews.len()
     );
-    for i in 0..cog.overviews.len() {
-        let overview = &cog.overviews[i];
+    for (i, overview) in overviews.iter().enumerate() {
         println!(
             "overview i={}, width={}, height{}, tile_width={}, tile_height={}",
             i, overview.width, overview.height, overview.tile_width, overview.tile_height
@@ -19,14 +19,10 @@ async fn main() -> Result<(), Error> {
     let x = args[3].parse::<u64>().unwrap();
     let y = args[4].parse::<u64>().unwrap();
 
-    let mut cog = acog::COG::open(filename).await?;
-    let tile_data = extract_tile(&mut cog, TMSTileCoords::from_zxy(z, x, y)).await?;
-    write_to_npy(
-        "img.npy",
-        tile_data.data,
-        // TODO: Remove hardcoded tile size
-        [256, 256, 3],
-    )?;
+    let cog = acog::COG::open(filename).await?;
+    let tile_data = extract_tile(&cog, TMSTileCoords::from_zxy(z, x, y)).await?;
+    let shape = tile_data.shape();
+    write_to_npy("img.npy", tile_data.data, shape)?;
 
     println!("Stats: {}", cog.get_stats());
     Ok(())
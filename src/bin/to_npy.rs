@@ -15,22 +15,22 @@ async fn main() -> Result<(), Error> {
     let filename = &args[1];
     let overview_index = args[2].parse::<usize>().unwrap();
 
-    let mut cog = acog::open(filename).await?;
+    let cog = acog::open(filename).await?;
+    let overviews = cog.overviews().await?;
     println!(
         "cog width={}, height={}, nbands={}, overviews={}",
         cog.width(),
         cog.height(),
         cog.nbands(),
-        cog.overviews.len()
+        overviews.len()
     );
-    for i in 0..cog.overviews.len() {
-        let overview = &cog.overviews[i];
+    for (i, overview) in overviews.iter().enumerate() {
         println!(
             "overview i={}, width={}, height{}, tile_width={}, tile_height={}",
             i, overview.width, overview.height, overview.tile_width, overview.tile_height
         );
     }
-    let overview = &cog.overviews[overview_index];
+    let overview = overviews[overview_index];
 
     let rect = if args.len() > 3 {
         ImageRect {
@@ -48,19 +48,16 @@ async fn main() -> Result<(), Error> {
         }
     };
     println!("Extracting rect={:?}", rect);
+    let nbands = overview.nbands;
 
-    let img_data = overview
-        .make_reader(&mut cog.source)
-        .await?
-        .read_image_part(&mut cog.source, &rect)
-        .await?;
+    let img_data = cog.read_image_part(overview_index, &rect).await?;
     write_to_npy(
         "img.npy",
         img_data,
         [
             rect.height() as usize,
             rect.width() as usize,
-            overview.nbands as usize,
+            nbands as usize,
         ],
     )?;
     Ok(())
@@ -0,0 +1,275 @@
+/// A process-wide cache of opened COGs
+///
+/// Opening a COG requires reading and decoding the TIFF header, the IFDs, the GeoKeyDirectory and the
+/// georeference, which costs several reads (or HTTP range requests) per open. Servers typically get
+/// most of their traffic on a small set of files, so keeping those opened lets a repeated open cost a
+/// hash lookup instead.
+use std::collections::HashMap;
+use std::path::PathBuf;
+use std::sync::{Arc, Mutex, OnceLock};
+use std::time::{Duration, Instant};
+
+use crate::errors::Error;
+use crate::metadata_cache::MetadataCache;
+use crate::COG;
+
+/// Reading from a COG only requires `&self`, so a cached COG can serve concurrent reads
+pub type SharedCOG = Arc<COG>;
+
+#[derive(Debug, Clone)]
+pub struct COGCacheConfig {
+    /// Maximum number of opened COGs to keep
+    pub max_entries: usize,
+    /// Maximum (estimated) memory used by the opened COGs
+    pub max_bytes: usize,
+    /// If set, COGs opened longer than this ago are re-opened, which allows picking up files that
+    /// changed
+    pub ttl: Option<Duration>,
+    /// If set, the headers of the COGs are also cached on disk in this directory, so re-opening
+    /// them after a restart doesn't read them from the source again. See `MetadataCache`. Sidecar
+    /// files older than `ttl` aren't used. Remote COGs only use sidecars if `ttl` is set, since
+    /// there is no other way to notice they changed
+    pub metadata_cache_dir: Option<PathBuf>,
+}
+
+impl Default for COGCacheConfig {
+    fn default() -> Self {
+        COGCacheConfig {
+            max_entries: 256,
+            max_bytes: 512 * 1024 * 1024,
+            ttl: None,
+            metadata_cache_dir: None,
+        }
+    }
+}
+
+struct CacheEntry {
+    cog: SharedCOG,
+    opened_at: Instant,
+    // Value of `CacheState::use_counter` when this entry was last used
+    last_used: u64,
+    // Estimated memory used by the COG, as of the last eviction
+    nbytes: usize,
+}
+
+#[derive(Debug, Default)]
+struct Stats {
+    hits: usize,
+    misses: usize,
+    evictions: usize,
+}
+
+#[derive(Default)]
+struct CacheState {
+    config: COGCacheConfig,
+    entries: HashMap<String, CacheEntry>,
+    // Incremented on each access, this gives us the recency ordering for LRU eviction
+    use_counter: u64,
+    stats: Stats,
+}
+
+impl CacheState {
+    fn get(&mut self, source_spec: &str) -> Option<SharedCOG> {
+        let expired = match (self.entries.get(source_spec), self.config.ttl) {
+            (Some(entry), Some(ttl)) => entry.opened_at.elapsed() > ttl,
+            _ => false,
+        };
+        if expired {
+            self.entries.remove(source_spec);
+            self.stats.evictions += 1;
+        }
+        self.use_counter += 1;
+        let use_counter = self.use_counter;
+        match self.entries.get_mut(source_spec) {
+            Some(entry) => {
+                entry.last_used = use_counter;
+                self.stats.hits += 1;
+                Some(entry.cog.clone())
+            }
+            None => {
+                self.stats.misses += 1;
+                None
+            }
+        }
+    }
+
+    fn insert(&mut self, source_spec: &str, cog: SharedCOG, nbytes: usize) {
+        self.use_counter += 1;
+        self.entries.insert(
+            source_spec.to_string(),
+            CacheEntry {
+                cog,
+                opened_at: Instant::now(),
+                last_used: self.use_counter,
+                nbytes,
+            },
+        );
+        self.evict();
+    }
+
+    fn evict(&mut self) {
+        // The memory used by a COG grows as it's being read from (e.g. its chunk cache), so refresh
+        // our estimates
+        for entry in self.entries.values_mut() {
+            entry.nbytes = entry.cog.estimate_nbytes();
+        }
+        let mut total_nbytes: usize = self.entries.values().map(|e| e.nbytes).sum();
+        // Note that we always keep at least one entry, even if it's above max_bytes
+        while self.entries.len() > 1
+            && (self.entries.len() > self.config.max_entries
+                || total_nbytes > self.config.max_bytes)
+        {
+            let lru_key = self
+                .entries
+                .iter()
+                .min_by_key(|(_, e)| e.last_used)
+                .map(|(k, _)| k.clone())
+                .unwrap();
+            let entry = self.entries.remove(&lru_key).unwrap();
+            total_nbytes -= entry.nbytes;
+            self.stats.evictions += 1;
+        }
+    }
+}
+
+/// A thread-safe, bounded cache of opened COGs, keyed by source spec with LRU eviction
+///
+/// Note that concurrent misses on the same source spec will each open the COG, with the last one
+/// being kept in the cache
+#[derive(Default)]
+pub struct COGCache {
+    state: Mutex<CacheState>,
+}
+
+impl COGCache {
+    pub fn new(config: COGCacheConfig) -> COGCache {
+        COGCache {
+            state: Mutex::new(CacheState {
+                config,
+                ..Default::default()
+            }),
+        }
+    }
+
+    /// The process-wide cache
+    pub fn global() -> &'static COGCache {
+        static GLOBAL_CACHE: OnceLock<COGCache> = OnceLock::new();
+        GLOBAL_CACHE.get_or_init(COGCache::default)
+    }
+
+    pub fn get_config(&self) -> COGCacheConfig {
+        self.state.lock().unwrap().config.clone()
+    }
+
+    pub fn set_config(&self, config: COGCacheConfig) {
+        let mut state = self.state.lock().unwrap();
+        state.config = config;
+        state.evict();
+    }
+
+    /// Returns the cached COG for this source spec, opening it if it isn't cached yet
+    pub async fn open(&self, source_spec: &str) -> Result<SharedCOG, Error> {
+        if let Some(cog) = self.state.lock().unwrap().get(source_spec) {
+            return Ok(cog);
+        }
+        let config = self.get_config();
+        // We don't hold the lock while opening, so other COGs can be used meanwhile
+        let cog = match config.metadata_cache_dir {
+            Some(dir) => {
+                MetadataCache::new(dir, config.ttl)
+                    .open(source_spec)
+                    .await?
+            }
+            None => COG::open(source_spec).await?,
+        };
+        let nbytes = cog.estimate_nbytes();
+        let cog = Arc::new(cog);
+        self.state
+            .lock()
+            .unwrap()
+            .insert(source_spec, cog.clone(), nbytes);
+        Ok(cog)
+    }
+
+    /// Removes the given source spec from the cache, if it's there
+    pub fn invalidate(&self, source_spec: &str) {
+        self.state.lock().unwrap().entries.remove(source_spec);
+    }
+
+    pub fn clear(&self) {
+        self.state.lock().unwrap().entries.clear();
+    }
+
+    pub fn len(&self) -> usize {
+        self.state.lock().unwrap().entries.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    // Obtain some statistics to be reported to the user
+    pub fn get_stats(&self) -> String {
+        let state = self.state.lock().unwrap();
+        format!("entries={}, {:?}", state.entries.len(), state.stats)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::{COGCache, COGCacheConfig};
+    use std::sync::Arc;
+    use std::time::Duration;
+
+    const EXAMPLE_1: &str = "example_data/example_1_cog_3857_nocompress.tif";
+    const EXAMPLE_2: &str = "example_data/example_1_cog_nocompress.tif";
+    const EXAMPLE_3: &str = "example_data/marina_1_cog_nocompress.tif";
+
+    #[tokio::test]
+    async fn test_cache_hit() {
+        let cache = COGCache::new(COGCacheConfig::default());
+        let cog1 = cache.open(EXAMPLE_1).await.unwrap();
+        let cog2 = cache.open(EXAMPLE_1).await.unwrap();
+        assert!(Arc::ptr_eq(&cog1, &cog2));
+        assert!(cache.get_stats().contains("hits: 1, misses: 1"));
+    }
+
+    #[tokio::test]
+    async fn test_cache_lru_eviction() {
+        let cache = COGCache::new(COGCacheConfig {
+            max_entries: 2,
+            ..Default::default()
+        });
+        let cog1 = cache.open(EXAMPLE_1).await.unwrap();
+        cache.open(EXAMPLE_2).await.unwrap();
+        // Use EXAMPLE_1 so EXAMPLE_2 becomes the least recently used
+        cache.open(EXAMPLE_1).await.unwrap();
+        cache.open(EXAMPLE_3).await.unwrap();
+        assert_eq!(cache.len(), 2);
+        assert!(Arc::ptr_eq(&cog1, &cache.open(EXAMPLE_1).await.unwrap()));
+        assert!(cache.get_stats().contains("evictions: 1"));
+    }
+
+    #[tokio::test]
+    async fn test_cache_ttl() {
+        let cache = COGCache::new(COGCacheConfig {
+            ttl: Some(Duration::ZERO),
+            ..Default::default()
+        });
+        let cog1 = cache.open(EXAMPLE_1).await.unwrap();
+        let cog2 = cache.open(EXAMPLE_1).await.unwrap();
+        assert!(!Arc::ptr_eq(&cog1, &cog2));
+    }
+
+    #[tokio::test]
+    async fn test_cache_max_bytes() {
+        let cache = COGCache::new(COGCacheConfig {
+            max_bytes: 1,
+            ..Default::default()
+        });
+        cache.open(EXAMPLE_1).await.unwrap();
+        cache.open(EXAMPLE_2).await.unwrap();
+        // We always keep the most recently opened COG
+        assert_eq!(cache.len(), 1);
+    }
+}
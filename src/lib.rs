@@ -1,7 +1,9 @@
+pub mod cache;
 mod epsg;
 mod errors;
 pub mod image;
 mod math;
+pub mod metadata_cache;
 pub mod npy;
 pub mod ppm;
 mod sources;
@@ -9,8 +11,9 @@ mod tiff;
 pub mod tiler;
 
 pub use errors::Error;
+pub use sources::{get_http_client_config, set_http_client_config, HttpClientConfig};
 pub use tiff::cog::{ImageRect, COG};
-pub use tiff::ifd::{FullyDecodedIFDEntry, TIFFReader};
+pub use tiff::ifd::{FullyDecodedIFDEntry, IFDChain, TIFFReader};
 
 pub async fn open(source_spec: &str) -> Result<COG, Error> {
     COG::open(source_spec).await
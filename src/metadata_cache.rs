@@ -0,0 +1,249 @@
+/// An on-disk cache of the headers of COGs, to re-open them without reading their header again
+///
+/// Opening a COG reads its TIFF header, the IFDs and their values (georeference, geokeys, tile
+/// offsets...), which costs several range requests for remote COGs. When a COG is opened through
+/// a `MetadataCache`, the chunks of the source that were read while opening are written to a
+/// sidecar file. The next open of the same source spec (e.g. after a restart, or from another
+/// process) preloads them in the chunk cache so the COG is parsed without reading from the source.
+///
+/// The sidecar file format is:
+/// - MAGIC
+/// - validator length (u32) and validator (utf-8)
+/// - number of chunks (u32)
+/// - for each chunk: chunk index (u32), data length (u32) and data
+///
+/// All integers are little endian.
+///
+/// Local files are validated by their size and modification time. Remote sources have no such
+/// validator (it would cost a request), so their sidecars are only used if the cache has a
+/// `max_age`: without one, remote COGs are opened without a sidecar.
+use std::path::PathBuf;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::time::{Duration, SystemTime, UNIX_EPOCH};
+
+use sha2::{Digest, Sha256};
+
+use crate::errors::Error;
+use crate::sources::Source;
+use crate::COG;
+
+const MAGIC: &[u8; 8] = b"ACOGHDR1";
+
+pub struct MetadataCache {
+    dir: PathBuf,
+    max_age: Option<Duration>,
+}
+
+fn is_remote(source_spec: &str) -> bool {
+    ["/vsis3/", "/vsicurl/", "http://", "https://"]
+        .iter()
+        .any(|prefix| source_spec.starts_with(prefix))
+}
+
+/// Identifies the version of a local file, so its sidecar isn't used anymore once it changes.
+/// Remote sources would need a request to get this, so this is empty for them and `max_age`
+/// is used instead
+fn local_file_validator(source_spec: &str) -> String {
+    if is_remote(source_spec) {
+        return "".to_string();
+    }
+    let filename = source_spec.strip_prefix("mmap://").unwrap_or(source_spec);
+    match std::fs::metadata(filename) {
+        Ok(metadata) => {
+            let mtime = metadata
+                .modified()
+                .ok()
+                .and_then(|t| t.duration_since(UNIX_EPOCH).ok())
+                .map(|d| d.as_nanos())
+                .unwrap_or(0);
+            format!("size={},mtime={}", metadata.len(), mtime)
+        }
+        Err(_) => "".to_string(),
+    }
+}
+
+fn encode(validator: &str, chunks: &[(u32, Vec<u8>)]) -> Vec<u8> {
+    let data_len: usize = chunks.iter().map(|(_, data)| 8 + data.len()).sum();
+    let mut out = Vec::with_capacity(MAGIC.len() + 8 + validator.len() + data_len);
+    out.extend(MAGIC);
+    out.extend((validator.len() as u32).to_le_bytes());
+    out.extend(validator.as_bytes());
+    out.extend((chunks.len() as u32).to_le_bytes());
+    for (chunk_index, data) in chunks {
+        out.extend(chunk_index.to_le_bytes());
+        out.extend((data.len() as u32).to_le_bytes());
+        out.extend(data);
+    }
+    out
+}
+
+/// Consumes and returns the first `n` bytes of `data`
+fn take<'a>(data: &mut &'a [u8], n: usize) -> Option<&'a [u8]> {
+    if data.len() < n {
+        return None;
+    }
+    let (value, rest) = data.split_at(n);
+    *data = rest;
+    Some(value)
+}
+
+fn take_u32(data: &mut &[u8]) -> Option<u32> {
+    Some(u32::from_le_bytes(take(data, 4)?.try_into().unwrap()))
+}
+
+/// Returns the chunks stored in `data`, or None if it's invalid or has another validator
+fn decode(mut data: &[u8], validator: &str) -> Option<Vec<(u32, Vec<u8>)>> {
+    if take(&mut data, MAGIC.len())? != MAGIC {
+        return None;
+    }
+    let validator_len = take_u32(&mut data)? as usize;
+    if take(&mut data, validator_len)? != validator.as_bytes() {
+        return None;
+    }
+    let nchunks = take_u32(&mut data)?;
+    let mut chunks = vec![];
+    for _ in 0..nchunks {
+        let chunk_index = take_u32(&mut data)?;
+        let len = take_u32(&mut data)? as usize;
+        chunks.push((chunk_index, take(&mut data, len)?.to_vec()));
+    }
+    Some(chunks)
+}
+
+impl MetadataCache {
+    /// Sidecar files are stored in `dir`, which is created if needed. If `max_age` is set, sidecar
+    /// files older than this are ignored (and replaced), which allows picking up remote files
+    /// that changed. Remote sources can't be validated otherwise, so without `max_age` they
+    /// don't use sidecars at all
+    pub fn new(dir: impl Into<PathBuf>, max_age: Option<Duration>) -> MetadataCache {
+        MetadataCache {
+            dir: dir.into(),
+            max_age,
+        }
+    }
+
+    fn sidecar_path(&self, source_spec: &str) -> PathBuf {
+        let hash: String = Sha256::digest(source_spec.as_bytes())
+            .iter()
+            .map(|b| format!("{:02x}", b))
+            .collect();
+        self.dir.join(format!("{}.acoghdr", hash))
+    }
+
+    async fn load(&self, source_spec: &str, validator: &str) -> Option<Vec<(u32, Vec<u8>)>> {
+        let path = self.sidecar_path(source_spec);
+        if let Some(max_age) = self.max_age {
+            let modified = tokio::fs::metadata(&path).await.ok()?.modified().ok()?;
+            if SystemTime::now()
+                .duration_since(modified)
+                .unwrap_or_default()
+                > max_age
+            {
+                return None;
+            }
+        }
+        decode(&tokio::fs::read(&path).await.ok()?, validator)
+    }
+
+    async fn store(
+        &self,
+        source_spec: &str,
+        validator: &str,
+        chunks: &[(u32, Vec<u8>)],
+    ) -> Result<(), Error> {
+        tokio::fs::create_dir_all(&self.dir).await?;
+        let path = self.sidecar_path(source_spec);
+        // Write to a temporary file first, so concurrent opens (possibly from other processes)
+        // never see a partially written sidecar. The counter makes the name unique to this call,
+        // as concurrent opens of the same source spec can happen in the same process
+        static TMP_COUNTER: AtomicUsize = AtomicUsize::new(0);
+        let tmp_path = path.with_extension(format!(
+            "{}.{}.tmp",
+            std::process::id(),
+            TMP_COUNTER.fetch_add(1, Ordering::Relaxed)
+        ));
+        tokio::fs::write(&tmp_path, encode(validator, chunks)).await?;
+        tokio::fs::rename(&tmp_path, &path).await?;
+        Ok(())
+    }
+
+    /// Opens the COG, using its sidecar file if there is a valid one and writing it otherwise
+    pub async fn open(&self, source_spec: &str) -> Result<COG, Error> {
+        let source = Source::new_from_source_spec(source_spec).await?;
+        if self.max_age.is_none() && is_remote(source_spec) {
+            // Nothing would ever tell us the remote file changed
+            return COG::open_from_source(source).await;
+        }
+        let validator = local_file_validator(source_spec);
+        let cached_chunks = self.load(source_spec, &validator).await;
+        let has_sidecar = cached_chunks.is_some();
+        if let Some(chunks) = cached_chunks {
+            source.insert_cached_chunks(chunks)?;
+        }
+        let cog = COG::open_from_source(source).await?;
+        if !has_sidecar {
+            // The COG is usable even if we couldn't write its sidecar (e.g. a read-only cache
+            // directory), the next open then just reads the header from the source again
+            let _ = self
+                .store(source_spec, &validator, &cog.source.cached_chunks())
+                .await;
+        }
+        Ok(cog)
+    }
+
+    /// Removes the sidecar file of this source spec, if there is one
+    pub async fn invalidate(&self, source_spec: &str) -> Result<(), Error> {
+        match tokio::fs::remove_file(self.sidecar_path(source_spec)).await {
+            Err(e) if e.kind() != std::io::ErrorKind::NotFound => Err(e.into()),
+            _ => Ok(()),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::{decode, encode, is_remote, MetadataCache};
+
+    const EXAMPLE_1: &str = "example_data/example_1_cog_3857_nocompress.tif";
+
+    #[test]
+    fn test_encode_decode() {
+        let chunks = vec![(0, vec![1, 2, 3]), (5, vec![4; 100])];
+        let data = encode("size=10", &chunks);
+        assert_eq!(decode(&data, "size=10"), Some(chunks));
+        // The file changed
+        assert_eq!(decode(&data, "size=11"), None);
+        // Truncated
+        assert_eq!(decode(&data[..data.len() - 1], "size=10"), None);
+    }
+
+    #[test]
+    fn test_is_remote() {
+        assert!(is_remote("https://example.com/cog.tif"));
+        assert!(is_remote("/vsis3/bucket/cog.tif"));
+        assert!(!is_remote(EXAMPLE_1));
+    }
+
+    #[tokio::test]
+    async fn test_reopen_from_sidecar() {
+        let dir = std::env::temp_dir().join(format!(
+            "acog_test_reopen_from_sidecar_{}",
+            std::process::id()
+        ));
+        let cache = MetadataCache::new(&dir, None);
+        cache.invalidate(EXAMPLE_1).await.unwrap();
+
+        let cog1 = cache.open(EXAMPLE_1).await.unwrap();
+        assert!(!cog1.get_stats().contains("read_counts=0"));
+        // Nothing is read from the source when re-opening
+        let cog2 = cache.open(EXAMPLE_1).await.unwrap();
+        assert!(cog2.get_stats().contains("read_counts=0"));
+        assert_eq!(cog2.width(), cog1.width());
+        assert_eq!(cog2.height(), cog1.height());
+        assert_eq!(
+            format!("{:?}", cog2.georeference),
+            format!("{:?}", cog1.georeference)
+        );
+        std::fs::remove_dir_all(&dir).unwrap();
+    }
+}
@@ -1,34 +1,76 @@
 use crate::errors::Error;
 use std::io;
-use std::io::SeekFrom;
-use tokio::{fs::File, io::AsyncReadExt, io::AsyncSeekExt};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
 
 #[derive(Default)]
 struct Stats {
-    read_counts: usize,
+    read_counts: AtomicUsize,
 }
 
+/// A local file source using positional reads (`pread`), which don't touch the file cursor. This
+/// makes the source `Sync`: concurrent reads share the same file descriptor without any locking
 pub struct FileSource {
-    pub file: File,
+    file: Arc<std::fs::File>,
     stats: Stats,
 }
 
+#[cfg(unix)]
+fn read_at(file: &std::fs::File, buf: &mut [u8], offset: u64) -> io::Result<usize> {
+    use std::os::unix::fs::FileExt;
+    file.read_at(buf, offset)
+}
+
+#[cfg(windows)]
+fn read_at(file: &std::fs::File, buf: &mut [u8], offset: u64) -> io::Result<usize> {
+    // Note that contrary to `pread`, this does move the file cursor, but we never rely on it
+    use std::os::windows::fs::FileExt;
+    file.seek_read(buf, offset)
+}
+
+/// Reads until `buf` is full or EOF is reached, returning the number of bytes read
+fn read_full_at(file: &std::fs::File, buf: &mut [u8], offset: u64) -> io::Result<usize> {
+    let mut nread = 0;
+    while nread < buf.len() {
+        match read_at(file, &mut buf[nread..], offset + nread as u64) {
+            Ok(0) => break,
+            Ok(n) => nread += n,
+            Err(e) if e.kind() == io::ErrorKind::Interrupted => continue,
+            Err(e) => return Err(e),
+        }
+    }
+    Ok(nread)
+}
+
 impl FileSource {
     pub async fn new(filename: &str) -> Result<FileSource, io::Error> {
-        let file = File::open(filename).await?;
+        let file = tokio::fs::File::open(filename).await?.into_std().await;
         Ok(FileSource {
-            file,
+            file: Arc::new(file),
             stats: Default::default(),
         })
     }
 
-    pub async fn read(&mut self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
-        self.file.seek(SeekFrom::Start(offset)).await?;
-        self.stats.read_counts += 1;
-        Ok(self.file.read(buf).await?)
+    pub async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+        // Like tokio::fs, we do the blocking read on the blocking pool. This requires an owned
+        // buffer, which we then copy to `buf`
+        let file = self.file.clone();
+        let len = buf.len();
+        let (data, nread) = tokio::task::spawn_blocking(move || {
+            let mut data = vec![0u8; len];
+            read_full_at(&file, &mut data, offset).map(|nread| (data, nread))
+        })
+        .await
+        .map_err(|e| Error::SourceError(format!("File read task failed: {}", e)))??;
+        buf[..nread].copy_from_slice(&data[..nread]);
+        self.stats.read_counts.fetch_add(1, Ordering::Relaxed);
+        Ok(nread)
     }
 
     pub fn get_stats(&self) -> String {
-        format!("read_counts={}", self.stats.read_counts)
+        format!(
+            "read_counts={}",
+            self.stats.read_counts.load(Ordering::Relaxed)
+        )
     }
 }
@@ -0,0 +1,181 @@
+use std::cmp::min;
+
+use super::shared_http_client;
+use crate::errors::Error;
+use bytes::Buf;
+use reqwest::{Client, Response};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{Mutex, OnceLock};
+
+/// Value of the Range header to read `len` bytes at `offset`. Note that the end is inclusive
+pub fn range_header(offset: u64, len: usize) -> String {
+    format!("bytes={}-{}", offset, offset + len as u64 - 1)
+}
+
+/// Parses the total size out of a `Content-Range: bytes <from>-<to>/<size>` header
+fn parse_content_range_size(content_range: &str) -> Option<u64> {
+    let (_, size) = content_range.strip_prefix("bytes ")?.split_once('/')?;
+    size.parse().ok()
+}
+
+/// Copies the body of a range request response to `buf`. This returns the number of bytes copied
+/// and, if the server told us, the total size of the resource
+pub async fn read_range_response(
+    resp: Response,
+    buf: &mut [u8],
+) -> Result<(usize, Option<u64>), Error> {
+    // We check for explicit 206 (Partial Content) because if the server would not support range requests,
+    // it could just reply with 200 and the whole document, but we don't support/want this
+    // here
+    if resp.status().as_u16() != 206 {
+        return Err(Error::OtherError(format!(
+            "Request failed, code={}: {}",
+            resp.status().as_u16(),
+            resp.text().await?,
+        )));
+    }
+    // Note that EOF is implicitely handled here because if we do a partial past EOF read, we'll
+    // still get a 206 but we can parse the "Content-Range" header to get file size. E.g.:
+    //
+    //    curl -v -r 558379745-558379761 http://localhost:9000/public/local/marina_cog_nocompress_3857.tif
+    //    ...
+    //    Content-Range: bytes 558379745-558379749/558379750
+    //
+    // But this is not necessary, because the server will just return the data until EOF, so
+    // our logic below transparently handles this
+    //
+    // Note that if you do a completely invalid read (both start and end past EOF), then most server
+    // will rightly response with a 416 - but that's a sign of a logic error here, so we do
+    // error out in this case
+    let size = resp
+        .headers()
+        .get("Content-Range")
+        .and_then(|v| v.to_str().ok())
+        .and_then(parse_content_range_size);
+    let mut body = resp.bytes().await?;
+    let body_len = body.remaining();
+    let len_to_copy = min(body_len, buf.len());
+    body.copy_to_slice(&mut buf[0..len_to_copy]);
+    Ok((len_to_copy, size))
+}
+
+#[derive(Debug, Default)]
+struct Stats {
+    requests_count: AtomicUsize,
+    redirects_count: AtomicUsize,
+}
+
+/// A source reading from a plain HTTP(S) URL through range requests, like GDAL's /vsicurl/
+pub struct HttpSource {
+    client: Client,
+    url: String,
+    // If `url` redirects (e.g. a CDN or a presigned URL), the URL it redirected to. We use this
+    // directly for subsequent reads instead of following the redirect on each read
+    redirect_url: Mutex<Option<String>>,
+    // Learnt from the Content-Range of the first response, so we don't need a HEAD request
+    size: OnceLock<u64>,
+    stats: Stats,
+}
+
+impl HttpSource {
+    pub async fn new(url: &str) -> Result<HttpSource, Error> {
+        Ok(HttpSource {
+            client: shared_http_client()?,
+            url: url.to_string(),
+            redirect_url: Mutex::new(None),
+            size: OnceLock::new(),
+            stats: Default::default(),
+        })
+    }
+
+    /// Size of the resource, if known yet
+    pub fn size(&self) -> Option<u64> {
+        self.size.get().copied()
+    }
+
+    async fn send(&self, url: &str, offset: u64, len: usize) -> Result<Response, Error> {
+        println!("Range request: {} {}-{}", url, offset, offset + len as u64);
+        self.stats.requests_count.fetch_add(1, Ordering::Relaxed);
+        Ok(self
+            .client
+            .get(url)
+            .header("Range", range_header(offset, len))
+            .send()
+            .await?)
+    }
+
+    pub async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+        if buf.is_empty() || self.size().is_some_and(|size| offset >= size) {
+            return Ok(0);
+        }
+        let redirect_url = self.redirect_url.lock().unwrap().clone();
+        let (requested_url, resp) = match redirect_url {
+            Some(redirect_url) => {
+                let resp = self.send(&redirect_url, offset, buf.len()).await?;
+                if resp.status().is_client_error() {
+                    // The redirect target may have expired (e.g. presigned URLs), so resolve it
+                    // again from the original URL
+                    *self.redirect_url.lock().unwrap() = None;
+                    (
+                        self.url.clone(),
+                        self.send(&self.url, offset, buf.len()).await?,
+                    )
+                } else {
+                    (redirect_url, resp)
+                }
+            }
+            None => (
+                self.url.clone(),
+                self.send(&self.url, offset, buf.len()).await?,
+            ),
+        };
+        // reqwest follows redirects, so we end up on another URL than the one we requested if
+        // there was one
+        if resp.url().as_str() != requested_url && resp.status().as_u16() == 206 {
+            self.stats.redirects_count.fetch_add(1, Ordering::Relaxed);
+            *self.redirect_url.lock().unwrap() = Some(resp.url().to_string());
+        }
+        let (read_count, size) = read_range_response(resp, buf).await?;
+        if let Some(size) = size {
+            let _ = self.size.set(size);
+        }
+        Ok(read_count)
+    }
+
+    pub fn get_stats(&self) -> String {
+        format!("{:?}", self.stats)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::{parse_content_range_size, range_header};
+    use crate as acog;
+
+    #[test]
+    fn test_parse_content_range_size() {
+        assert_eq!(
+            parse_content_range_size("bytes 558379745-558379749/558379750"),
+            Some(558379750)
+        );
+        assert_eq!(parse_content_range_size("bytes 0-9/*"), None);
+        assert_eq!(parse_content_range_size("garbage"), None);
+    }
+
+    #[test]
+    fn test_range_header() {
+        assert_eq!(range_header(10, 10), "bytes=10-19");
+    }
+
+    /// This requires minio running with the setup from the `docker-compose.yml` file
+    #[tokio::test]
+    async fn test_http_cog_info_example_1() {
+        let cog =
+            acog::open("/vsicurl/http://localhost:9000/public/example_1_cog_3857_nocompress.tif")
+                .await
+                .unwrap();
+        assert_eq!(cog.width(), 370);
+        assert_eq!(cog.height(), 276);
+        assert_eq!(cog.nbands(), 4);
+    }
+}
@@ -0,0 +1,98 @@
+use crate::errors::Error;
+use reqwest::Client;
+use std::sync::{Mutex, OnceLock};
+use std::time::Duration;
+
+/// Configuration of the HTTP client shared by all remote sources
+#[derive(Debug, Clone)]
+pub struct HttpClientConfig {
+    /// Maximum number of idle (keep-alive) connections kept per host
+    pub pool_max_idle_per_host: usize,
+    /// Idle connections are closed after this long. None keeps them forever
+    pub pool_idle_timeout: Option<Duration>,
+    /// Disables Nagle's algorithm, which otherwise delays the small range requests we send
+    pub tcp_nodelay: bool,
+    /// Use HTTP/2 without negotiation (prior knowledge). Only enable this if the endpoint
+    /// supports it, requests will fail otherwise
+    pub http2: bool,
+}
+
+impl Default for HttpClientConfig {
+    fn default() -> Self {
+        HttpClientConfig {
+            pool_max_idle_per_host: 32,
+            pool_idle_timeout: Some(Duration::from_secs(90)),
+            tcp_nodelay: true,
+            http2: false,
+        }
+    }
+}
+
+impl HttpClientConfig {
+    fn build_client(&self) -> Result<Client, Error> {
+        let mut builder = Client::builder()
+            .pool_max_idle_per_host(self.pool_max_idle_per_host)
+            .pool_idle_timeout(self.pool_idle_timeout)
+            .tcp_nodelay(self.tcp_nodelay);
+        if self.http2 {
+            builder = builder.http2_prior_knowledge();
+        }
+        Ok(builder.build()?)
+    }
+}
+
+struct SharedClient {
+    config: HttpClientConfig,
+    // Lazily built on first use
+    client: Option<Client>,
+}
+
+fn shared_client() -> &'static Mutex<SharedClient> {
+    static SHARED_CLIENT: OnceLock<Mutex<SharedClient>> = OnceLock::new();
+    SHARED_CLIENT.get_or_init(|| {
+        Mutex::new(SharedClient {
+            config: HttpClientConfig::default(),
+            client: None,
+        })
+    })
+}
+
+/// Returns the process-wide HTTP client. `Client` is a handle on a connection pool, so all the
+/// sources using it share their keep-alive connections and opening a COG on an endpoint we
+/// already talked to doesn't pay for a new TCP/TLS handshake
+pub fn shared_http_client() -> Result<Client, Error> {
+    let mut shared = shared_client().lock().unwrap();
+    if shared.client.is_none() {
+        shared.client = Some(shared.config.build_client()?);
+    }
+    Ok(shared.client.clone().unwrap())
+}
+
+pub fn get_http_client_config() -> HttpClientConfig {
+    shared_client().lock().unwrap().config.clone()
+}
+
+/// Replaces the process-wide HTTP client with one using the given config. Sources that are
+/// already opened keep using the previous client
+pub fn set_http_client_config(config: HttpClientConfig) -> Result<(), Error> {
+    let client = config.build_client()?;
+    let mut shared = shared_client().lock().unwrap();
+    shared.config = config;
+    shared.client = Some(client);
+    Ok(())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::{get_http_client_config, set_http_client_config, shared_http_client};
+
+    #[test]
+    fn test_set_http_client_config() {
+        shared_http_client().unwrap();
+        let mut config = get_http_client_config();
+        config.pool_max_idle_per_host = 4;
+        set_http_client_config(config).unwrap();
+        assert_eq!(get_http_client_config().pool_max_idle_per_host, 4);
+        shared_http_client().unwrap();
+    }
+}
@@ -1,8 +1,9 @@
 use crate::errors::Error;
+use std::sync::atomic::{AtomicUsize, Ordering};
 
 #[derive(Default)]
 struct Stats {
-    read_counts: usize,
+    read_counts: AtomicUsize,
 }
 
 pub struct MemorySource {
@@ -19,14 +20,17 @@ impl MemorySource {
         }
     }
 
-    pub async fn read(&mut self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+    pub async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
         let end = std::cmp::min(self.buffer.len(), offset as usize + buf.len());
         buf[..(end - offset as usize)].copy_from_slice(&self.buffer[offset as usize..end as usize]);
-        self.stats.read_counts += 1;
+        self.stats.read_counts.fetch_add(1, Ordering::Relaxed);
         Ok(end - offset as usize)
     }
 
     pub fn get_stats(&self) -> String {
-        format!("read_counts={}", self.stats.read_counts)
+        format!(
+            "read_counts={}",
+            self.stats.read_counts.load(Ordering::Relaxed)
+        )
     }
 }
@@ -1,20 +1,39 @@
 use std::{fmt, io::ErrorKind};
 
 mod file;
+mod http;
+mod http_client;
 mod memory;
+mod mmap;
 mod s3;
+mod sigv4;
+#[cfg(all(feature = "io-uring", target_os = "linux"))]
+mod uring;
 
 pub use file::FileSource;
+use futures::stream::{self, BoxStream, StreamExt};
+pub use http::HttpSource;
+pub use http_client::{
+    get_http_client_config, set_http_client_config, shared_http_client, HttpClientConfig,
+};
 pub use memory::MemorySource;
+pub use mmap::MmapSource;
 pub use s3::S3Source;
-use std::collections::HashMap;
+use std::collections::{BTreeMap, HashMap};
+use std::sync::Mutex;
+#[cfg(all(feature = "io-uring", target_os = "linux"))]
+pub use uring::UringSource;
 
 use crate::errors::Error;
 use std::io;
 
 enum SourceKind {
     File(FileSource),
+    Http(HttpSource),
+    Mmap(MmapSource),
     S3(S3Source),
+    #[cfg(all(feature = "io-uring", target_os = "linux"))]
+    Uring(UringSource),
     #[allow(dead_code)] // This is used for testing
     Memory(MemorySource),
 }
@@ -23,7 +42,11 @@ impl fmt::Debug for SourceKind {
     fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
         match self {
             Self::File(_) => f.debug_tuple("File").finish(),
+            Self::Http(_) => f.debug_tuple("Http").finish(),
+            Self::Mmap(_) => f.debug_tuple("Mmap").finish(),
             Self::S3(_) => f.debug_tuple("S3").finish(),
+            #[cfg(all(feature = "io-uring", target_os = "linux"))]
+            Self::Uring(_) => f.debug_tuple("Uring").finish(),
             Self::Memory(_) => f.debug_tuple("Memory").finish(),
         }
     }
@@ -32,10 +55,14 @@ impl fmt::Debug for SourceKind {
 impl SourceKind {
     /// This tries to read the given buffer at the given offset. If EOF is reached, this will
     /// return Ok(n) where n < buf.len()
-    async fn read(&mut self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+    async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
         match self {
             SourceKind::File(s) => s.read(offset, buf).await,
+            SourceKind::Http(s) => s.read(offset, buf).await,
+            SourceKind::Mmap(s) => s.read(offset, buf).await,
             SourceKind::S3(s) => s.read(offset, buf).await,
+            #[cfg(all(feature = "io-uring", target_os = "linux"))]
+            SourceKind::Uring(s) => s.read(offset, buf).await,
             SourceKind::Memory(s) => s.read(offset, buf).await,
         }
     }
@@ -43,7 +70,7 @@ impl SourceKind {
     /// Reads exactly the given buffer from the given offset. This returns an Err(ErrorKind::UnexpectedEof)
     /// if Eof is reached while reading. If this returns Ok(), it is guaranteed the whole buffer has been read
     /// See https://docs.rs/tokio/latest/tokio/io/trait.AsyncReadExt.html#method.read_exact
-    pub async fn read_exact(&mut self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
+    pub async fn read_exact(&self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
         let bytes_count = self.read(offset, buf).await?;
         if bytes_count < buf.len() {
             Err(Error::IO(io::Error::from(ErrorKind::UnexpectedEof)))
@@ -55,15 +82,42 @@ impl SourceKind {
     pub fn get_stats(&self) -> String {
         match self {
             SourceKind::File(s) => s.get_stats(),
+            SourceKind::Http(s) => s.get_stats(),
+            SourceKind::Mmap(s) => s.get_stats(),
             SourceKind::S3(s) => s.get_stats(),
+            #[cfg(all(feature = "io-uring", target_os = "linux"))]
+            SourceKind::Uring(s) => s.get_stats(),
             SourceKind::Memory(s) => s.get_stats(),
         }
     }
 }
 
-const CHUNK_SIZE: usize = 16384; // 16 kB, like GDAL `CPL_VSIL_CURL_CHUNK_SIZE`
+pub const CHUNK_SIZE: usize = 16384; // 16 kB, like GDAL `CPL_VSIL_CURL_CHUNK_SIZE`
 
-const MAX_CACHED_CHUNKS: usize = 100;
+/// Default memory budget of the chunk cache of a source
+pub const DEFAULT_CHUNK_CACHE_MAX_BYTES: usize = 100 * CHUNK_SIZE;
+
+/// Default maximum number of direct reads a single request (e.g. reading an image part) keeps in
+/// flight at once. For S3 each of those is an HTTP range request, so this bounds the number of
+/// connections opened by one request
+pub const DEFAULT_MAX_CONCURRENT_READS: usize = 8;
+
+/// Default maximum gap (in bytes) between two direct reads for them to be merged into a single
+/// read. Reading a few unneeded bytes is cheaper than an additional HTTP request
+pub const DEFAULT_MAX_RANGE_GAP: u64 = 16384;
+
+/// Default number of bytes read in a single read at the start of a file when opening it, like
+/// GDAL's `GDAL_INGESTED_BYTES_AT_OPEN`. For a COG, this usually covers all of the IFDs
+pub const DEFAULT_INGESTED_BYTES_AT_OPEN: usize = 4 * CHUNK_SIZE;
+
+/// The ingested bytes at open, which can be overriden through the same `GDAL_INGESTED_BYTES_AT_OPEN`
+/// environment variable as GDAL
+fn ingested_bytes_at_open_from_env() -> usize {
+    std::env::var("GDAL_INGESTED_BYTES_AT_OPEN")
+        .ok()
+        .and_then(|v| v.parse().ok())
+        .unwrap_or(DEFAULT_INGESTED_BYTES_AT_OPEN)
+}
 
 /// Sources support chunked reading mode with caching and direct reading.
 /// - Chunked reading with caching should be uses to tread the header + IFDs
@@ -85,9 +139,28 @@ const MAX_CACHED_CHUNKS: usize = 100;
 struct ChunkCache {
     // Maps a chunk index to the chunk data. Note that the last chunk will still have CHUNK_SIZE
     // data, but data past `source_len` will be filled with 0
-    chunks_cache: HashMap<u32, [u8; CHUNK_SIZE]>,
+    chunks_cache: HashMap<u32, CachedChunk>,
+    // Maps `CachedChunk::last_used` to the chunk index, so the first entry is the least recently
+    // used chunk
+    recency: BTreeMap<u64, u32>,
+    // Incremented on each access, this gives us the recency ordering for LRU eviction
+    use_counter: u64,
+    max_bytes: usize,
     // Once we have reached EOF, we store the source len here
     source_len: Option<u64>,
+    stats: ChunkCacheStats,
+}
+
+struct CachedChunk {
+    data: Box<[u8; CHUNK_SIZE]>,
+    last_used: u64,
+}
+
+#[derive(Debug, Default)]
+struct ChunkCacheStats {
+    hits: usize,
+    misses: usize,
+    evictions: usize,
 }
 
 impl fmt::Debug for ChunkCache {
@@ -99,72 +172,193 @@ impl fmt::Debug for ChunkCache {
 }
 
 impl ChunkCache {
-    pub fn new() -> Self {
+    pub fn new(max_bytes: usize) -> Self {
         ChunkCache {
             chunks_cache: HashMap::new(),
+            recency: BTreeMap::new(),
+            use_counter: 0,
+            max_bytes,
             source_len: None,
+            stats: Default::default(),
         }
     }
 
-    async fn read_chunk(
-        &mut self,
-        source_kind: &mut SourceKind,
-        chunk_index: u32,
-    ) -> Result<&[u8; CHUNK_SIZE], Error> {
-        if self.chunks_cache.len() >= MAX_CACHED_CHUNKS {
-            // Here, a LRU cache would probably be a better idea. For now we just evict randomly
-            // a page for simplicity's sake
-            let key = *self.chunks_cache.keys().next().unwrap();
-            self.chunks_cache.remove(&key);
+    /// Evicts least recently used chunks until there is room for `nchunks` more chunks within
+    /// `max_bytes`
+    fn evict(&mut self, nchunks: usize) {
+        while !self.chunks_cache.is_empty()
+            && (self.chunks_cache.len() + nchunks) * CHUNK_SIZE > self.max_bytes
+        {
+            let (_, chunk_index) = self.recency.pop_first().unwrap();
+            self.chunks_cache.remove(&chunk_index);
+            self.stats.evictions += 1;
         }
+    }
 
-        match self.chunks_cache.entry(chunk_index) {
-            std::collections::hash_map::Entry::Occupied(e) => Ok(e.into_mut()),
-            std::collections::hash_map::Entry::Vacant(e) => {
-                let mut chunk = [0u8; CHUNK_SIZE];
-                let read_count = source_kind
-                    .read(chunk_index as u64 * CHUNK_SIZE as u64, &mut chunk)
-                    .await?;
-                if read_count < chunk.len() {
-                    // If we read less than page size, it means we reached EOF. Note that tokio read_buf doc
-                    // say that it's possible that you get an EOF once and then could get more data from the file.
-                    // But I guess this only happen if the file is being written to while you read - which is not
-                    // something we want to handle. So we decide that the first EOF we get is the true EOF
-                    if let Some(source_len) = self.source_len {
-                        return Err(Error::SourceError(format!("Reached EOF a second time (previous source_len={}), now read_count={} at chunk_index={}", source_len, read_count, chunk_index)));
-                    } else {
-                        self.source_len =
-                            Some(chunk_index as u64 * CHUNK_SIZE as u64 + read_count as u64);
-                    }
-                }
-                return Ok(e.insert(chunk));
+    pub fn set_max_bytes(&mut self, max_bytes: usize) {
+        self.max_bytes = max_bytes;
+        self.evict(0);
+    }
+
+    /// If the given chunk is cached, copies `chunk[chunk_from..chunk_from + out.len()]` to `out`
+    /// and returns true
+    fn read_cached(&mut self, chunk_index: u32, chunk_from: usize, out: &mut [u8]) -> bool {
+        self.use_counter += 1;
+        match self.chunks_cache.get_mut(&chunk_index) {
+            Some(chunk) => {
+                self.stats.hits += 1;
+                self.recency.remove(&chunk.last_used);
+                chunk.last_used = self.use_counter;
+                self.recency.insert(self.use_counter, chunk_index);
+                out.copy_from_slice(&chunk.data[chunk_from..chunk_from + out.len()]);
+                true
+            }
+            None => {
+                self.stats.misses += 1;
+                false
             }
         }
     }
 
-    pub async fn read_exact(
+    /// Inserts a chunk that was just read from the source, `read_count` being what the read
+    /// returned
+    fn insert(
         &mut self,
-        source_kind: &mut SourceKind,
-        offset: u64,
-        buf: &mut [u8],
+        chunk_index: u32,
+        chunk: Box<[u8; CHUNK_SIZE]>,
+        read_count: usize,
     ) -> Result<(), Error> {
+        if read_count < CHUNK_SIZE {
+            // If we read less than page size, it means we reached EOF. Note that tokio read_buf doc
+            // say that it's possible that you get an EOF once and then could get more data from the file.
+            // But I guess this only happen if the file is being written to while you read - which is not
+            // something we want to handle. So we decide that the first EOF we get is the true EOF.
+            // Note that concurrent readers can both read the last chunk, so getting the same EOF
+            // again is fine
+            let source_len = chunk_index as u64 * CHUNK_SIZE as u64 + read_count as u64;
+            match self.source_len {
+                Some(previous_source_len) if previous_source_len != source_len => {
+                    return Err(Error::SourceError(format!("Reached EOF a second time (previous source_len={}), now read_count={} at chunk_index={}", previous_source_len, read_count, chunk_index)));
+                }
+                _ => self.source_len = Some(source_len),
+            }
+        }
+        if let Some(previous) = self.chunks_cache.remove(&chunk_index) {
+            // Another reader cached this chunk while we were reading it
+            self.recency.remove(&previous.last_used);
+        }
+        // Note that we always keep the chunk we just read, even if max_bytes < CHUNK_SIZE
+        self.evict(1);
+        self.use_counter += 1;
+        self.chunks_cache.insert(
+            chunk_index,
+            CachedChunk {
+                data: chunk,
+                last_used: self.use_counter,
+            },
+        );
+        self.recency.insert(self.use_counter, chunk_index);
+        Ok(())
+    }
+
+    pub fn get_stats(&self) -> String {
+        format!("chunks={}, {:?}", self.chunks_cache.len(), self.stats)
+    }
+}
+
+#[derive(Debug)]
+pub struct Source {
+    kind: SourceKind,
+    // The cache is only locked for short, synchronous operations and never while reading from
+    // `kind`, so concurrent reads don't wait on each other's I/O
+    cache: Mutex<ChunkCache>,
+    max_concurrent_reads: usize,
+    max_range_gap: u64,
+    ingested_bytes_at_open: usize,
+}
+
+impl Source {
+    fn new(kind: SourceKind) -> Source {
+        Source {
+            kind,
+            cache: Mutex::new(ChunkCache::new(DEFAULT_CHUNK_CACHE_MAX_BYTES)),
+            max_concurrent_reads: DEFAULT_MAX_CONCURRENT_READS,
+            max_range_gap: DEFAULT_MAX_RANGE_GAP,
+            ingested_bytes_at_open: ingested_bytes_at_open_from_env(),
+        }
+    }
+
+    pub async fn new_from_source_spec(source_spec: &str) -> Result<Source, Error> {
+        let source_string = source_spec.to_string();
+        if source_string.starts_with("/vsis3/") {
+            let source = Source::new(SourceKind::S3(
+                S3Source::new(source_string.strip_prefix("/vsis3/").unwrap()).await?,
+            ));
+            Ok(source)
+        } else if let Some(url) = source_string.strip_prefix("/vsicurl/") {
+            Ok(Source::new(SourceKind::Http(HttpSource::new(url).await?)))
+        } else if source_string.starts_with("http://") || source_string.starts_with("https://") {
+            Ok(Source::new(SourceKind::Http(
+                HttpSource::new(&source_string).await?,
+            )))
+        } else if let Some(filename) = source_string.strip_prefix("mmap://") {
+            // Memory-mapping is opt-in, since the process crashes if the file gets truncated
+            // while mapped (see `MmapSource`). Files which can't be mapped (e.g. empty files or
+            // special files) fall back to regular reads
+            let kind = match MmapSource::new(filename).await {
+                Ok(mmap_source) => SourceKind::Mmap(mmap_source),
+                Err(_) => SourceKind::File(FileSource::new(filename).await?),
+            };
+            Ok(Source::new(kind))
+        } else {
+            #[cfg(all(feature = "io-uring", target_os = "linux"))]
+            if let Ok(uring_source) = UringSource::new(&source_string).await {
+                return Ok(Source::new(SourceKind::Uring(uring_source)));
+            }
+            Ok(Source::new(SourceKind::File(
+                FileSource::new(&source_string).await?,
+            )))
+        }
+    }
+
+    // Read going through the chunk cache. Note that concurrent reads missing the same chunk will
+    // all read it from the source
+    pub async fn read_exact(&self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
         let start_chunk = (offset / CHUNK_SIZE as u64) as u32;
-        let end_chunk = ((offset + buf.len() as u64) / CHUNK_SIZE as u64) as u32;
+        // Note that if the read ends on a chunk boundary, we don't need the next chunk
+        let end_chunk = ((offset + buf.len() as u64).saturating_sub(1) / CHUNK_SIZE as u64) as u32;
         let mut buf_offset = 0;
         for chunk_id in start_chunk..end_chunk + 1 {
             let chunk_start_offset = chunk_id as i64 * CHUNK_SIZE as i64;
-            let chunk = self.read_chunk(source_kind, chunk_id).await?;
-
             let chunk_from = std::cmp::max(offset as i64 - chunk_start_offset, 0) as usize;
             let chunk_to = std::cmp::min(
                 (offset as i64 + buf.len() as i64) - chunk_start_offset,
                 CHUNK_SIZE as i64,
             ) as usize;
             let read_count = chunk_to - chunk_from;
-            buf[buf_offset..buf_offset + read_count].copy_from_slice(&chunk[chunk_from..chunk_to]);
+            let out = &mut buf[buf_offset..buf_offset + read_count];
+
+            let cached = self
+                .cache
+                .lock()
+                .unwrap()
+                .read_cached(chunk_id, chunk_from, out);
+            if !cached {
+                let mut chunk = Box::new([0u8; CHUNK_SIZE]);
+                let chunk_read_count = self
+                    .kind
+                    .read(chunk_start_offset as u64, &mut chunk[..])
+                    .await?;
+                out.copy_from_slice(&chunk[chunk_from..chunk_to]);
+                self.cache
+                    .lock()
+                    .unwrap()
+                    .insert(chunk_id, chunk, chunk_read_count)?;
+            }
 
             // Read past EOF check
-            if let Some(source_len) = self.source_len {
+            let source_len = self.cache.lock().unwrap().source_len;
+            if let Some(source_len) = source_len {
                 if offset + buf.len() as u64 > source_len {
                     return Err(Error::SourceError(format!(
                         "Trying to read past EOF (source_len={}), offset + buf.len() = {}",
@@ -177,55 +371,243 @@ impl ChunkCache {
         }
         Ok(())
     }
-}
 
-#[derive(Debug)]
-pub struct Source {
-    kind: SourceKind,
-    cache: ChunkCache,
-}
+    /// Reads `[offset, offset + nbytes)` in a single source read and stores it in the chunk cache,
+    /// so that subsequent `read_exact` in this range don't need to read from the source
+    ///
+    /// This is rounded to whole chunks and bounded by half of the chunk cache budget, so that a
+    /// prefetch doesn't evict the chunks that were read just before it. Chunks that are already
+    /// cached at either end of the range are not read again
+    pub async fn prefetch(&self, offset: u64, nbytes: usize) -> Result<(), Error> {
+        if nbytes == 0 {
+            return Ok(());
+        }
+        // Chunks in [start_chunk, end_chunk)
+        let (start_chunk, end_chunk) = {
+            let cache = self.cache.lock().unwrap();
+            let mut start_chunk = (offset / CHUNK_SIZE as u64) as u32;
+            let mut end_chunk = ((offset + nbytes as u64).div_ceil(CHUNK_SIZE as u64)) as u32;
+            if let Some(source_len) = cache.source_len {
+                end_chunk = std::cmp::min(end_chunk, source_len.div_ceil(CHUNK_SIZE as u64) as u32);
+            }
+            while start_chunk < end_chunk && cache.chunks_cache.contains_key(&start_chunk) {
+                start_chunk += 1;
+            }
+            let max_chunks = std::cmp::max(cache.max_bytes / CHUNK_SIZE / 2, 1) as u32;
+            end_chunk = std::cmp::min(end_chunk, start_chunk.saturating_add(max_chunks));
+            while end_chunk > start_chunk && cache.chunks_cache.contains_key(&(end_chunk - 1)) {
+                end_chunk -= 1;
+            }
+            (start_chunk, end_chunk)
+        };
+        if start_chunk >= end_chunk {
+            return Ok(());
+        }
+        let mut data = vec![0u8; (end_chunk - start_chunk) as usize * CHUNK_SIZE];
+        let read_count = self
+            .kind
+            .read(start_chunk as u64 * CHUNK_SIZE as u64, &mut data)
+            .await?;
+        let mut cache = self.cache.lock().unwrap();
+        for (i, chunk_data) in data.chunks_exact(CHUNK_SIZE).enumerate() {
+            let chunk_read_count =
+                std::cmp::min(read_count.saturating_sub(i * CHUNK_SIZE), CHUNK_SIZE);
+            let mut chunk = Box::new([0u8; CHUNK_SIZE]);
+            chunk.copy_from_slice(chunk_data);
+            cache.insert(start_chunk + i as u32, chunk, chunk_read_count)?;
+            if chunk_read_count < CHUNK_SIZE {
+                // We reached EOF, the following chunks are empty
+                break;
+            }
+        }
+        Ok(())
+    }
 
-impl Source {
-    fn new(kind: SourceKind) -> Source {
-        Source {
-            kind,
-            cache: ChunkCache::new(),
+    /// Prefetches all the given (start, end) byte ranges into the chunk cache. Ranges that are
+    /// close to each other (see `max_range_gap()`) are merged and the resulting reads are done
+    /// concurrently, up to `max_concurrent_reads()` at once
+    pub async fn prefetch_ranges(&self, mut ranges: Vec<(u64, u64)>) -> Result<(), Error> {
+        // Merging whole chunks ensures two reads never fill the same chunk
+        let chunk_size = CHUNK_SIZE as u64;
+        for range in ranges.iter_mut() {
+            *range = (
+                range.0 / chunk_size * chunk_size,
+                range.1.div_ceil(chunk_size) * chunk_size,
+            );
         }
+        ranges.sort();
+        let mut merged: Vec<(u64, u64)> = vec![];
+        for (start, end) in ranges {
+            match merged.last_mut() {
+                Some(last) if start <= last.1 + self.max_range_gap => {
+                    last.1 = std::cmp::max(last.1, end)
+                }
+                _ => merged.push((start, end)),
+            }
+        }
+        let mut reads = stream::iter(merged)
+            .map(|(start, end)| self.prefetch(start, (end - start) as usize))
+            .buffer_unordered(self.max_concurrent_reads);
+        while let Some(res) = reads.next().await {
+            res?;
+        }
+        Ok(())
     }
 
-    pub async fn new_from_source_spec(source_spec: &str) -> Result<Source, Error> {
-        let source_string = source_spec.to_string();
-        if source_string.starts_with("/vsis3/") {
-            let source = Source::new(SourceKind::S3(
-                S3Source::new(source_string.strip_prefix("/vsis3/").unwrap()).await?,
-            ));
-            Ok(source)
-        } else {
-            let source = Source::new(SourceKind::File(FileSource::new(&source_string).await?));
-            Ok(source)
+    // Read bypassing the chunk cache. This doesn't require `&mut`, so multiple direct reads can
+    // be in flight concurrently
+    pub async fn read_exact_direct(&self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
+        self.kind.read_exact(offset, buf).await
+    }
+
+    /// Reads the given (offset, nbytes) ranges bypassing the chunk cache. This returns a stream of
+    /// (index of the range in `ranges`, data), in completion order
+    ///
+    /// Up to `max_concurrent_reads()` reads are kept in flight, except for io_uring sources which
+    /// hand all the reads over to their ring at once
+    pub fn read_ranges_direct(
+        &self,
+        ranges: Vec<(u64, u64)>,
+    ) -> BoxStream<'_, Result<(usize, Vec<u8>), Error>> {
+        #[cfg(all(feature = "io-uring", target_os = "linux"))]
+        if let SourceKind::Uring(uring_source) = &self.kind {
+            let rx = uring_source.read_batch(ranges.clone());
+            return stream::unfold((rx, ranges.len()), |(mut rx, remaining)| async move {
+                match rx.recv().await {
+                    Some(Ok(res)) => Some((Ok(res), (rx, remaining.saturating_sub(1)))),
+                    // The batch stops after an error
+                    Some(Err(e)) => Some((Err(e), (rx, 0))),
+                    // Otherwise, the channel shouldn't be closed before all the ranges were sent
+                    None if remaining > 0 => Some((
+                        Err(Error::SourceError("io_uring batch was dropped".to_string())),
+                        (rx, 0),
+                    )),
+                    None => None,
+                }
+            })
+            .map(move |res| {
+                let (index, data) = res?;
+                if (data.len() as u64) < ranges[index].1 {
+                    return Err(Error::IO(io::Error::from(ErrorKind::UnexpectedEof)));
+                }
+                Ok((index, data))
+            })
+            .boxed();
         }
+        stream::iter(ranges.into_iter().enumerate())
+            .map(move |(index, (offset, nbytes))| async move {
+                let mut data = vec![0u8; nbytes as usize];
+                self.read_exact_direct(offset, &mut data).await?;
+                Ok((index, data))
+            })
+            .buffer_unordered(self.max_concurrent_reads)
+            .boxed()
     }
 
-    // Read going through the chunk cache
-    pub async fn read_exact(&mut self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
-        self.cache.read_exact(&mut self.kind, offset, buf).await
+    /// Maximum number of direct reads a single request should keep in flight at once
+    pub fn max_concurrent_reads(&self) -> usize {
+        self.max_concurrent_reads
     }
 
-    // Read bypassing the chunk cache
-    pub async fn read_exact_direct(&mut self, offset: u64, buf: &mut [u8]) -> Result<(), Error> {
-        self.kind.read_exact(offset, buf).await
+    /// Sets the maximum number of concurrent direct reads per request. A value of 1 makes reads
+    /// sequential
+    pub fn set_max_concurrent_reads(&mut self, max_concurrent_reads: usize) {
+        self.max_concurrent_reads = std::cmp::max(max_concurrent_reads, 1);
+    }
+
+    /// Maximum gap (in bytes) between two direct reads for them to be merged into one
+    pub fn max_range_gap(&self) -> u64 {
+        self.max_range_gap
+    }
+
+    /// Sets the maximum gap between two direct reads for them to be merged into one. With 0,
+    /// only exactly contiguous reads are merged
+    pub fn set_max_range_gap(&mut self, max_range_gap: u64) {
+        self.max_range_gap = max_range_gap;
+    }
+
+    /// Number of bytes read at once at the start of the file when opening it
+    pub fn ingested_bytes_at_open(&self) -> usize {
+        self.ingested_bytes_at_open
+    }
+
+    /// Sets the number of bytes read at once at the start of the file when opening it. Note that
+    /// this is also bounded by half of the chunk cache budget, see `prefetch`
+    pub fn set_ingested_bytes_at_open(&mut self, ingested_bytes_at_open: usize) {
+        self.ingested_bytes_at_open = ingested_bytes_at_open;
+    }
+
+    /// The length of the source, if it's known yet (i.e. once a read reached EOF)
+    pub fn known_len(&self) -> Option<u64> {
+        self.cache.lock().unwrap().source_len
+    }
+
+    /// Returns the (chunk index, data) of the chunks currently in the chunk cache, by increasing
+    /// index. The data of the last chunk of the source is truncated at EOF
+    pub fn cached_chunks(&self) -> Vec<(u32, Vec<u8>)> {
+        let cache = self.cache.lock().unwrap();
+        let mut chunks: Vec<(u32, Vec<u8>)> = cache
+            .chunks_cache
+            .iter()
+            .map(|(&chunk_index, chunk)| {
+                let mut len = CHUNK_SIZE;
+                if let Some(source_len) = cache.source_len {
+                    let chunk_start = chunk_index as u64 * CHUNK_SIZE as u64;
+                    len =
+                        std::cmp::min(len as u64, source_len.saturating_sub(chunk_start)) as usize;
+                }
+                (chunk_index, chunk.data[..len].to_vec())
+            })
+            .collect();
+        chunks.sort_by_key(|&(chunk_index, _)| chunk_index);
+        chunks
+    }
+
+    /// Adds chunks (e.g. obtained from `cached_chunks`) to the chunk cache, so they don't need to
+    /// be read from the source. A chunk shorter than CHUNK_SIZE marks the end of the source
+    pub fn insert_cached_chunks(&self, chunks: Vec<(u32, Vec<u8>)>) -> Result<(), Error> {
+        let mut cache = self.cache.lock().unwrap();
+        for (chunk_index, data) in chunks {
+            if data.len() > CHUNK_SIZE {
+                return Err(Error::OtherError(format!(
+                    "Chunk {} is too large: {} bytes",
+                    chunk_index,
+                    data.len()
+                )));
+            }
+            let mut chunk = Box::new([0u8; CHUNK_SIZE]);
+            chunk[..data.len()].copy_from_slice(&data);
+            cache.insert(chunk_index, chunk, data.len())?;
+        }
+        Ok(())
+    }
+
+    /// Sets the memory budget of the chunk cache used by `read_exact`. Least recently used chunks
+    /// are evicted when it's exceeded
+    pub fn set_chunk_cache_max_bytes(&self, max_bytes: usize) {
+        self.cache.lock().unwrap().set_max_bytes(max_bytes);
     }
 
     pub fn get_stats(&self) -> String {
-        self.kind.get_stats()
+        format!(
+            "{}, chunk_cache: {}",
+            self.kind.get_stats(),
+            self.cache.lock().unwrap().get_stats()
+        )
+    }
+
+    /// Rough estimate of the memory used by this source, which is mostly its chunk cache
+    pub fn estimate_nbytes(&self) -> usize {
+        self.cache.lock().unwrap().chunks_cache.len() * CHUNK_SIZE
     }
 }
 
 #[cfg(test)]
 mod tests {
-    use super::SourceKind;
+    use super::{SourceKind, CHUNK_SIZE};
     use crate::errors::Error;
-    use crate::sources::{MemorySource, Source};
+    use crate::sources::{FileSource, MemorySource, MmapSource, Source};
+    use futures::StreamExt;
     use std::fs::File;
     use std::io::Read;
 
@@ -240,7 +622,7 @@ mod tests {
             let mut data = vec![0u8; data_len];
             random_buf(&mut data);
 
-            let mut mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+            let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
 
             for offset in [0, 50, 1026] {
                 if offset > data_len {
@@ -261,7 +643,7 @@ mod tests {
         let mut data = vec![0u8; 2000];
         random_buf(&mut data);
 
-        let mut mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
 
         let offset = 513;
         let mut out = vec![0u8; data.len() - offset];
@@ -280,12 +662,39 @@ mod tests {
         assert!(stats.contains("read_counts=1"));
     }
 
+    #[tokio::test]
+    async fn test_cached_source_lru_eviction() {
+        let mut data = vec![0u8; 4 * CHUNK_SIZE];
+        random_buf(&mut data);
+
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        mem_source.set_chunk_cache_max_bytes(2 * CHUNK_SIZE);
+
+        let mut out = vec![0u8; 10];
+        for chunk_index in [0, 1, 0, 2] {
+            mem_source
+                .read_exact((chunk_index * CHUNK_SIZE) as u64, &mut out)
+                .await
+                .unwrap();
+        }
+        // Chunk 1 was the least recently used, so it should have been evicted and not chunk 0
+        mem_source.read_exact(0, &mut out).await.unwrap();
+        assert!(mem_source.get_stats().contains("read_counts=3"));
+        mem_source
+            .read_exact(CHUNK_SIZE as u64, &mut out)
+            .await
+            .unwrap();
+        let stats = mem_source.get_stats();
+        assert!(stats.contains("read_counts=4"));
+        assert!(stats.contains("chunks=2, ChunkCacheStats { hits: 2, misses: 4, evictions: 2 }"));
+    }
+
     #[tokio::test]
     async fn test_direct_source_cache_hits() {
         let mut data = vec![0u8; 2000];
         random_buf(&mut data);
 
-        let mut mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
 
         let offset = 513;
         let mut out = vec![0u8; data.len() - offset];
@@ -309,10 +718,217 @@ mod tests {
         let mut data = vec![0u8; 50];
         random_buf(&mut data);
 
-        let mut mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
 
         let mut out = vec![0u8; 10];
         let res = mem_source.read_exact(45, &mut out).await;
         assert!(matches!(res, Err(Error::SourceError(_msg))));
     }
+
+    #[tokio::test]
+    async fn test_prefetch() {
+        let mut data = vec![0u8; 3 * CHUNK_SIZE + 100];
+        random_buf(&mut data);
+
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        mem_source.prefetch(0, 2 * CHUNK_SIZE + 1).await.unwrap();
+        assert!(mem_source.get_stats().contains("read_counts=1"));
+
+        // All of the 3 prefetched chunks are cached
+        let mut out = vec![0u8; 3 * CHUNK_SIZE];
+        mem_source.read_exact(0, &mut out).await.unwrap();
+        assert_eq!(out, data[..3 * CHUNK_SIZE]);
+        assert!(mem_source.get_stats().contains("read_counts=1"));
+
+        // Already cached chunks are skipped and this reads up to EOF
+        mem_source.prefetch(0, 10 * CHUNK_SIZE).await.unwrap();
+        assert!(mem_source.get_stats().contains("read_counts=2"));
+        let mut out = vec![0u8; 100];
+        mem_source
+            .read_exact(3 * CHUNK_SIZE as u64, &mut out)
+            .await
+            .unwrap();
+        assert_eq!(out, data[3 * CHUNK_SIZE..]);
+        let stats = mem_source.get_stats();
+        assert!(stats.contains("read_counts=2"));
+        assert!(stats.contains("chunks=4"));
+
+        // Nothing left to read
+        mem_source.prefetch(0, 10 * CHUNK_SIZE).await.unwrap();
+        assert!(mem_source.get_stats().contains("read_counts=2"));
+    }
+
+    #[tokio::test]
+    async fn test_prefetch_ranges() {
+        let mut data = vec![0u8; 10 * CHUNK_SIZE];
+        random_buf(&mut data);
+        let c = CHUNK_SIZE as u64;
+
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        let ranges = vec![
+            (5 * c + 1, 5 * c + 2),
+            (10, 20),
+            (c + 5, c + 10),
+            (8 * c, 8 * c + 1),
+        ];
+        // The first two chunks are merged in one read
+        mem_source.prefetch_ranges(ranges.clone()).await.unwrap();
+        let stats = mem_source.get_stats();
+        assert!(stats.contains("read_counts=3"));
+        assert!(stats.contains("chunks=4"));
+
+        for (start, end) in ranges {
+            let mut out = vec![0u8; (end - start) as usize];
+            mem_source.read_exact(start, &mut out).await.unwrap();
+            assert_eq!(out, data[start as usize..end as usize]);
+        }
+        assert!(mem_source.get_stats().contains("read_counts=3"));
+    }
+
+    #[tokio::test]
+    async fn test_cached_chunks() {
+        let mut data = vec![0u8; 2 * CHUNK_SIZE + 100];
+        random_buf(&mut data);
+
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        mem_source.prefetch(0, data.len()).await.unwrap();
+        let chunks = mem_source.cached_chunks();
+        assert_eq!(
+            chunks
+                .iter()
+                .map(|(i, c)| (*i, c.len()))
+                .collect::<Vec<_>>(),
+            vec![(0, CHUNK_SIZE), (1, CHUNK_SIZE), (2, 100)]
+        );
+
+        let other_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        other_source.insert_cached_chunks(chunks).unwrap();
+        let mut out = vec![0u8; data.len()];
+        other_source.read_exact(0, &mut out).await.unwrap();
+        assert_eq!(out, data);
+        assert!(other_source.get_stats().contains("read_counts=0"));
+    }
+
+    #[tokio::test]
+    async fn test_mmap_source() {
+        let filename = "example_data/example_1_cog_nocompress.tif";
+        let file_source = FileSource::new(filename).await.unwrap();
+        let mmap_source = MmapSource::new(filename).await.unwrap();
+        let file_len = std::fs::metadata(filename).unwrap().len();
+
+        for (offset, len) in [(0, 100), (1000, 20000), (file_len - 10, 10)] {
+            let mut expected = vec![0u8; len];
+            file_source.read(offset, &mut expected).await.unwrap();
+            let mut out = vec![0u8; len];
+            assert_eq!(mmap_source.read(offset, &mut out).await.unwrap(), len);
+            assert_eq!(out, expected);
+        }
+        // Reads past EOF are partial
+        let mut out = vec![0u8; 20];
+        assert_eq!(mmap_source.read(file_len - 10, &mut out).await.unwrap(), 10);
+
+        // Local files are only mapped if asked for
+        let source = Source::new_from_source_spec(filename).await.unwrap();
+        assert!(!matches!(source.kind, SourceKind::Mmap(_)));
+        let source = Source::new_from_source_spec(&format!("mmap://{}", filename))
+            .await
+            .unwrap();
+        assert!(matches!(source.kind, SourceKind::Mmap(_)));
+    }
+
+    #[tokio::test]
+    async fn test_file_source_concurrent_reads() {
+        let filename = "example_data/example_1_cog_nocompress.tif";
+        let expected = std::fs::read(filename).unwrap();
+        let file_source = FileSource::new(filename).await.unwrap();
+
+        let offsets: Vec<usize> = (0..8).map(|i| i * expected.len() / 8).collect();
+        let reads = offsets.iter().map(|&offset| {
+            let file_source = &file_source;
+            async move {
+                let mut out = vec![0u8; 100];
+                let nread = file_source.read(offset as u64, &mut out).await.unwrap();
+                out.truncate(nread);
+                out
+            }
+        });
+        let results = futures::future::join_all(reads).await;
+        for (offset, out) in offsets.iter().zip(results) {
+            let end = std::cmp::min(offset + 100, expected.len());
+            assert_eq!(out, expected[*offset..end]);
+        }
+        assert!(file_source.get_stats().contains("read_counts=8"));
+    }
+
+    #[tokio::test]
+    async fn test_read_ranges_direct() {
+        let mut data = vec![0u8; 2000];
+        random_buf(&mut data);
+
+        let mem_source = Source::new(SourceKind::Memory(MemorySource::new(data.clone())));
+        let ranges = vec![(1500, 500), (0, 10), (100, 1000)];
+        let results: Vec<(usize, Vec<u8>)> = mem_source
+            .read_ranges_direct(ranges.clone())
+            .map(|res| res.unwrap())
+            .collect()
+            .await;
+        assert_eq!(results.len(), 3);
+        for (index, out) in results {
+            let (offset, nbytes) = ranges[index];
+            assert_eq!(out, data[offset as usize..(offset + nbytes) as usize]);
+        }
+
+        // Reading past EOF is an error
+        let mut reads = mem_source.read_ranges_direct(vec![(1900, 200)]);
+        assert!(reads.next().await.unwrap().is_err());
+    }
+
+    #[cfg(all(feature = "io-uring", target_os = "linux"))]
+    #[tokio::test]
+    async fn test_uring_source_read_batch() {
+        let filename = "example_data/example_1_cog_nocompress.tif";
+        let expected = std::fs::read(filename).unwrap();
+        let uring_source = super::UringSource::new(filename).await.unwrap();
+
+        let ranges: Vec<(u64, u64)> = (0..10).map(|i| (i * 1000, 100)).collect();
+        let mut rx = uring_source.read_batch(ranges.clone());
+        let mut count = 0;
+        while let Some(res) = rx.recv().await {
+            let (index, out) = res.unwrap();
+            let (offset, nbytes) = ranges[index];
+            assert_eq!(out, expected[offset as usize..(offset + nbytes) as usize]);
+            count += 1;
+        }
+        assert_eq!(count, ranges.len());
+    }
+
+    #[cfg(all(feature = "io-uring", target_os = "linux"))]
+    #[tokio::test]
+    async fn test_uring_source_concurrent_batches() {
+        let filename = "example_data/example_1_cog_nocompress.tif";
+        let expected = std::fs::read(filename).unwrap();
+        let uring_source = super::UringSource::new(filename).await.unwrap();
+
+        // More reads than fit in the ring, spread over several batches. One of them is dropped
+        // right away, which shouldn't affect the others
+        let ranges: Vec<(u64, u64)> = (0..1000).map(|i| (i * 10, 100)).collect();
+        let receivers: Vec<_> = (0..4)
+            .map(|_| uring_source.read_batch(ranges.clone()))
+            .collect();
+        drop(uring_source.read_batch(ranges.clone()));
+        for mut rx in receivers {
+            let mut count = 0;
+            while let Some(res) = rx.recv().await {
+                let (index, out) = res.unwrap();
+                let (offset, nbytes) = ranges[index];
+                assert_eq!(out, expected[offset as usize..(offset + nbytes) as usize]);
+                count += 1;
+            }
+            assert_eq!(count, ranges.len());
+        }
+
+        let mut buf = [0u8; 8];
+        assert_eq!(uring_source.read(4, &mut buf).await.unwrap(), 8);
+        assert_eq!(buf, expected[4..12]);
+    }
 }
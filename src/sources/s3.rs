@@ -1,74 +1,135 @@
-use std::cmp::min;
-
+use super::http::{range_header, read_range_response};
+use super::shared_http_client;
+use super::sigv4::{uri_encode_path, Credentials, Signer};
 use crate::errors::Error;
-use bytes::Buf;
 use reqwest::Client;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::time::SystemTime;
 
 #[derive(Debug, Default)]
 struct Stats {
-    requests_count: usize,
+    requests_count: AtomicUsize,
+}
+
+// GDAL's CPLTestBool
+fn parse_bool(value: &str) -> bool {
+    !matches!(value.to_uppercase().as_str(), "NO" | "FALSE" | "OFF" | "0")
+}
+
+/// Where and how to access S3. `from_env` reads this from the same environment variables as
+/// GDAL's /vsis3/, see https://gdal.org/user/virtual_file_systems.html#vsis3-aws-s3-files
+#[derive(Debug, Clone)]
+pub struct S3Config {
+    /// Host (and optionally port) of the S3 API, `AWS_S3_ENDPOINT`
+    pub endpoint: String,
+    /// Whether to use https, `AWS_HTTPS`
+    pub https: bool,
+    /// Whether to use virtual-hosted style (bucket.endpoint/key) rather than path style
+    /// (endpoint/bucket/key) addressing, `AWS_VIRTUAL_HOSTING`
+    pub virtual_hosting: bool,
+    /// `AWS_REGION`, or `AWS_DEFAULT_REGION`
+    pub region: String,
+    /// `AWS_ACCESS_KEY_ID`, `AWS_SECRET_ACCESS_KEY` and `AWS_SESSION_TOKEN`. None to do anonymous
+    /// requests, which is what `AWS_NO_SIGN_REQUEST=YES` does
+    pub credentials: Option<Credentials>,
+}
+
+impl S3Config {
+    pub fn from_env() -> Result<S3Config, Error> {
+        let var = |name: &str| std::env::var(name).ok();
+        let credentials = if var("AWS_NO_SIGN_REQUEST").is_some_and(|v| parse_bool(&v)) {
+            None
+        } else {
+            match (var("AWS_ACCESS_KEY_ID"), var("AWS_SECRET_ACCESS_KEY")) {
+                (Some(access_key_id), Some(secret_access_key)) => Some(Credentials {
+                    access_key_id,
+                    secret_access_key,
+                    session_token: var("AWS_SESSION_TOKEN"),
+                }),
+                _ => {
+                    return Err(Error::SourceError(
+                        "AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY must be set, or AWS_NO_SIGN_REQUEST=YES for anonymous access".to_string(),
+                    ))
+                }
+            }
+        };
+        Ok(S3Config {
+            endpoint: var("AWS_S3_ENDPOINT").unwrap_or("s3.amazonaws.com".to_string()),
+            https: var("AWS_HTTPS").map_or(true, |v| parse_bool(&v)),
+            virtual_hosting: var("AWS_VIRTUAL_HOSTING").map_or(true, |v| parse_bool(&v)),
+            region: var("AWS_REGION")
+                .or(var("AWS_DEFAULT_REGION"))
+                .unwrap_or("us-east-1".to_string()),
+            credentials,
+        })
+    }
 }
 
 pub struct S3Source {
     client: Client,
-    blob_name: String,
+    url: String,
+    host: String,
+    // URI-encoded path of the object, used for signing
+    canonical_uri: String,
+    signer: Option<Signer>,
     stats: Stats,
 }
 
 impl S3Source {
+    /// `filename` is bucket/key
     pub async fn new(filename: &str) -> Result<S3Source, Error> {
-        let client = Client::builder().build()?;
+        S3Source::new_with_config(filename, S3Config::from_env()?).await
+    }
+
+    pub async fn new_with_config(filename: &str, config: S3Config) -> Result<S3Source, Error> {
+        let (bucket, key) = filename
+            .split_once('/')
+            .ok_or_else(|| Error::SourceError(format!("Expected bucket/key, got {}", filename)))?;
+        let (host, canonical_uri) = if config.virtual_hosting {
+            (
+                format!("{}.{}", bucket, config.endpoint),
+                uri_encode_path(&format!("/{}", key)),
+            )
+        } else {
+            (
+                config.endpoint.clone(),
+                uri_encode_path(&format!("/{}/{}", bucket, key)),
+            )
+        };
+        let scheme = if config.https { "https" } else { "http" };
         Ok(S3Source {
-            client,
-            blob_name: filename.to_string(),
+            client: shared_http_client()?,
+            url: format!("{}://{}{}", scheme, host, canonical_uri),
+            host,
+            canonical_uri,
+            signer: config
+                .credentials
+                .map(|credentials| Signer::new(credentials, &config.region)),
             stats: Default::default(),
         })
     }
 
-    pub async fn read(&mut self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
-        // TODO: Take endpoint from env var
-        let url = format!("http://localhost:9000/{}", self.blob_name);
-        let mut do_request = |from: u64, to: u64| {
-            println!("Range request: {}-{}", from, to);
-            self.stats.requests_count += 1;
-            self.client
-                .get(url.clone())
-                .header("Range", format!("bytes={}-{}", from, to))
-                .send()
-        };
-        let mut body = {
-            let resp = do_request(offset, offset + buf.len() as u64).await?;
-            // We check for explicit 206 (Partial Content) because if the server would not support range requests,
-            // it could just reply with 200 and the whole document, but we don't support/want this
-            // here
-            if resp.status().as_u16() == 206 {
-                // Note that EOF is implicitely handled here because if we do a partial past EOF read, we'll
-                // still get a 206 but we can parse the "Content-Range" header to get file size. E.g.:
-                //
-                //    curl -v -r 558379745-558379761 http://localhost:9000/public/local/marina_cog_nocompress_3857.tif
-                //    ...
-                //    Content-Range: bytes 558379745-558379749/558379750
-                //
-                // But this is not necessary, because the server will just return the data until EOF, so
-                // our logic below transparently handles this
-                //
-                // Note that if you do a completely invalid read (both start and end past EOF), then most server
-                // will rightly response with a 416 - but that's a sign of a logic error here, so we do
-                // error out in this case
-                resp.bytes().await?
-            } else {
-                return Err(Error::OtherError(format!(
-                    "Request failed, code={}: {}",
-                    resp.status().as_u16(),
-                    resp.text().await?,
-                )));
+    pub async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+        if buf.is_empty() {
+            return Ok(0);
+        }
+        println!("Range request: {}-{}", offset, offset + buf.len() as u64);
+        self.stats.requests_count.fetch_add(1, Ordering::Relaxed);
+        let range = range_header(offset, buf.len());
+        let mut request = self.client.get(&self.url);
+        match &self.signer {
+            Some(signer) => {
+                for (name, value) in
+                    signer.sign_get(&self.host, &self.canonical_uri, &range, SystemTime::now())
+                {
+                    request = request.header(name, value);
+                }
             }
-        };
-
-        let body_len = body.remaining();
-        let len_to_copy = min(body_len, buf.len());
-        body.copy_to_slice(&mut buf[0..len_to_copy]);
-        Ok(len_to_copy)
+            None => request = request.header("Range", range),
+        }
+        let resp = request.send().await?;
+        let (read_count, _size) = read_range_response(resp, buf).await?;
+        Ok(read_count)
     }
 
     pub fn get_stats(&self) -> String {
@@ -82,7 +143,10 @@ mod tests {
 
     /// There is also a tiler "integration test" in `test_extract_tile_minio`
 
-    /// These tests require minio running with the setup from the `docker-compose.yml` file
+    /// These tests require minio running with the setup from the `docker-compose.yml` file, and the
+    /// following environment variables:
+    ///
+    ///     AWS_S3_ENDPOINT=localhost:9000 AWS_HTTPS=NO AWS_VIRTUAL_HOSTING=FALSE AWS_NO_SIGN_REQUEST=YES
     #[tokio::test]
     async fn test_minio_cog_info_example_1() {
         let cog = acog::open("/vsis3/public/example_1_cog_3857_nocompress.tif")
@@ -91,6 +155,6 @@ mod tests {
         assert_eq!(cog.width(), 370);
         assert_eq!(cog.height(), 276);
         assert_eq!(cog.nbands(), 4);
-        assert_eq!(cog.overviews.len(), 1);
+        assert_eq!(cog.overviews().await.unwrap().len(), 1);
     }
 }
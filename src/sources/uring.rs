@@ -0,0 +1,387 @@
+use crate::errors::Error;
+use io_uring::{opcode, squeue, types, IoUring};
+use std::collections::{HashMap, VecDeque};
+use std::io::{self, Write};
+use std::os::unix::io::AsRawFd;
+use std::os::unix::net::UnixStream;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{mpsc as std_mpsc, Arc, OnceLock};
+use tokio::sync::mpsc;
+
+// Maximum number of reads in flight in the ring
+const RING_ENTRIES: u32 = 256;
+// user_data of the read on the wake up socket. Reads of batches use (batch id << 32 | range index)
+const WAKER_USER_DATA: u64 = u64::MAX;
+
+#[derive(Default)]
+struct Stats {
+    read_counts: AtomicUsize,
+    submissions: AtomicUsize,
+}
+
+/// A local file source doing its reads through io_uring
+///
+/// All the `UringSource`s share a single ring, owned by a reaper thread. `read_batch` hands its
+/// ranges over to that thread, which keeps up to `RING_ENTRIES` reads in flight and sends each
+/// result as soon as its completion is reaped. So unlike `FileSource`, reads don't go through
+/// tokio's blocking pool and the reads of a batch are submitted together
+pub struct UringSource {
+    file: Arc<std::fs::File>,
+    stats: Arc<Stats>,
+    ring: &'static Ring,
+}
+
+type BatchSender = mpsc::UnboundedSender<Result<(usize, Vec<u8>), Error>>;
+
+/// Receives the results of a `read_batch` as (index of the range, data) in completion order
+pub type BatchReceiver = mpsc::UnboundedReceiver<Result<(usize, Vec<u8>), Error>>;
+
+impl UringSource {
+    pub async fn new(filename: &str) -> Result<UringSource, Error> {
+        let ring = shared_ring()?;
+        let file = tokio::fs::File::open(filename).await?.into_std().await;
+        Ok(UringSource {
+            file: Arc::new(file),
+            stats: Default::default(),
+            ring,
+        })
+    }
+
+    /// Reads the given (offset, nbytes) ranges. The returned data is shorter than nbytes if EOF
+    /// was reached
+    ///
+    /// Each range is sent through the returned channel as soon as its read completes. Dropping
+    /// the receiver stops the batch
+    pub fn read_batch(&self, ranges: Vec<(u64, u64)>) -> BatchReceiver {
+        let (tx, rx) = mpsc::unbounded_channel();
+        self.ring.submit(BatchRequest {
+            file: self.file.clone(),
+            ranges,
+            stats: self.stats.clone(),
+            tx,
+        });
+        rx
+    }
+
+    pub async fn read(&self, offset: u64, buf: &mut [u8]) -> Result<usize, Error> {
+        let mut rx = self.read_batch(vec![(offset, buf.len() as u64)]);
+        match rx.recv().await {
+            Some(Ok((_, data))) => {
+                buf[..data.len()].copy_from_slice(&data);
+                Ok(data.len())
+            }
+            Some(Err(e)) => Err(e),
+            None => Err(Error::SourceError("io_uring read was dropped".to_string())),
+        }
+    }
+
+    pub fn get_stats(&self) -> String {
+        format!(
+            "read_counts={}, submissions={}",
+            self.stats.read_counts.load(Ordering::Relaxed),
+            self.stats.submissions.load(Ordering::Relaxed)
+        )
+    }
+}
+
+struct BatchRequest {
+    file: Arc<std::fs::File>,
+    ranges: Vec<(u64, u64)>,
+    stats: Arc<Stats>,
+    tx: BatchSender,
+}
+
+/// Handle to the reaper thread, which owns the ring
+struct Ring {
+    requests: std_mpsc::Sender<BatchRequest>,
+    // Writing to this wakes the reaper thread up, since it has a read on the other end in the ring
+    waker: UnixStream,
+}
+
+/// Returns the ring shared by all the `UringSource`s, starting it on first use
+fn shared_ring() -> Result<&'static Ring, Error> {
+    static RING: OnceLock<Result<Ring, String>> = OnceLock::new();
+    RING.get_or_init(|| Ring::start().map_err(|e| e.to_string()))
+        .as_ref()
+        .map_err(|e| Error::SourceError(format!("io_uring isn't available: {}", e)))
+}
+
+impl Ring {
+    fn start() -> io::Result<Ring> {
+        // This fails if io_uring isn't available, it could be disabled in the kernel or by seccomp
+        let ring = IoUring::new(RING_ENTRIES)?;
+        let (waker, wake_receiver) = UnixStream::pair()?;
+        waker.set_nonblocking(true)?;
+        let (requests, receiver) = std_mpsc::channel();
+        let reaper = Reaper {
+            ring,
+            requests: receiver,
+            wake_receiver,
+            wake_buf: vec![0u8; 64],
+            waker_armed: false,
+            batches: HashMap::new(),
+            next_batch_id: 0,
+            pending: VecDeque::new(),
+            in_flight: 0,
+        };
+        std::thread::Builder::new()
+            .name("acog-io-uring".to_string())
+            .spawn(move || reaper.run())?;
+        Ok(Ring { requests, waker })
+    }
+
+    fn submit(&self, request: BatchRequest) {
+        if let Err(std_mpsc::SendError(request)) = self.requests.send(request) {
+            let _ = request.tx.send(Err(Error::SourceError(
+                "io_uring reaper thread stopped".to_string(),
+            )));
+            return;
+        }
+        // WouldBlock means the socket is full of wake ups the reaper didn't consume yet. Other
+        // errors mean the reaper stopped, in which case it dropped the request (and its sender)
+        let _ = (&self.waker).write(&[1]);
+    }
+}
+
+struct Batch {
+    file: Arc<std::fs::File>,
+    ranges: Vec<(u64, u64)>,
+    stats: Arc<Stats>,
+    tx: BatchSender,
+    // The buffers are only ever moved out once their read is complete, so the kernel never writes
+    // to a buffer that moved
+    bufs: Vec<Vec<u8>>,
+    filled: Vec<usize>,
+    in_flight: usize,
+    remaining: usize,
+    // Set once a read failed or the receiver was dropped. The pending reads of a cancelled batch
+    // aren't submitted, and it's removed once its in flight reads are reaped
+    cancelled: bool,
+}
+
+struct Reaper {
+    ring: IoUring,
+    requests: std_mpsc::Receiver<BatchRequest>,
+    wake_receiver: UnixStream,
+    wake_buf: Vec<u8>,
+    waker_armed: bool,
+    batches: HashMap<u32, Batch>,
+    next_batch_id: u32,
+    // (batch id, range index) of the reads to submit. A range is submitted again after a short
+    // read
+    pending: VecDeque<(u32, usize)>,
+    // Number of entries pushed to the ring whose completion wasn't reaped yet, waker included
+    in_flight: usize,
+}
+
+impl Reaper {
+    fn run(mut self) {
+        if let Err(e) = self.run_loop() {
+            self.fail(e);
+        }
+    }
+
+    fn run_loop(&mut self) -> io::Result<()> {
+        loop {
+            if !self.waker_armed {
+                self.arm_waker()?;
+            }
+            self.receive_requests();
+            let submitted_stats = self.push_pending_reads()?;
+            match self.ring.submit_and_wait(1) {
+                Ok(_) => {
+                    for stats in submitted_stats {
+                        stats.submissions.fetch_add(1, Ordering::Relaxed);
+                    }
+                }
+                // Interrupted by a signal, or the completion queue is full: reap the completions
+                // and submit again
+                Err(e)
+                    if e.kind() == io::ErrorKind::Interrupted
+                        || e.raw_os_error() == Some(libc::EBUSY) => {}
+                Err(e) => return Err(e),
+            }
+            self.reap_completions()?;
+        }
+    }
+
+    /// Fails all the batches after an error of the ring itself, which stops the reaper
+    fn fail(mut self, err: io::Error) {
+        let error = || Error::SourceError(format!("io_uring error: {}", err));
+        while let Ok(request) = self.requests.try_recv() {
+            let _ = request.tx.send(Err(error()));
+        }
+        for (_, batch) in self.batches.drain() {
+            let _ = batch.tx.send(Err(error()));
+            // The in flight reads can't be reaped anymore, so their buffers are leaked rather
+            // than freed while the kernel could still write to them
+            if batch.in_flight > 0 {
+                std::mem::forget(batch.bufs);
+            }
+        }
+        if self.waker_armed {
+            std::mem::forget(self.wake_buf);
+        }
+    }
+
+    /// Pushes an entry to the submission queue, submitting the queued entries first if it's full.
+    /// The number of entries in flight is capped to the size of the queue, so that shouldn't
+    /// happen
+    ///
+    /// Safety: the buffer of the entry must stay valid until its completion is reaped
+    unsafe fn push(&mut self, entry: &squeue::Entry) -> io::Result<()> {
+        if self.ring.submission().push(entry).is_err() {
+            self.ring.submit()?;
+            self.ring
+                .submission()
+                .push(entry)
+                .map_err(|_| io::Error::other("io_uring submission queue is full"))?;
+        }
+        self.in_flight += 1;
+        Ok(())
+    }
+
+    fn arm_waker(&mut self) -> io::Result<()> {
+        let entry = opcode::Read::new(
+            types::Fd(self.wake_receiver.as_raw_fd()),
+            self.wake_buf.as_mut_ptr(),
+            self.wake_buf.len() as u32,
+        )
+        .build()
+        .user_data(WAKER_USER_DATA);
+        // Safety: wake_buf is only freed once this read is reaped, or leaked
+        unsafe { self.push(&entry)? };
+        self.waker_armed = true;
+        Ok(())
+    }
+
+    fn receive_requests(&mut self) {
+        while let Ok(request) = self.requests.try_recv() {
+            let batch_id = self.next_batch_id;
+            self.next_batch_id = self.next_batch_id.wrapping_add(1);
+            self.pending
+                .extend((0..request.ranges.len()).map(|index| (batch_id, index)));
+            // An empty batch is done right away: dropping it closes its channel
+            if !request.ranges.is_empty() {
+                self.batches.insert(
+                    batch_id,
+                    Batch {
+                        bufs: request
+                            .ranges
+                            .iter()
+                            .map(|&(_, nbytes)| vec![0u8; nbytes as usize])
+                            .collect(),
+                        filled: vec![0; request.ranges.len()],
+                        in_flight: 0,
+                        remaining: request.ranges.len(),
+                        cancelled: false,
+                        file: request.file,
+                        ranges: request.ranges,
+                        stats: request.stats,
+                        tx: request.tx,
+                    },
+                );
+            }
+        }
+    }
+
+    /// Pushes pending reads until the ring is full. Returns the stats of the sources that had
+    /// reads pushed
+    fn push_pending_reads(&mut self) -> io::Result<Vec<Arc<Stats>>> {
+        let mut pushed_stats: Vec<Arc<Stats>> = vec![];
+        while self.in_flight < RING_ENTRIES as usize {
+            let Some((batch_id, index)) = self.pending.pop_front() else {
+                break;
+            };
+            let Some(batch) = self.batches.get_mut(&batch_id) else {
+                continue;
+            };
+            if batch.cancelled || batch.tx.is_closed() {
+                batch.cancelled = true;
+                if batch.in_flight == 0 {
+                    self.batches.remove(&batch_id);
+                }
+                continue;
+            }
+            let buf = &mut batch.bufs[index][batch.filled[index]..];
+            let entry = opcode::Read::new(
+                types::Fd(batch.file.as_raw_fd()),
+                buf.as_mut_ptr(),
+                buf.len().min(u32::MAX as usize) as u32,
+            )
+            .offset(batch.ranges[index].0 + batch.filled[index] as u64)
+            .build()
+            .user_data(((batch_id as u64) << 32) | index as u64);
+            batch.in_flight += 1;
+            if !pushed_stats.iter().any(|s| Arc::ptr_eq(s, &batch.stats)) {
+                pushed_stats.push(batch.stats.clone());
+            }
+            // Safety: The buffer isn't moved nor freed until the completion of this read is
+            // reaped
+            unsafe { self.push(&entry)? };
+        }
+        Ok(pushed_stats)
+    }
+
+    fn reap_completions(&mut self) -> io::Result<()> {
+        let completions: Vec<(u64, i32)> = self
+            .ring
+            .completion()
+            .map(|cqe| (cqe.user_data(), cqe.result()))
+            .collect();
+        for (user_data, result) in completions {
+            self.in_flight -= 1;
+            if user_data == WAKER_USER_DATA {
+                // The new requests are received on the next iteration, what was read doesn't
+                // matter
+                self.waker_armed = false;
+                if result < 0 {
+                    let err = io::Error::from_raw_os_error(-result);
+                    if err.kind() != io::ErrorKind::Interrupted {
+                        return Err(err);
+                    }
+                }
+                continue;
+            }
+            self.complete_read((user_data >> 32) as u32, user_data as u32 as usize, result);
+        }
+        Ok(())
+    }
+
+    fn complete_read(&mut self, batch_id: u32, index: usize, result: i32) {
+        // Batches are only removed once they have no read in flight
+        let Some(batch) = self.batches.get_mut(&batch_id) else {
+            return;
+        };
+        batch.in_flight -= 1;
+        batch.stats.read_counts.fetch_add(1, Ordering::Relaxed);
+        if batch.cancelled {
+            // Nothing to do, the receiver doesn't want more results
+        } else if result < 0 {
+            let err = io::Error::from_raw_os_error(-result);
+            if err.kind() == io::ErrorKind::Interrupted {
+                self.pending.push_back((batch_id, index));
+            } else {
+                let _ = batch.tx.send(Err(err.into()));
+                batch.cancelled = true;
+            }
+        } else {
+            batch.filled[index] += result as usize;
+            if result == 0 || batch.filled[index] == batch.bufs[index].len() {
+                // Done, either because we read everything or reached EOF
+                let mut data = std::mem::take(&mut batch.bufs[index]);
+                data.truncate(batch.filled[index]);
+                batch.remaining -= 1;
+                if batch.tx.send(Ok((index, data))).is_err() {
+                    // The receiver is gone, no need to read the other ranges
+                    batch.cancelled = true;
+                }
+            } else {
+                self.pending.push_back((batch_id, index));
+            }
+        }
+        if batch.in_flight == 0 && (batch.cancelled || batch.remaining == 0) {
+            self.batches.remove(&batch_id);
+        }
+    }
+}
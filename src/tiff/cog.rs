@@ -1,22 +1,38 @@
+use std::collections::{BTreeSet, HashMap};
+
+use futures::stream::StreamExt;
+use tokio::sync::OnceCell;
+
 use super::compression::Compression;
 use super::geo_keys::GeoKeyDirectory;
 use super::georef::{Georeference, Geotransform};
-use super::ifd::{IFDTag, IFDValue, ImageFileDirectory, TIFFReader};
+use super::ghost::StructuralMetadata;
+use super::ifd::{IFDChain, IFDTag, IFDValue, ImageFileDirectory, LazyU64Array, TIFFReader};
 use crate::sources::Source;
 use crate::Error;
 
 /// Functionality specific to reading Cloud Optimized Geotiffs
 #[derive(Debug)]
 pub struct COG {
-    // overviews[0] is the full resolution image
-    pub overviews: Vec<Overview>,
-    #[allow(dead_code)]
-    mask_overviews: Vec<Overview>,
+    // overviews()[0]
+    full_resolution: Overview,
+    // When opened with `open_lazy`, those are only read on first use, see `COG::overviews`
+    other_overviews: OnceCell<OtherOverviews>,
+    remaining_ifds: IFDChain,
     pub geo_keys: GeoKeyDirectory,
     pub source: Source,
     pub georeference: Georeference,
 }
 
+/// The overviews of a COG other than the full resolution image
+#[derive(Debug)]
+struct OtherOverviews {
+    // By decreasing resolution
+    overviews: Vec<Overview>,
+    #[allow(dead_code)]
+    mask_overviews: Vec<Overview>,
+}
+
 #[derive(Debug)]
 pub struct Overview {
     pub width: u64,
@@ -27,6 +43,9 @@ pub struct Overview {
     pub ifd: ImageFileDirectory,
     pub is_full_resolution: bool,
     pub compression: Compression,
+    pub structural_metadata: Option<StructuralMetadata>,
+    // Created on first use, see `Overview::reader`
+    reader: OnceCell<OverviewDataReader>,
 }
 
 #[derive(Debug)]
@@ -36,16 +55,38 @@ pub struct OverviewDataReader {
     pub nbands: u64,
     tile_width: u64,
     tile_height: u64,
-    tile_offsets: Vec<u64>,
-    tile_bytes_counts: Vec<u64>,
+    // Those are only read from the source as tiles get read, so reading a few tiles of a large
+    // image doesn't require reading those whole arrays
+    tile_offsets: LazyU64Array,
+    tile_bytes_counts: LazyU64Array,
+    // Whether tile sizes are read from the GDAL block leaders instead of TileByteCounts
+    block_leaders: bool,
+    block_order_row_major: bool,
+    block_trailers: bool,
     compression: Compression,
 }
 
+/// Size of a GDAL block leader or trailer
+const BLOCK_LEADER_NBYTES: u64 = 4;
+
+/// Where to find a tile in the source
+#[derive(Debug, Clone, Copy)]
+struct TileLocation {
+    // Offset of the tile data
+    offset: u64,
+    // None if the size is to be read from the block leader
+    nbytes: Option<u64>,
+    // The (offset, nbytes) to read to get the tile, which includes the block leader and trailer
+    // when the size is read from the leader
+    read_range: (u64, u64),
+}
+
 impl Overview {
     pub async fn from_ifd(
         ifd: ImageFileDirectory,
-        source: &mut Source,
+        source: &Source,
         is_mask: bool,
+        structural_metadata: Option<StructuralMetadata>,
     ) -> Result<Overview, Error> {
         // Check planar configuration is contiguous pixels
         match ifd
@@ -130,36 +171,48 @@ impl Overview {
             ifd,
             is_full_resolution,
             compression,
+            structural_metadata,
+            reader: OnceCell::new(),
         })
     }
 
-    pub async fn make_reader(&self, source: &mut Source) -> Result<OverviewDataReader, Error> {
+    /// The reader of this overview, which is created on first use and then shared by all reads.
+    /// The parts of TileOffsets/TileByteCounts it decoded are kept, so subsequent reads don't
+    /// need to read them again. `source` must be the source this overview was read from
+    pub async fn reader(&self, source: &Source) -> Result<&OverviewDataReader, Error> {
+        self.reader
+            .get_or_try_init(|| self.make_reader(source))
+            .await
+    }
+
+    /// Rough estimate of the memory used by this overview
+    pub fn estimate_nbytes(&self) -> usize {
+        self.ifd.estimate_nbytes() + self.reader.get().map_or(0, |r| r.estimate_nbytes())
+    }
+
+    /// Creates a new reader for this overview. Prefer `reader`, which reuses the same reader
+    pub async fn make_reader(&self, source: &Source) -> Result<OverviewDataReader, Error> {
+        let metadata = self.structural_metadata.unwrap_or_default();
         // Note that as per the COG spec, those two arrays are likely *not* stored compactly next
-        // to the header, so this will cause additional reads to the source
-        let tile_offsets = self
-            .ifd
-            .get_vec_u64_tag_value(source, IFDTag::TileOffsets)
-            .await?
-            .iter()
-            // TODO: Read directly as u64
-            .map(|v| *v as u64)
-            .collect();
-        let tile_bytes_counts = self
-            .ifd
-            .get_vec_u64_tag_value(source, IFDTag::TileByteCounts)
-            .await?
-            .iter()
-            // TODO: Read directly as u64
-            .map(|v| *v as u64)
-            .collect();
+        // to the header, so reading them can cause additional reads to the source. This is why
+        // they're only read as needed
         Ok(OverviewDataReader {
             width: self.width,
             height: self.height,
             nbands: self.nbands,
             tile_width: self.tile_width,
             tile_height: self.tile_height,
-            tile_offsets,
-            tile_bytes_counts,
+            tile_offsets: self
+                .ifd
+                .get_lazy_u64_tag_value(source, IFDTag::TileOffsets)
+                .await?,
+            tile_bytes_counts: self
+                .ifd
+                .get_lazy_u64_tag_value(source, IFDTag::TileByteCounts)
+                .await?,
+            block_leaders: metadata.block_leader_size_as_uint4,
+            block_order_row_major: metadata.block_order_row_major,
+            block_trailers: metadata.block_trailer_last_4_bytes_repeated,
             compression: self.compression,
         })
     }
@@ -167,7 +220,7 @@ impl Overview {
 
 // TODO: Use x/y instead ?
 // TODO: Use u32 here, u64 doesn't make sense for image dimensions
-#[derive(Debug)]
+#[derive(Debug, Clone)]
 pub struct ImageRect {
     pub i_from: u64,
     pub j_from: u64,
@@ -185,6 +238,14 @@ impl ImageRect {
 }
 
 impl OverviewDataReader {
+    /// Rough estimate of the memory used by this reader, which is mostly the parts of the tile
+    /// index it read
+    pub fn estimate_nbytes(&self) -> usize {
+        std::mem::size_of::<OverviewDataReader>()
+            + self.tile_offsets.estimate_nbytes()
+            + self.tile_bytes_counts.estimate_nbytes()
+    }
+
     // Pastes the given tile at the right location in the output array. Both tile_rect and out_rect
     // define the area covered by out/tile in the whole image
     // Assumes both out_data and tile_data are packed as HwC (PlanarConfiguration=1)
@@ -217,11 +278,10 @@ impl OverviewDataReader {
         }
     }
 
-    pub async fn read_image_part(
-        &self,
-        source: &mut Source,
-        rect: &ImageRect,
-    ) -> Result<Vec<u8>, Error> {
+    fn check_rect_bounds(&self, rect: &ImageRect) -> Result<(), Error> {
+        if rect.i_from > rect.i_to || rect.j_from > rect.j_to {
+            return Err(Error::OutOfBoundsRead(format!("invalid rect: {:?}", rect)));
+        }
         if rect.j_to > self.width {
             return Err(Error::OutOfBoundsRead(format!(
                 "rect.j_to out of bounds: {} > {}",
@@ -234,167 +294,625 @@ impl OverviewDataReader {
                 rect.i_to, self.height
             )));
         }
-        // TODO: May want the caller to pass the output vector instead of allocating
-        let nbytes = rect.width() * rect.height() * self.nbands;
-        let mut out_data = vec![0u8; nbytes as usize];
+        Ok(())
+    }
+
+    /// Returns the (tile_i, tile_j) of all the tiles covering the given rect
+    fn tiles_for_rect(&self, rect: &ImageRect) -> Vec<(u64, u64)> {
         let start_tile_j = rect.j_from / self.tile_width;
         let start_tile_i = rect.i_from / self.tile_height;
         let end_tile_j = (rect.j_to as f64 / self.tile_width as f64).ceil() as u64;
         let end_tile_i = (rect.i_to as f64 / self.tile_height as f64).ceil() as u64;
+        let mut tiles = vec![];
+        for tile_i in start_tile_i..end_tile_i {
+            for tile_j in start_tile_j..end_tile_j {
+                tiles.push((tile_i, tile_j));
+            }
+        }
+        tiles
+    }
 
+    fn tile_rect(&self, tile_i: u64, tile_j: u64) -> ImageRect {
+        ImageRect {
+            i_from: tile_i * self.tile_height,
+            j_from: tile_j * self.tile_width,
+            i_to: (tile_i + 1) * self.tile_height,
+            j_to: (tile_j + 1) * self.tile_width,
+        }
+    }
+
+    fn tile_index(&self, tile_i: u64, tile_j: u64) -> usize {
         let tiles_across = (self.width + self.tile_width - 1) / self.tile_width;
+        // As per the spec, tiles are ordered left to right and top to bottom
+        (tile_i * tiles_across + tile_j) as usize
+    }
 
-        // The below code assumes PlanarConfiguration=1 which is what GDAL does when creating COG, although
-        // COGs with other planar configurations are possible in theory
-        for tile_i in start_tile_i..end_tile_i {
-            for tile_j in start_tile_j..end_tile_j {
-                // As per the spec, tiles are ordered left to right and top to bottom
-                let tile_index = tile_i * tiles_across + tile_j;
-                let offset = self.tile_offsets[tile_index as usize];
-                // Read compressed buf
-                let mut tile_data = vec![0u8; self.tile_bytes_counts[tile_index as usize] as usize];
-                // We use read_direct here to read the whole tile at once
-                // TODO: Can this lead to too huge request depending on tile size ? Or does COG always
-                // guarantee reasonable tile size ?
-                source.read_exact_direct(offset, &mut tile_data).await?;
-
-                // Decompress
-                // TODO: Could reduce allocations by reusing the output vector across tiles (e.g. weezl support into_vec)
-                let tile_data = self.compression.decompress(tile_data)?;
-
-                let tile_rect = ImageRect {
-                    i_from: tile_i * self.tile_height,
-                    j_from: tile_j * self.tile_width,
-                    i_to: (tile_i + 1) * self.tile_height,
-                    j_to: (tile_j + 1) * self.tile_width,
-                };
-                let tile_data_expected_nbytes =
-                    tile_rect.width() * tile_rect.height() * self.nbands;
-                if tile_data.len() as u64 != tile_data_expected_nbytes {
-                    // If we fail here, two things could have happened:
-                    // - The file has partial tiles that are less than tile_size * tile_size. That
-                    //   valid as per the COG spec
-                    // - Something is wrong with the decompression. Either the tile_data is compressed
-                    //   but we didn't pick that up. Or the decompression didn't return enough data
-                    //   (note that for now we don't support compression - so that's a note for when we do)
-                    return Err(Error::InvalidData(format!(
-                        "tile_data shorter than expected. {} instead of {}. Is there some compression issue ?",
-                        tile_data.len(), tile_data_expected_nbytes
-                    )));
+    fn block_trailer_nbytes(&self) -> u64 {
+        if self.block_trailers {
+            BLOCK_LEADER_NBYTES
+        } else {
+            0
+        }
+    }
+
+    /// Looks up the location of the given tiles, only reading the parts of TileOffsets and
+    /// TileByteCounts covering those tiles
+    ///
+    /// With GDAL block leaders, the size of a tile is stored right before its data, so we don't
+    /// need TileByteCounts. As we don't know that size before reading the leader, the tile is read
+    /// up to the leader of the next tile, which is only possible if tiles are in row-major order.
+    /// Otherwise (or for the last tile), we fall back to TileByteCounts
+    async fn locate_tiles(
+        &self,
+        source: &Source,
+        tiles: &BTreeSet<(u64, u64)>,
+    ) -> Result<HashMap<(u64, u64), TileLocation>, Error> {
+        let indices: Vec<usize> = tiles
+            .iter()
+            .map(|&(tile_i, tile_j)| self.tile_index(tile_i, tile_j))
+            .collect();
+        let offsets = self.tile_offsets.get_many(source, &indices).await?;
+        let next_offsets: Vec<Option<u64>> = if self.block_leaders && self.block_order_row_major {
+            let last_index = self
+                .tile_offsets
+                .len()
+                .checked_sub(1)
+                .ok_or_else(|| Error::OtherError("TileOffsets is empty".to_string()))?;
+            let next_indices: Vec<usize> = indices
+                .iter()
+                .map(|&i| std::cmp::min(i + 1, last_index))
+                .collect();
+            let next_offsets = self.tile_offsets.get_many(source, &next_indices).await?;
+            indices
+                .iter()
+                .zip(next_offsets)
+                .map(|(&i, next_offset)| (i < last_index).then_some(next_offset))
+                .collect()
+        } else {
+            vec![None; indices.len()]
+        };
+
+        let mut locations = HashMap::new();
+        let mut unbounded = vec![];
+        for (k, &tile_coords) in tiles.iter().enumerate() {
+            let offset = offsets[k];
+            // Note that empty tiles have a 0 offset, so this also excludes those
+            match next_offsets[k] {
+                Some(next_offset) if next_offset > offset && offset >= BLOCK_LEADER_NBYTES => {
+                    locations.insert(
+                        tile_coords,
+                        TileLocation {
+                            offset,
+                            nbytes: None,
+                            read_range: (offset - BLOCK_LEADER_NBYTES, next_offset - offset),
+                        },
+                    );
                 }
-                self.paste_tile(&mut out_data, &tile_data, rect, &tile_rect);
+                _ => unbounded.push(k),
+            }
+        }
+        if !unbounded.is_empty() {
+            let unbounded_indices: Vec<usize> = unbounded.iter().map(|&k| indices[k]).collect();
+            let bytes_counts = self
+                .tile_bytes_counts
+                .get_many(source, &unbounded_indices)
+                .await?;
+            let tiles: Vec<&(u64, u64)> = tiles.iter().collect();
+            for (&k, nbytes) in unbounded.iter().zip(bytes_counts) {
+                locations.insert(
+                    *tiles[k],
+                    TileLocation {
+                        offset: offsets[k],
+                        nbytes: Some(nbytes),
+                        read_range: (offsets[k], nbytes),
+                    },
+                );
+            }
+        }
+        Ok(locations)
+    }
+
+    /// Returns the (start, nbytes) of the compressed data of the given tile within the data of a
+    /// range read
+    fn locate_tile_in_range(
+        &self,
+        range: &RangeRead,
+        range_data: &[u8],
+        tile: (u64, u64),
+        location: &TileLocation,
+    ) -> Result<(usize, usize), Error> {
+        let from = (location.offset - range.offset) as usize;
+        let nbytes = match location.nbytes {
+            Some(nbytes) => nbytes as usize,
+            None => {
+                let leader = &range_data[from - BLOCK_LEADER_NBYTES as usize..from];
+                u32::from_le_bytes(leader.try_into().unwrap()) as usize
             }
+        };
+        if from + nbytes > range_data.len() {
+            return Err(Error::InvalidData(format!(
+                "Tile {:?} of {} bytes extends past its range read",
+                tile, nbytes
+            )));
+        }
+        // The trailer repeats the last 4 bytes of the tile, which allows checking that the file
+        // wasn't modified since GDAL wrote it
+        let end = from + nbytes;
+        let trailer_nbytes = self.block_trailer_nbytes() as usize;
+        if location.nbytes.is_none()
+            && trailer_nbytes > 0
+            && nbytes >= trailer_nbytes
+            && end + trailer_nbytes <= range_data.len()
+            && range_data[end - trailer_nbytes..end] != range_data[end..end + trailer_nbytes]
+        {
+            return Err(Error::InvalidData(format!(
+                "Block trailer of tile {:?} doesn't match its data",
+                tile
+            )));
+        }
+        Ok((from, nbytes))
+    }
+
+    /// Decompresses the given tile data, checking that it has the expected size
+    fn decode_tile(&self, tile_i: u64, tile_j: u64, tile_data: Vec<u8>) -> Result<Vec<u8>, Error> {
+        // TODO: Could reduce allocations by reusing the output vector across tiles (e.g. weezl support into_vec)
+        let tile_data = self.compression.decompress(tile_data)?;
+
+        let tile_rect = self.tile_rect(tile_i, tile_j);
+        let tile_data_expected_nbytes = tile_rect.width() * tile_rect.height() * self.nbands;
+        if tile_data.len() as u64 != tile_data_expected_nbytes {
+            // If we fail here, two things could have happened:
+            // - The file has partial tiles that are less than tile_size * tile_size. That
+            //   valid as per the COG spec
+            // - Something is wrong with the decompression. Either the tile_data is compressed
+            //   but we didn't pick that up. Or the decompression didn't return enough data
+            //   (note that for now we don't support compression - so that's a note for when we do)
+            return Err(Error::InvalidData(format!(
+                "tile_data shorter than expected. {} instead of {}. Is there some compression issue ?",
+                tile_data.len(), tile_data_expected_nbytes
+            )));
+        }
+        Ok(tile_data)
+    }
+
+    /// Slices the data of a range covering one or more tiles back into tiles, which are
+    /// decompressed
+    fn decode_range(
+        &self,
+        range: &RangeRead,
+        range_data: Vec<u8>,
+        locations: &HashMap<(u64, u64), TileLocation>,
+    ) -> Result<Vec<((u64, u64), Vec<u8>)>, Error> {
+        if let [(tile_i, tile_j)] = range.tiles[..] {
+            // Common case of a range containing a single tile, no need to copy unless there is a
+            // block leader to strip
+            let (from, nbytes) = self.locate_tile_in_range(
+                range,
+                &range_data,
+                (tile_i, tile_j),
+                &locations[&(tile_i, tile_j)],
+            )?;
+            let mut tile_data = range_data;
+            tile_data.truncate(from + nbytes);
+            tile_data.drain(..from);
+            return Ok(vec![(
+                (tile_i, tile_j),
+                self.decode_tile(tile_i, tile_j, tile_data)?,
+            )]);
+        }
+        let mut tiles_data = vec![];
+        for &(tile_i, tile_j) in &range.tiles {
+            let (from, nbytes) = self.locate_tile_in_range(
+                range,
+                &range_data,
+                (tile_i, tile_j),
+                &locations[&(tile_i, tile_j)],
+            )?;
+            let tile_data = range_data[from..from + nbytes].to_vec();
+            tiles_data.push((
+                (tile_i, tile_j),
+                self.decode_tile(tile_i, tile_j, tile_data)?,
+            ));
+        }
+        Ok(tiles_data)
+    }
+
+    /// Reads the given tiles, returning a map of (tile_i, tile_j) => decompressed tile data
+    ///
+    /// Tiles stored next to each other in the source (GDAL writes the tiles of a row
+    /// contiguously) are coalesced into a single read, see `plan_range_reads`. The reads are
+    /// issued concurrently (see `Source::read_ranges_direct`) and each range is decompressed as
+    /// soon as it arrives, so decompression overlaps with the I/O of the other ranges
+    async fn read_tiles(
+        &self,
+        source: &Source,
+        tiles: &BTreeSet<(u64, u64)>,
+    ) -> Result<HashMap<(u64, u64), Vec<u8>>, Error> {
+        let locations = self.locate_tiles(source, tiles).await?;
+        let tile_ranges = locations
+            .iter()
+            .map(|(&tile_coords, location)| {
+                (tile_coords, location.read_range.0, location.read_range.1)
+            })
+            .collect();
+        let ranges = plan_range_reads(tile_ranges, source.max_range_gap(), MAX_RANGE_READ_NBYTES);
+        let mut reads =
+            source.read_ranges_direct(ranges.iter().map(|r| (r.offset, r.nbytes)).collect());
+        let mut tiles_data = HashMap::new();
+        while let Some(res) = reads.next().await {
+            let (index, range_data) = res?;
+            tiles_data.extend(self.decode_range(&ranges[index], range_data, &locations)?);
+        }
+        Ok(tiles_data)
+    }
+
+    /// Number of bytes required to hold the given rect, packed as HwC
+    pub fn image_part_nbytes(&self, rect: &ImageRect) -> usize {
+        (rect.width() * rect.height() * self.nbands) as usize
+    }
+
+    // Pastes all the tiles covering rect into `out_data`
+    fn paste_tiles(
+        &self,
+        out_data: &mut [u8],
+        rect: &ImageRect,
+        tiles_data: &HashMap<(u64, u64), Vec<u8>>,
+    ) {
+        // The below code assumes PlanarConfiguration=1 which is what GDAL does when creating COG, although
+        // COGs with other planar configurations are possible in theory
+        for (tile_i, tile_j) in self.tiles_for_rect(rect) {
+            let tile_rect = self.tile_rect(tile_i, tile_j);
+            self.paste_tile(out_data, &tiles_data[&(tile_i, tile_j)], rect, &tile_rect);
         }
+    }
+
+    pub async fn read_image_part(
+        &self,
+        source: &Source,
+        rect: &ImageRect,
+    ) -> Result<Vec<u8>, Error> {
+        self.check_rect_bounds(rect)?;
+        let mut out_data = vec![0u8; self.image_part_nbytes(rect)];
+        self.read_image_part_into(source, rect, &mut out_data)
+            .await?;
         Ok(out_data)
     }
+
+    /// Same as `read_image_part`, but writes into the given `out_data`, which must be exactly
+    /// `image_part_nbytes(rect)` long
+    pub async fn read_image_part_into(
+        &self,
+        source: &Source,
+        rect: &ImageRect,
+        out_data: &mut [u8],
+    ) -> Result<(), Error> {
+        self.check_rect_bounds(rect)?;
+        if out_data.len() != self.image_part_nbytes(rect) {
+            return Err(Error::OtherError(format!(
+                "Output buffer has wrong size. Got {}, expected {}",
+                out_data.len(),
+                self.image_part_nbytes(rect)
+            )));
+        }
+        let tiles: BTreeSet<(u64, u64)> = self.tiles_for_rect(rect).into_iter().collect();
+        let tiles_data = self.read_tiles(source, &tiles).await?;
+        self.paste_tiles(out_data, rect, &tiles_data);
+        Ok(())
+    }
+
+    /// Reads multiple image parts at once. Tiles that are shared between parts are read only once
+    pub async fn read_image_parts(
+        &self,
+        source: &Source,
+        rects: &[ImageRect],
+    ) -> Result<Vec<Vec<u8>>, Error> {
+        for rect in rects {
+            self.check_rect_bounds(rect)?;
+        }
+        let tiles: BTreeSet<(u64, u64)> = rects
+            .iter()
+            .flat_map(|rect| self.tiles_for_rect(rect))
+            .collect();
+        let tiles_data = self.read_tiles(source, &tiles).await?;
+
+        let mut parts = vec![];
+        for rect in rects {
+            let mut out_data = vec![0u8; self.image_part_nbytes(rect)];
+            self.paste_tiles(&mut out_data, rect, &tiles_data);
+            parts.push(out_data);
+        }
+        Ok(parts)
+    }
 }
 
-impl COG {
-    pub async fn open(source_spec: &str) -> Result<COG, Error> {
-        let tiff_reader = TIFFReader::open_from_source_spec(source_spec).await?;
-        // https://docs.ogc.org/is/21-026/21-026.html#_requirement_reduced_resolution_subfiles
-        let mut overviews: Vec<Overview> = vec![];
-        let mut mask_overviews: Vec<Overview> = vec![];
-        let ifds = tiff_reader.ifds;
-        let mut source = tiff_reader.source;
-        for ifd in ifds {
-            // Check photommetric interpretation to decide whether its the (RGB..) image or mask
-            match ifd
-                .get_tag_value(&mut source, IFDTag::PhotometricInterpretation)
-                .await?
-            {
-                IFDValue::Short(v) => match v[..] {
-                    // RGB
-                    [2] => {
-                        overviews.push(Overview::from_ifd(ifd, &mut source, false).await?);
-                    }
-                    // Mask
-                    [4] => {
-                        mask_overviews.push(Overview::from_ifd(ifd, &mut source, true).await?);
-                    }
-                    _ => {
-                        return Err(Error::UnsupportedTagValue(
-                            IFDTag::PhotometricInterpretation,
-                            format!("{:?}", v),
-                        ));
-                    }
-                },
-                value => {
-                    return Err(Error::TagHasWrongType(
+/// Ranges are not coalesced beyond this size, so a large image part is still split into several
+/// reads that can be issued concurrently
+const MAX_RANGE_READ_NBYTES: u64 = 8 * 1024 * 1024;
+
+/// A contiguous byte range of the source, covering one or more tiles
+#[derive(Debug, PartialEq)]
+struct RangeRead {
+    offset: u64,
+    nbytes: u64,
+    // The (tile_i, tile_j) of the tiles within this range
+    tiles: Vec<(u64, u64)>,
+}
+
+/// Given the ((tile_i, tile_j), offset, nbytes) of the tiles to read, plan the reads to do
+///
+/// Tiles are sorted by offset and merged into a single range read if the gap between them is at
+/// most `max_gap` bytes (similar to GDAL's `GDAL_HTTP_MERGE_CONSECUTIVE_RANGES`), as long as the
+/// merged range stays under `max_nbytes`. Reading a few unused bytes is much cheaper than an extra
+/// request, especially for HTTP sources
+fn plan_range_reads(
+    mut tile_ranges: Vec<((u64, u64), u64, u64)>,
+    max_gap: u64,
+    max_nbytes: u64,
+) -> Vec<RangeRead> {
+    tile_ranges.sort_by_key(|&(_, offset, _)| offset);
+    let mut ranges: Vec<RangeRead> = vec![];
+    for (tile_coords, offset, nbytes) in tile_ranges {
+        if let Some(last) = ranges.last_mut() {
+            let last_end = last.offset + last.nbytes;
+            let merged_nbytes = std::cmp::max(last_end, offset + nbytes) - last.offset;
+            if offset <= last_end + max_gap && merged_nbytes <= max_nbytes {
+                last.nbytes = merged_nbytes;
+                last.tiles.push(tile_coords);
+                continue;
+            }
+        }
+        ranges.push(RangeRead {
+            offset,
+            nbytes,
+            tiles: vec![tile_coords],
+        });
+    }
+    ranges
+}
+
+/// Splits the given IFDs into the image overviews and the mask overviews
+async fn overviews_from_ifds(
+    ifds: Vec<ImageFileDirectory>,
+    source: &Source,
+    structural_metadata: Option<StructuralMetadata>,
+) -> Result<(Vec<Overview>, Vec<Overview>), Error> {
+    // https://docs.ogc.org/is/21-026/21-026.html#_requirement_reduced_resolution_subfiles
+    let mut overviews: Vec<Overview> = vec![];
+    let mut mask_overviews: Vec<Overview> = vec![];
+    for ifd in ifds {
+        // Check photommetric interpretation to decide whether its the (RGB..) image or mask
+        match ifd
+            .get_tag_value(source, IFDTag::PhotometricInterpretation)
+            .await?
+        {
+            IFDValue::Short(v) => match v[..] {
+                // RGB
+                [2] => {
+                    overviews
+                        .push(Overview::from_ifd(ifd, source, false, structural_metadata).await?);
+                }
+                // Mask
+                [4] => {
+                    mask_overviews
+                        .push(Overview::from_ifd(ifd, source, true, structural_metadata).await?);
+                }
+                _ => {
+                    return Err(Error::UnsupportedTagValue(
                         IFDTag::PhotometricInterpretation,
-                        value,
-                    ))
+                        format!("{:?}", v),
+                    ));
                 }
+            },
+            value => {
+                return Err(Error::TagHasWrongType(
+                    IFDTag::PhotometricInterpretation,
+                    value,
+                ))
             }
         }
+    }
+    Ok((overviews, mask_overviews))
+}
+
+/// Checks the reduced resolution `overviews` that follow the full resolution image
+fn check_overviews(full_resolution: &Overview, overviews: &[Overview]) -> Result<(), Error> {
+    // COG requirement 3: IFD must be ordered by decreasing resolution
+    // We also check that
+    // - nbands are consistent
+    // - this isn't a multi image COG - which we don't support
+    let mut prev_width = full_resolution.width;
+    let mut prev_height = full_resolution.height;
+    for (i, overview) in overviews.iter().enumerate() {
+        // Index in `COG::overviews()`
+        let i = i + 1;
+        if overview.width >= prev_width {
+            return Err(Error::NotACOG(format!(
+                "Wrong overview ordering. Got overview i={} with width={} >= prev_width={}",
+                i, overview.width, prev_width
+            )));
+        }
+        if overview.height >= prev_height {
+            return Err(Error::NotACOG(format!(
+                "Wrong overview ordering. Got overview i={} with height={} >= prev_height={}",
+                i, overview.width, prev_height
+            )));
+        }
+        if overview.nbands != full_resolution.nbands {
+            return Err(Error::NotACOG(format!(
+                "Overview {} has inconsistent nbands={}, expected {}",
+                i, overview.nbands, full_resolution.nbands
+            )));
+        }
+        if overview.is_full_resolution {
+            return Err(Error::NotACOG(format!(
+                "Got a second full resolution overview (i={}). This library doesn't support multi image COGs",
+                i
+            )));
+        }
+        prev_width = overview.width;
+        prev_height = overview.height;
+    }
+    Ok(())
+}
+
+impl COG {
+    pub async fn open(source_spec: &str) -> Result<COG, Error> {
+        Self::open_from_source(Source::new_from_source_spec(source_spec).await?).await
+    }
+
+    pub async fn open_from_source(source: Source) -> Result<COG, Error> {
+        Self::open_from_source_impl(source, false).await
+    }
+
+    /// Same as `open`, but only the full resolution image IFD (and the georeference) is read
+    /// when opening. The other overviews are read the first time they're needed, which makes
+    /// opening faster if only the full resolution image or the metadata are used
+    pub async fn open_lazy(source_spec: &str) -> Result<COG, Error> {
+        Self::open_lazy_from_source(Source::new_from_source_spec(source_spec).await?).await
+    }
+
+    pub async fn open_lazy_from_source(source: Source) -> Result<COG, Error> {
+        Self::open_from_source_impl(source, true).await
+    }
+
+    async fn open_from_source_impl(source: Source, lazy: bool) -> Result<COG, Error> {
+        let max_ifds = if lazy { 1 } else { usize::MAX };
+        let tiff_reader = TIFFReader::open_from_source_with_max_ifds(source, max_ifds).await?;
+        let source = tiff_reader.source;
+        let structural_metadata = tiff_reader.structural_metadata;
+        let (mut overviews, mask_overviews) =
+            overviews_from_ifds(tiff_reader.ifds, &source, structural_metadata).await?;
 
         // COG requirement 3: first IFD must be full res image
-        if !overviews[0].is_full_resolution {
+        if overviews.is_empty() || !overviews[0].is_full_resolution {
             return Err(Error::NotACOG(
                 "overview 0 is not full resolution".to_string(),
             ));
         }
+        let full_resolution = overviews.remove(0);
+        let other_overviews = if tiff_reader.remaining_ifds.is_done() {
+            check_overviews(&full_resolution, &overviews)?;
+            OnceCell::new_with(Some(OtherOverviews {
+                overviews,
+                mask_overviews,
+            }))
+        } else {
+            OnceCell::new()
+        };
 
-        // COG requirement 3: IFD must be ordered by decreasing resolution
-        // We also check that
-        // - nbands are consistent
-        // - this isn't a multi image COG - which we don't support
-        {
-            let mut prev_width = overviews[0].width;
-            let mut prev_height = overviews[0].height;
-            for i in 1..overviews.len() {
-                if overviews[i].width >= prev_width {
-                    return Err(Error::NotACOG(format!(
-                        "Wrong overview ordering. Got overview i={} with width={} >= prev_width={}",
-                        i, overviews[i].width, prev_width
-                    )));
-                }
-                if overviews[i].height >= prev_height {
-                    return Err(Error::NotACOG(format!(
-                        "Wrong overview ordering. Got overview i={} with height={} >= prev_height={}",
-                        i, overviews[i].width, prev_height
-                    )));
-                }
-                if overviews[i].nbands != overviews[0].nbands {
-                    return Err(Error::NotACOG(format!(
-                        "Overview {} has inconsistent nbands={}, expected {}",
-                        i, overviews[i].nbands, overviews[0].nbands
-                    )));
-                }
-                if overviews[i].is_full_resolution {
-                    return Err(Error::NotACOG(format!(
-                        "Got a second full resolution overview (i={}). This library doesn't support multi image COGs",
-                        i
-                    )));
-                }
-                prev_width = overviews[i].width;
-                prev_height = overviews[i].height;
-            }
-        }
         // As per the COG spec, the overview contains the projection/geokey data
-        let geo_keys = GeoKeyDirectory::from_ifd(&overviews[0].ifd, &mut source).await?;
+        let geo_keys = GeoKeyDirectory::from_ifd(&full_resolution.ifd, &source).await?;
 
-        let georeference = Georeference::decode(&overviews[0].ifd, &mut source, &geo_keys).await?;
+        let georeference = Georeference::decode(&full_resolution.ifd, &source, &geo_keys).await?;
 
         Ok(COG {
-            overviews,
-            mask_overviews,
+            full_resolution,
+            other_overviews,
+            remaining_ifds: tiff_reader.remaining_ifds,
             source,
             geo_keys,
             georeference,
         })
     }
 
+    async fn other_overviews(&self) -> Result<&OtherOverviews, Error> {
+        self.other_overviews
+            .get_or_try_init(|| async {
+                let mut remaining_ifds = self.remaining_ifds;
+                let ifds = remaining_ifds.read_ifds(&self.source, usize::MAX).await?;
+                let (overviews, mask_overviews) = overviews_from_ifds(
+                    ifds,
+                    &self.source,
+                    self.full_resolution.structural_metadata,
+                )
+                .await?;
+                check_overviews(&self.full_resolution, &overviews)?;
+                Ok(OtherOverviews {
+                    overviews,
+                    mask_overviews,
+                })
+            })
+            .await
+    }
+
+    /// The overviews of this COG by decreasing resolution, `overviews()[0]` being the full
+    /// resolution image. If the COG was opened with `open_lazy`, the first call reads the IFDs
+    /// of the other overviews
+    pub async fn overviews(&self) -> Result<Vec<&Overview>, Error> {
+        let other_overviews = self.other_overviews().await?;
+        Ok(std::iter::once(&self.full_resolution)
+            .chain(other_overviews.overviews.iter())
+            .collect())
+    }
+
+    /// Same as `overviews`, but without reading any IFD: if the COG was opened with `open_lazy`
+    /// and the other overviews weren't needed yet, this only contains the full resolution image
+    pub fn loaded_overviews(&self) -> Vec<&Overview> {
+        std::iter::once(&self.full_resolution)
+            .chain(
+                self.other_overviews
+                    .get()
+                    .iter()
+                    .flat_map(|o| o.overviews.iter()),
+            )
+            .collect()
+    }
+
+    /// Returns `overviews()[overview_index]`. The full resolution image (`overview_index` = 0)
+    /// never requires reading IFDs
+    pub async fn overview(&self, overview_index: usize) -> Result<&Overview, Error> {
+        if overview_index == 0 {
+            return Ok(&self.full_resolution);
+        }
+        let overviews = &self.other_overviews().await?.overviews;
+        overviews.get(overview_index - 1).ok_or_else(|| {
+            Error::OutOfBoundsRead(format!(
+                "overview_index out of bounds: {} >= {}",
+                overview_index,
+                overviews.len() + 1
+            ))
+        })
+    }
+
     pub fn width(&self) -> u64 {
-        self.overviews[0].width
+        self.full_resolution.width
     }
 
     pub fn height(&self) -> u64 {
-        self.overviews[0].height
+        self.full_resolution.height
     }
 
     pub fn nbands(&self) -> u64 {
-        self.overviews[0].nbands
+        self.full_resolution.nbands
+    }
+
+    /// Reads the given rect (in pixels) of the given overview. The returned data is packed as HwC
+    pub async fn read_image_part(
+        &self,
+        overview_index: usize,
+        rect: &ImageRect,
+    ) -> Result<Vec<u8>, Error> {
+        let overview = self.overview(overview_index).await?;
+        overview
+            .reader(&self.source)
+            .await?
+            .read_image_part(&self.source, rect)
+            .await
+    }
+
+    /// Same as `read_image_part`, but writes into the given `out_data`
+    pub async fn read_image_part_into(
+        &self,
+        overview_index: usize,
+        rect: &ImageRect,
+        out_data: &mut [u8],
+    ) -> Result<(), Error> {
+        let overview = self.overview(overview_index).await?;
+        overview
+            .reader(&self.source)
+            .await?
+            .read_image_part_into(&self.source, rect, out_data)
+            .await
     }
 
     pub fn compute_georeference_for_overview(&self, overview: &Overview) -> Georeference {
@@ -415,26 +933,43 @@ impl COG {
     pub fn get_stats(&self) -> String {
         self.source.get_stats()
     }
+
+    /// Rough estimate of the memory used by this COG, e.g. to decide how many COGs can be kept opened
+    pub fn estimate_nbytes(&self) -> usize {
+        std::mem::size_of::<COG>()
+            + self.full_resolution.estimate_nbytes()
+            + self
+                .other_overviews
+                .get()
+                .iter()
+                .flat_map(|o| o.overviews.iter().chain(o.mask_overviews.iter()))
+                .map(|o| o.estimate_nbytes())
+                .sum::<usize>()
+            + self.source.estimate_nbytes()
+    }
 }
 
 #[cfg(test)]
 mod tests {
+    use super::{
+        plan_range_reads, Compression, LazyU64Array, OverviewDataReader, RangeRead, Source,
+    };
     use crate::ImageRect;
+    use std::collections::BTreeSet;
 
     #[tokio::test]
     async fn test_overview_reader_direct_reads() {
         // Test that reading from overview uses direct reads and not chunked once
-        let mut cog =
-            crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
-                .await
-                .unwrap();
-        let overview = &cog.overviews[1];
-        let ovr_reader = overview.make_reader(&mut cog.source).await.unwrap();
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+            .await
+            .unwrap();
+        let overview = cog.overview(1).await.unwrap();
+        let ovr_reader = overview.make_reader(&cog.source).await.unwrap();
         assert_eq!(overview.width, 185);
         assert_eq!(overview.height, 138);
         ovr_reader
             .read_image_part(
-                &mut cog.source,
+                &cog.source,
                 &ImageRect {
                     i_from: 0,
                     j_from: 0,
@@ -451,4 +986,262 @@ mod tests {
         assert!(stats.contains("read_counts=2"));
         // TODO: Could expose stats cache and check those as well
     }
+
+    #[tokio::test]
+    async fn test_open_lazy() {
+        let filename = "example_data/example_1_cog_3857_nocompress_blocksize_256.tif";
+        let cog = crate::COG::open(filename).await.unwrap();
+        let lazy_cog = crate::COG::open_lazy(filename).await.unwrap();
+        assert!(!lazy_cog.other_overviews.initialized());
+        assert_eq!(lazy_cog.width(), cog.width());
+        assert_eq!(lazy_cog.loaded_overviews().len(), 1);
+        assert_eq!(
+            format!("{:?}", lazy_cog.georeference),
+            format!("{:?}", cog.georeference)
+        );
+
+        // Reading from the full resolution image doesn't need the other overviews
+        let rect = ImageRect {
+            i_from: 0,
+            j_from: 0,
+            i_to: 10,
+            j_to: 10,
+        };
+        assert_eq!(
+            lazy_cog.read_image_part(0, &rect).await.unwrap(),
+            cog.read_image_part(0, &rect).await.unwrap()
+        );
+        assert!(!lazy_cog.other_overviews.initialized());
+
+        assert_eq!(
+            lazy_cog.read_image_part(1, &rect).await.unwrap(),
+            cog.read_image_part(1, &rect).await.unwrap()
+        );
+        let sizes = |overviews: Vec<&super::Overview>| -> Vec<(u64, u64)> {
+            overviews.iter().map(|o| (o.width, o.height)).collect()
+        };
+        assert_eq!(
+            sizes(lazy_cog.overviews().await.unwrap()),
+            sizes(cog.overviews().await.unwrap())
+        );
+        assert!(lazy_cog.overview(10).await.is_err());
+    }
+
+    #[tokio::test]
+    async fn test_overview_reader_is_shared() {
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+            .await
+            .unwrap();
+        let nbytes = cog.estimate_nbytes();
+        let rect = ImageRect {
+            i_from: 0,
+            j_from: 0,
+            i_to: 10,
+            j_to: 10,
+        };
+        cog.read_image_part(0, &rect).await.unwrap();
+        let overview = cog.overview(0).await.unwrap();
+        let reader = overview.reader(&cog.source).await.unwrap();
+        assert!(std::ptr::eq(
+            reader,
+            overview.reader(&cog.source).await.unwrap()
+        ));
+        // The reader and the part of the tile index it read are kept
+        assert!(cog.estimate_nbytes() > nbytes);
+    }
+
+    #[tokio::test]
+    async fn test_read_image_part_into() {
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+            .await
+            .unwrap();
+        let rect = ImageRect {
+            i_from: 10,
+            j_from: 20,
+            i_to: 130,
+            j_to: 180,
+        };
+        let expected = cog.read_image_part(1, &rect).await.unwrap();
+        let mut out = vec![0u8; (rect.width() * rect.height() * cog.nbands()) as usize];
+        cog.read_image_part_into(1, &rect, &mut out).await.unwrap();
+        assert_eq!(out, expected);
+
+        // Wrong output size and out of bounds overview should be rejected
+        let mut out = vec![0u8; 10];
+        assert!(cog.read_image_part_into(1, &rect, &mut out).await.is_err());
+        assert!(matches!(
+            cog.read_image_part(2, &rect).await,
+            Err(crate::Error::OutOfBoundsRead(_))
+        ));
+    }
+
+    #[tokio::test]
+    async fn test_read_image_part_concurrency() {
+        let mut cog =
+            crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+                .await
+                .unwrap();
+        // This covers the 4 tiles of the full resolution image
+        let rect = ImageRect {
+            i_from: 0,
+            j_from: 0,
+            i_to: cog.height(),
+            j_to: cog.width(),
+        };
+        cog.source.set_max_concurrent_reads(1);
+        let sequential = cog.read_image_part(0, &rect).await.unwrap();
+        cog.source.set_max_concurrent_reads(4);
+        let concurrent = cog.read_image_part(0, &rect).await.unwrap();
+        assert_eq!(sequential, concurrent);
+    }
+
+    #[tokio::test]
+    async fn test_read_tiles_with_block_leaders() {
+        // A 4x4 single band image with 2x2 tiles, laid out like GDAL does with block leaders and
+        // trailers
+        let image: Vec<u8> = (0..16).collect();
+        let mut file_data = vec![0u8; 16];
+        let mut tile_offsets = vec![];
+        for (tile_i, tile_j) in [(0, 0), (0, 1), (1, 0), (1, 1)] {
+            let tile: Vec<u8> = [(0, 0), (0, 1), (1, 0), (1, 1)]
+                .iter()
+                .map(|(i, j)| image[(tile_i * 2 + i) * 4 + tile_j * 2 + j])
+                .collect();
+            file_data.extend((tile.len() as u32).to_le_bytes());
+            tile_offsets.push(file_data.len() as u64);
+            file_data.extend(&tile);
+            file_data.extend(&tile[tile.len() - 4..]);
+        }
+        let filename = std::env::temp_dir().join(format!(
+            "acog_test_block_leaders_{}.bin",
+            std::process::id()
+        ));
+        std::fs::write(&filename, &file_data).unwrap();
+        let source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+
+        let first_tile_offset = tile_offsets[0] as usize;
+        let reader = OverviewDataReader {
+            width: 4,
+            height: 4,
+            nbands: 1,
+            tile_width: 2,
+            tile_height: 2,
+            tile_offsets: LazyU64Array::from_values(tile_offsets),
+            // Only the last tile's size should be taken from there, since the other tiles are
+            // followed by another tile
+            tile_bytes_counts: LazyU64Array::from_values(vec![0, 0, 0, 4]),
+            block_leaders: true,
+            block_order_row_major: true,
+            block_trailers: true,
+            compression: Compression::Raw,
+        };
+        let rect = ImageRect {
+            i_from: 0,
+            j_from: 0,
+            i_to: 4,
+            j_to: 4,
+        };
+        assert_eq!(reader.read_image_part(&source, &rect).await.unwrap(), image);
+
+        // A trailer not matching its tile is rejected
+        // The trailer of the first tile directly follows its 4 bytes of data
+        file_data[first_tile_offset + 4] ^= 0xFF;
+        std::fs::write(&filename, &file_data).unwrap();
+        let source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+        assert!(matches!(
+            reader.read_image_part(&source, &rect).await,
+            Err(crate::Error::InvalidData(_))
+        ));
+        std::fs::remove_file(&filename).unwrap();
+    }
+
+    #[tokio::test]
+    async fn test_locate_tiles_empty_tile_offsets() {
+        let source = Source::new_from_source_spec("example_data/example_1_cog_nocompress.tif")
+            .await
+            .unwrap();
+        let reader = OverviewDataReader {
+            width: 4,
+            height: 4,
+            nbands: 1,
+            tile_width: 2,
+            tile_height: 2,
+            tile_offsets: LazyU64Array::from_values(vec![]),
+            tile_bytes_counts: LazyU64Array::from_values(vec![]),
+            block_leaders: true,
+            block_order_row_major: true,
+            block_trailers: false,
+            compression: Compression::Raw,
+        };
+        assert!(matches!(
+            reader.locate_tiles(&source, &BTreeSet::new()).await,
+            Err(crate::Error::OtherError(_))
+        ));
+    }
+
+    #[tokio::test]
+    async fn test_gdal_block_leaders() {
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+            .await
+            .unwrap();
+        let overview = cog.overview(0).await.unwrap();
+        assert!(overview
+            .structural_metadata
+            .is_some_and(|m| m.block_leader_size_as_uint4));
+        let leaders_reader = overview.make_reader(&cog.source).await.unwrap();
+        assert!(leaders_reader.block_leaders);
+        let mut bytes_counts_reader = overview.make_reader(&cog.source).await.unwrap();
+        bytes_counts_reader.block_leaders = false;
+        let rect = ImageRect {
+            i_from: 0,
+            j_from: 0,
+            i_to: cog.height(),
+            j_to: cog.width(),
+        };
+        assert_eq!(
+            leaders_reader
+                .read_image_part(&cog.source, &rect)
+                .await
+                .unwrap(),
+            bytes_counts_reader
+                .read_image_part(&cog.source, &rect)
+                .await
+                .unwrap()
+        );
+    }
+
+    #[test]
+    fn test_plan_range_reads() {
+        let tile_ranges = vec![
+            ((0, 1), 1108, 100),
+            ((0, 0), 1000, 100),
+            // Gap of 8 bytes with the previous tile, like GDAL's leader/trailer
+            ((1, 0), 1216, 100),
+            ((1, 1), 5000, 100),
+        ];
+        let ranges = plan_range_reads(tile_ranges.clone(), 16, 1024);
+        assert_eq!(
+            ranges,
+            vec![
+                RangeRead {
+                    offset: 1000,
+                    nbytes: 316,
+                    tiles: vec![(0, 0), (0, 1), (1, 0)],
+                },
+                RangeRead {
+                    offset: 5000,
+                    nbytes: 100,
+                    tiles: vec![(1, 1)],
+                },
+            ]
+        );
+        // Gaps larger than max_gap aren't merged
+        assert_eq!(plan_range_reads(tile_ranges.clone(), 0, 1024).len(), 4);
+        // Merged ranges are bounded by max_nbytes
+        assert_eq!(plan_range_reads(tile_ranges, 16, 250).len(), 3);
+    }
 }
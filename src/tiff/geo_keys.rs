@@ -53,7 +53,7 @@ impl GeoKeyEntry {
     async fn decode(
         data: &[u16],
         ifd: &ImageFileDirectory,
-        source: &mut Source,
+        source: &Source,
     ) -> Result<GeoKeyEntry, Error> {
         if data.len() < 4 {
             return Err(Error::NotACOG(format!(
@@ -177,7 +177,7 @@ impl GeoKeyDirectory {
 
     pub async fn from_ifd(
         ifd: &ImageFileDirectory,
-        source: &mut Source,
+        source: &Source,
     ) -> Result<GeoKeyDirectory, Error> {
         let directory = ifd
             .get_vec_short_tag_value(source, IFDTag::GeoKeyDirectoryTag)
@@ -80,7 +80,7 @@ pub struct Georeference {
 impl Georeference {
     pub async fn decode(
         ifd: &ImageFileDirectory,
-        source: &mut Source,
+        source: &Source,
         geo_keys: &GeoKeyDirectory,
     ) -> Result<Georeference, Error> {
         let (crs, unit) = {
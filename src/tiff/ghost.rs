@@ -0,0 +1,124 @@
+/// Parsing of the GDAL structural metadata ("ghost area") of COGs
+///
+/// GDAL writes this right after the TIFF header of the COGs it creates, to describe how the file
+/// is laid out. See https://gdal.org/drivers/raster/cog.html#header-ghost-area
+use crate::errors::Error;
+use crate::sources::Source;
+
+const SIZE_PREFIX: &[u8] = b"GDAL_STRUCTURAL_METADATA_SIZE=";
+// The first line looks like "GDAL_STRUCTURAL_METADATA_SIZE=000140 bytes\n"
+const SIZE_LINE_LEN: usize = SIZE_PREFIX.len() + 13;
+
+#[derive(Debug, Clone, Copy, Default, PartialEq)]
+#[cfg_attr(feature = "json", derive(serde::Serialize))]
+pub struct StructuralMetadata {
+    /// LAYOUT=IFDS_BEFORE_DATA: all the IFDs and their values are stored before the image data
+    pub ifds_before_data: bool,
+    /// BLOCK_ORDER=ROW_MAJOR: the tiles of an overview are stored in row-major order
+    pub block_order_row_major: bool,
+    /// BLOCK_LEADER=SIZE_AS_UINT4: each tile is preceded by its size, as a little endian u32
+    pub block_leader_size_as_uint4: bool,
+    /// BLOCK_TRAILER=LAST_4_BYTES_REPEATED: each tile is followed by a copy of its last 4 bytes
+    pub block_trailer_last_4_bytes_repeated: bool,
+    /// MASK_INTERLEAVED_WITH_IMAGERY=YES: each mask tile directly follows its imagery tile
+    pub mask_interleaved_with_imagery: bool,
+}
+
+impl StructuralMetadata {
+    /// Parses the content of the ghost area (without the size line). This returns None if the
+    /// file was modified in a way that invalidates the layout (KNOWN_INCOMPATIBLE_EDITION=YES)
+    pub fn parse(content: &str) -> Option<StructuralMetadata> {
+        let mut metadata = StructuralMetadata::default();
+        for line in content.lines() {
+            match line.trim().split_once('=') {
+                Some(("LAYOUT", v)) => metadata.ifds_before_data = v == "IFDS_BEFORE_DATA",
+                Some(("BLOCK_ORDER", v)) => metadata.block_order_row_major = v == "ROW_MAJOR",
+                Some(("BLOCK_LEADER", v)) => {
+                    metadata.block_leader_size_as_uint4 = v == "SIZE_AS_UINT4"
+                }
+                Some(("BLOCK_TRAILER", v)) => {
+                    metadata.block_trailer_last_4_bytes_repeated = v == "LAST_4_BYTES_REPEATED"
+                }
+                Some(("MASK_INTERLEAVED_WITH_IMAGERY", v)) => {
+                    metadata.mask_interleaved_with_imagery = v == "YES"
+                }
+                Some(("KNOWN_INCOMPATIBLE_EDITION", "YES")) => return None,
+                _ => {}
+            }
+        }
+        Some(metadata)
+    }
+
+    /// Reads the ghost area, which directly follows the TIFF header (so `offset` is 8 for classic
+    /// TIFF and 16 for BigTIFF). This returns None if the file doesn't have one
+    pub async fn read(source: &Source, offset: u64) -> Result<Option<StructuralMetadata>, Error> {
+        // A (small) file without a ghost area could be shorter than the size line. The prefetch
+        // tells us the source length in that case, while other read errors are propagated
+        source.prefetch(offset, SIZE_LINE_LEN).await?;
+        if source
+            .known_len()
+            .is_some_and(|len| len < offset + SIZE_LINE_LEN as u64)
+        {
+            return Ok(None);
+        }
+        let mut size_line = [0u8; SIZE_LINE_LEN];
+        source.read_exact(offset, &mut size_line).await?;
+        if !size_line.starts_with(SIZE_PREFIX) {
+            return Ok(None);
+        }
+        let size: usize = std::str::from_utf8(&size_line[SIZE_PREFIX.len()..SIZE_PREFIX.len() + 6])
+            .ok()
+            .and_then(|v| v.parse().ok())
+            .ok_or_else(|| {
+                Error::InvalidData(format!(
+                    "Invalid GDAL structural metadata size line {:?}",
+                    String::from_utf8_lossy(&size_line)
+                ))
+            })?;
+        let mut content = vec![0u8; size];
+        source
+            .read_exact(offset + SIZE_LINE_LEN as u64, &mut content)
+            .await?;
+        Ok(Self::parse(&String::from_utf8_lossy(&content)))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::StructuralMetadata;
+    use crate::sources::Source;
+
+    #[tokio::test]
+    async fn test_read_short_file() {
+        let filename = std::env::temp_dir().join(format!(
+            "acog_test_ghost_read_short_file_{}.bin",
+            std::process::id()
+        ));
+        std::fs::write(&filename, b"II*\0\x08\0\0\0GDAL_STRUCTURAL").unwrap();
+        let source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+        assert_eq!(StructuralMetadata::read(&source, 8).await.unwrap(), None);
+        std::fs::remove_file(&filename).unwrap();
+    }
+
+    #[test]
+    fn test_parse() {
+        // As written by GDAL 3.8 for a COG with a mask
+        let content = "LAYOUT=IFDS_BEFORE_DATA\nBLOCK_ORDER=ROW_MAJOR\nBLOCK_LEADER=SIZE_AS_UINT4\nBLOCK_TRAILER=LAST_4_BYTES_REPEATED\nKNOWN_INCOMPATIBLE_EDITION=NO\nMASK_INTERLEAVED_WITH_IMAGERY=YES\n ";
+        assert_eq!(
+            StructuralMetadata::parse(content),
+            Some(StructuralMetadata {
+                ifds_before_data: true,
+                block_order_row_major: true,
+                block_leader_size_as_uint4: true,
+                block_trailer_last_4_bytes_repeated: true,
+                mask_interleaved_with_imagery: true,
+            })
+        );
+        assert_eq!(
+            StructuralMetadata::parse("LAYOUT=IFDS_BEFORE_DATA\nKNOWN_INCOMPATIBLE_EDITION=YES\n"),
+            None
+        );
+    }
+}
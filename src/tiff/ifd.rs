@@ -1,9 +1,13 @@
 /// Base functionality to read TIFF IFDs (ImageFileDirectory)
+use std::collections::{BTreeSet, HashMap};
 use std::mem::size_of;
+use std::sync::Mutex;
 
+use super::ghost::StructuralMetadata;
 use super::low_level::*;
 use crate::errors::Error;
 use crate::sources::Source;
+use tokio::sync::OnceCell;
 
 #[derive(Debug, Clone, Copy)]
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
@@ -62,7 +66,30 @@ pub enum IFDValue {
     Signed64(Vec<u64>),
 }
 
-#[derive(Debug, Clone, Copy, PartialEq)]
+impl IFDValue {
+    /// Rough estimate of the memory used by this value
+    fn estimate_nbytes(&self) -> usize {
+        size_of::<IFDValue>()
+            + match self {
+                IFDValue::Byte(v) => v.len(),
+                IFDValue::Ascii(v) => v.len(),
+                IFDValue::Short(v) => v.len() * size_of::<u16>(),
+                IFDValue::Long(v) => v.len() * size_of::<u32>(),
+                IFDValue::Rational(v) => v.len() * size_of::<(u32, u32)>(),
+                IFDValue::SignedByte(v) => v.len(),
+                IFDValue::UndefinedRawBytes(v) => v.len(),
+                IFDValue::SignedShort(v) => v.len() * size_of::<i16>(),
+                IFDValue::SignedLong(v) => v.len() * size_of::<i32>(),
+                IFDValue::SignedRational(v) => v.len() * size_of::<(i32, i32)>(),
+                IFDValue::Float(v) => v.len() * size_of::<f32>(),
+                IFDValue::Double(v) => v.len() * size_of::<f64>(),
+                IFDValue::Unsigned64(v) => v.len() * size_of::<u64>(),
+                IFDValue::Signed64(v) => v.len() * size_of::<u64>(),
+            }
+    }
+}
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
 pub enum IFDTag {
     PhotometricInterpretation,
@@ -165,6 +192,9 @@ struct IFDEntryMetadata {
     pub count: u64,
     pub offset_or_value: OffsetOrInlineValue,
     byte_order: ByteOrder,
+    // The decoded value, once it has been read through `cached_value`
+    #[cfg_attr(feature = "json", serde(skip))]
+    value: OnceCell<IFDValue>,
 }
 
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
@@ -181,26 +211,37 @@ enum RawEntryResult {
     InvalidCount(IFDTag, u64),
 }
 
-async fn read_u16(source: &mut Source, offset: u64, byte_order: ByteOrder) -> Result<u16, Error> {
+async fn read_u16(source: &Source, offset: u64, byte_order: ByteOrder) -> Result<u16, Error> {
     let mut buf = [0u8; 2];
     source.read_exact(offset, &mut buf).await?;
     Ok(decode_u16(buf, byte_order))
 }
 
-async fn read_u32(source: &mut Source, offset: u64, byte_order: ByteOrder) -> Result<u32, Error> {
+async fn read_u32(source: &Source, offset: u64, byte_order: ByteOrder) -> Result<u32, Error> {
     let mut buf = [0u8; 4];
     source.read_exact(offset, &mut buf).await?;
     Ok(decode_u32(buf, byte_order))
 }
 
-async fn read_u64(source: &mut Source, offset: u64, byte_order: ByteOrder) -> Result<u64, Error> {
+async fn read_u64(source: &Source, offset: u64, byte_order: ByteOrder) -> Result<u64, Error> {
     let mut buf = [0u8; 8];
     source.read_exact(offset, &mut buf).await?;
     Ok(decode_u64(buf, byte_order))
 }
 
 impl IFDEntryMetadata {
-    pub async fn read_value(&self, source: &mut Source) -> Result<IFDValue, Error> {
+    /// The (start, end) byte range of the value in the file, if it isn't inlined in the entry
+    fn value_byte_range(&self) -> Option<(u64, u64)> {
+        match self.offset_or_value {
+            OffsetOrInlineValue::Offset(offset) => Some((
+                offset,
+                offset + (type_size(self.field_type) as u64) * self.count,
+            )),
+            _ => None,
+        }
+    }
+
+    pub async fn read_value(&self, source: &Source) -> Result<IFDValue, Error> {
         let data = match self.offset_or_value {
             OffsetOrInlineValue::FourBytesInlineValue(arr) => {
                 arr[0..type_size(self.field_type) * self.count as usize].to_vec()
@@ -293,7 +334,43 @@ impl IFDEntryMetadata {
         Ok(value)
     }
 
-    pub async fn read(&self, source: &mut Source) -> Result<FullyDecodedIFDEntry, Error> {
+    /// Same as `read_value`, but the value is only read and decoded on the first call
+    pub async fn cached_value(&self, source: &Source) -> Result<&IFDValue, Error> {
+        self.value.get_or_try_init(|| self.read_value(source)).await
+    }
+
+    /// Returns this unsigned integers value as a `LazyU64Array`. Values stored out-of-line are
+    /// not read until they're accessed
+    pub async fn lazy_u64_value(&self, source: &Source) -> Result<LazyU64Array, Error> {
+        if !matches!(
+            self.field_type,
+            IFDType::Short | IFDType::Long | IFDType::Unsigned64
+        ) {
+            return Err(Error::TagHasWrongType(
+                self.tag,
+                self.read_value(source).await?,
+            ));
+        }
+        match self.offset_or_value {
+            OffsetOrInlineValue::Offset(offset) => Ok(LazyU64Array {
+                len: self.count as usize,
+                location: Some((offset, self.field_type, self.byte_order)),
+                pages: Mutex::new(HashMap::new()),
+            }),
+            _ => {
+                // Reading inline values doesn't need any I/O
+                let values = match self.read_value(source).await? {
+                    IFDValue::Short(values) => values.iter().map(|v| *v as u64).collect(),
+                    IFDValue::Long(values) => values.iter().map(|v| *v as u64).collect(),
+                    IFDValue::Unsigned64(values) => values,
+                    value => return Err(Error::TagHasWrongType(self.tag, value)),
+                };
+                Ok(LazyU64Array::from_values(values))
+            }
+        }
+    }
+
+    pub async fn read(&self, source: &Source) -> Result<FullyDecodedIFDEntry, Error> {
         Ok(FullyDecodedIFDEntry {
             tag: self.tag,
             value: self.read_value(source).await?,
@@ -301,72 +378,231 @@ impl IFDEntryMetadata {
     }
 }
 
+/// Number of elements in a page of a `LazyU64Array`
+const LAZY_ARRAY_PAGE_LEN: usize = 2048;
+
+/// An array of unsigned integers tag value which is read from the source by pages, as its
+/// elements are accessed
+///
+/// This is meant for TileOffsets and TileByteCounts: for large images those are several MB, while
+/// reading a few tiles only requires a few elements of them
+#[derive(Debug)]
+pub struct LazyU64Array {
+    len: usize,
+    // The (offset, type, byte order) of the values in the source. This is None if the values are
+    // already known, e.g. they're inlined in the IFD entry
+    location: Option<(u64, IFDType, ByteOrder)>,
+    // Maps a page index to its decoded values
+    pages: Mutex<HashMap<usize, Vec<u64>>>,
+}
+
+impl LazyU64Array {
+    /// An array whose values are all already known
+    pub fn from_values(values: Vec<u64>) -> LazyU64Array {
+        let pages = values
+            .chunks(LAZY_ARRAY_PAGE_LEN)
+            .map(|page| page.to_vec())
+            .enumerate()
+            .collect();
+        LazyU64Array {
+            len: values.len(),
+            location: None,
+            pages: Mutex::new(pages),
+        }
+    }
+
+    pub fn len(&self) -> usize {
+        self.len
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len == 0
+    }
+
+    /// Returns the elements at the given indices, reading the pages containing them if they
+    /// haven't been read yet. Consecutive pages are read at once
+    pub async fn get_many(&self, source: &Source, indices: &[usize]) -> Result<Vec<u64>, Error> {
+        if let Some(index) = indices.iter().find(|&&i| i >= self.len) {
+            return Err(Error::OutOfBoundsRead(format!(
+                "index {} >= len {}",
+                index, self.len
+            )));
+        }
+        let missing_pages: BTreeSet<usize> = {
+            let pages = self.pages.lock().unwrap();
+            indices
+                .iter()
+                .map(|i| i / LAZY_ARRAY_PAGE_LEN)
+                .filter(|page| !pages.contains_key(page))
+                .collect()
+        };
+        // (first, last) pages of the runs of consecutive missing pages
+        let mut runs: Vec<(usize, usize)> = vec![];
+        for page in missing_pages {
+            match runs.last_mut() {
+                Some((_, last)) if *last + 1 == page => *last = page,
+                _ => runs.push((page, page)),
+            }
+        }
+        for (first, last) in runs {
+            self.read_pages(source, first, last).await?;
+        }
+        let pages = self.pages.lock().unwrap();
+        Ok(indices
+            .iter()
+            .map(|i| pages[&(i / LAZY_ARRAY_PAGE_LEN)][i % LAZY_ARRAY_PAGE_LEN])
+            .collect())
+    }
+
+    pub async fn get(&self, source: &Source, index: usize) -> Result<u64, Error> {
+        Ok(self.get_many(source, &[index]).await?[0])
+    }
+
+    // Reads pages first..=last in a single read
+    async fn read_pages(&self, source: &Source, first: usize, last: usize) -> Result<(), Error> {
+        let (offset, field_type, byte_order) = self
+            .location
+            .expect("Values without a location are always fully decoded");
+        let size = type_size(field_type);
+        let from = first * LAZY_ARRAY_PAGE_LEN;
+        let to = std::cmp::min((last + 1) * LAZY_ARRAY_PAGE_LEN, self.len);
+        let mut data = vec![0u8; (to - from) * size];
+        // Note that this goes through the chunk cache, which likely already contains those if
+        // they're part of the header we ingested at open
+        source
+            .read_exact(offset + (from * size) as u64, &mut data)
+            .await?;
+        let mut pages = self.pages.lock().unwrap();
+        for (i, page_data) in data.chunks(LAZY_ARRAY_PAGE_LEN * size).enumerate() {
+            pages.insert(
+                first + i,
+                decode_uint_vec_to_u64(page_data, size, byte_order),
+            );
+        }
+        Ok(())
+    }
+
+    /// Rough estimate of the memory used by the pages read so far
+    pub fn estimate_nbytes(&self) -> usize {
+        size_of::<LazyU64Array>()
+            + self.pages.lock().unwrap().len() * LAZY_ARRAY_PAGE_LEN * size_of::<u64>()
+    }
+}
+
 #[derive(Debug)]
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
 pub struct ImageFileDirectory {
     entries: Vec<IFDEntryMetadata>,
+    // Index of each tag's entry in `entries`
+    #[cfg_attr(feature = "json", serde(skip))]
+    index: HashMap<IFDTag, usize>,
 }
 
 impl ImageFileDirectory {
-    pub async fn get_tag_value(&self, source: &mut Source, tag: IFDTag) -> Result<IFDValue, Error> {
-        let entry = self.entries.iter().find(|e| e.tag == tag);
-        match entry {
-            Some(e) => Ok(e.read_value(source).await?),
+    fn new(entries: Vec<IFDEntryMetadata>) -> ImageFileDirectory {
+        let mut index = HashMap::with_capacity(entries.len());
+        for (i, e) in entries.iter().enumerate() {
+            // If a tag is repeated (which is invalid), the first entry wins
+            index.entry(e.tag).or_insert(i);
+        }
+        ImageFileDirectory { entries, index }
+    }
+
+    /// Rough estimate of the memory used by this IFD
+    pub fn estimate_nbytes(&self) -> usize {
+        size_of::<ImageFileDirectory>()
+            + self.entries.len() * (size_of::<IFDEntryMetadata>() + size_of::<(IFDTag, usize)>())
+            + self
+                .entries
+                .iter()
+                .filter_map(|e| e.value.get())
+                .map(|v| v.estimate_nbytes())
+                .sum::<usize>()
+    }
+
+    fn get_entry(&self, tag: IFDTag) -> Result<&IFDEntryMetadata, Error> {
+        match self.index.get(&tag) {
+            Some(i) => Ok(&self.entries[*i]),
             None => Err(Error::RequiredTagNotFound(tag)),
         }
     }
 
-    pub async fn get_u64_tag_value(
+    /// Returns the decoded value of this tag. It is only read from the source on the first call
+    /// and kept in the IFD afterwards
+    pub async fn get_tag_value_ref(
+        &self,
+        source: &Source,
+        tag: IFDTag,
+    ) -> Result<&IFDValue, Error> {
+        self.get_entry(tag)?.cached_value(source).await
+    }
+
+    pub async fn get_tag_value(&self, source: &Source, tag: IFDTag) -> Result<IFDValue, Error> {
+        Ok(self.get_tag_value_ref(source, tag).await?.clone())
+    }
+
+    /// Same as `get_vec_u64_tag_value`, but the values are only read from the source as they're
+    /// accessed. See `LazyU64Array`
+    pub async fn get_lazy_u64_tag_value(
         &self,
-        source: &mut Source,
+        source: &Source,
         tag: IFDTag,
-    ) -> Result<usize, Error> {
-        Ok(self.get_vec_u64_tag_value(source, tag).await?[0])
+    ) -> Result<LazyU64Array, Error> {
+        self.get_entry(tag)?.lazy_u64_value(source).await
+    }
+
+    pub async fn get_u64_tag_value(&self, source: &Source, tag: IFDTag) -> Result<usize, Error> {
+        match self.get_tag_value_ref(source, tag).await? {
+            IFDValue::Short(values) => Ok(values[0] as usize),
+            IFDValue::Long(values) => Ok(values[0] as usize),
+            IFDValue::Unsigned64(values) => Ok(values[0] as usize),
+            value => Err(Error::TagHasWrongType(tag, value.clone())),
+        }
     }
 
     pub async fn get_vec_u64_tag_value(
         &self,
-        source: &mut Source,
+        source: &Source,
         tag: IFDTag,
     ) -> Result<Vec<usize>, Error> {
-        match self.get_tag_value(source, tag).await? {
+        match self.get_tag_value_ref(source, tag).await? {
             IFDValue::Short(values) => Ok(values.iter().map(|v| *v as usize).collect()),
             IFDValue::Long(values) => Ok(values.iter().map(|v| *v as usize).collect()),
             IFDValue::Unsigned64(values) => Ok(values.iter().map(|v| *v as usize).collect()),
-            value => Err(Error::TagHasWrongType(tag, value)),
+            value => Err(Error::TagHasWrongType(tag, value.clone())),
         }
     }
 
     pub async fn get_vec_short_tag_value(
         &self,
-        source: &mut Source,
+        source: &Source,
         tag: IFDTag,
     ) -> Result<Vec<u16>, Error> {
-        match self.get_tag_value(source, tag).await? {
-            IFDValue::Short(values) => Ok(values),
-            value => Err(Error::TagHasWrongType(tag, value)),
+        match self.get_tag_value_ref(source, tag).await? {
+            IFDValue::Short(values) => Ok(values.clone()),
+            value => Err(Error::TagHasWrongType(tag, value.clone())),
         }
     }
 
     pub async fn get_vec_double_tag_value(
         &self,
-        source: &mut Source,
+        source: &Source,
         tag: IFDTag,
     ) -> Result<Vec<f64>, Error> {
-        match self.get_tag_value(source, tag).await? {
-            IFDValue::Double(values) => Ok(values),
-            value => Err(Error::TagHasWrongType(tag, value)),
+        match self.get_tag_value_ref(source, tag).await? {
+            IFDValue::Double(values) => Ok(values.clone()),
+            value => Err(Error::TagHasWrongType(tag, value.clone())),
         }
     }
 
     pub async fn get_string_tag_value(
         &self,
-        source: &mut Source,
+        source: &Source,
         tag: IFDTag,
     ) -> Result<String, Error> {
-        match self.get_tag_value(source, tag).await? {
-            IFDValue::Ascii(value) => Ok(value),
-            value => Err(Error::TagHasWrongType(tag, value)),
+        match self.get_tag_value_ref(source, tag).await? {
+            IFDValue::Ascii(value) => Ok(value.clone()),
+            value => Err(Error::TagHasWrongType(tag, value.clone())),
         }
     }
 }
@@ -381,6 +617,7 @@ trait Variant {
 // is that all our data structures are tailored for BigTIFF (e.g. 64 bits offsets) and it's easy to
 // turn classic TIFF into that.
 // This enum contains a bunch of 'reading' function that will abstract this away
+#[derive(Debug, Clone, Copy)]
 enum TIFFVariant {
     // The TIFF standard: http://download.osgeo.org/geotiff/spec/tiff6.pdf
     Classic,
@@ -391,7 +628,7 @@ enum TIFFVariant {
 impl TIFFVariant {
     async fn read_initial_ifd_offset(
         &self,
-        source: &mut Source,
+        source: &Source,
         byte_order: ByteOrder,
     ) -> Result<u64, Error> {
         match self {
@@ -420,6 +657,14 @@ impl TIFFVariant {
         }
     }
 
+    /// Size of the TIFF header, which is directly followed by the GDAL ghost area if any
+    fn header_size(&self) -> u64 {
+        match self {
+            TIFFVariant::Classic => 8,
+            TIFFVariant::BigTiff => 16,
+        }
+    }
+
     fn ifd_offset_size(&self) -> usize {
         match self {
             TIFFVariant::Classic => 4,
@@ -429,7 +674,7 @@ impl TIFFVariant {
 
     async fn read_image_file_directory(
         &self,
-        source: &mut Source,
+        source: &Source,
         offset: u64,
         byte_order: ByteOrder,
     ) -> Result<(ImageFileDirectory, u64), Error> {
@@ -475,7 +720,7 @@ impl TIFFVariant {
                 byte_order,
             ),
         };
-        Ok((ImageFileDirectory { entries }, next_ifd_offset as u64))
+        Ok((ImageFileDirectory::new(entries), next_ifd_offset as u64))
     }
 
     async fn decode_ifd_entry_metadata(
@@ -545,16 +790,113 @@ impl TIFFVariant {
             count,
             offset_or_value,
             byte_order,
+            value: OnceCell::new(),
         }))
     }
 }
 
+/// Given the (start, end) byte ranges of the header (IFDs and their out-of-line values), returns
+/// the end of the part of the header which is contiguous with `[0, from)`, allowing for gaps of up
+/// to `max_gap` bytes between ranges
+fn contiguous_header_end(mut ranges: Vec<(u64, u64)>, from: u64, max_gap: u64) -> u64 {
+    ranges.sort();
+    let mut end = from;
+    for (range_start, range_end) in ranges {
+        if range_start > end + max_gap {
+            break;
+        }
+        end = std::cmp::max(end, range_end);
+    }
+    end
+}
+
+/// The position in the chain of IFDs of a file, from which the following IFDs can be read
+#[derive(Debug, Clone, Copy)]
+pub struct IFDChain {
+    variant: TIFFVariant,
+    byte_order: ByteOrder,
+    structural_metadata: Option<StructuralMetadata>,
+    // 0 once all the IFDs have been read
+    next_ifd_offset: u64,
+}
+
+impl IFDChain {
+    /// Whether all the IFDs have been read
+    pub fn is_done(&self) -> bool {
+        self.next_ifd_offset == 0
+    }
+
+    /// Reads the next (up to) `max_ifds` IFDs
+    pub async fn read_ifds(
+        &mut self,
+        source: &Source,
+        max_ifds: usize,
+    ) -> Result<Vec<ImageFileDirectory>, Error> {
+        // The IFDs and their out-of-line values, except for the tile offsets and byte counts which
+        // are read lazily (see `LazyU64Array`). Those can be much larger than the rest of the
+        // header, so they must not be prefetched when opening
+        let mut header_ranges = vec![];
+        let mut metadata_ranges = vec![];
+        let mut ifds = vec![];
+        // TODO: Infinite loop detection ?
+        while !self.is_done() && ifds.len() < max_ifds {
+            let ifd_offset = self.next_ifd_offset;
+            let (ifd, next_ifd_offset) = self
+                .variant
+                .read_image_file_directory(source, ifd_offset, self.byte_order)
+                .await?;
+            header_ranges.push((ifd_offset, ifd_offset));
+            for e in ifd.entries.iter() {
+                if let Some(range) = e.value_byte_range() {
+                    if !matches!(e.tag, IFDTag::TileOffsets | IFDTag::TileByteCounts) {
+                        header_ranges.push(range);
+                        metadata_ranges.push(range);
+                    }
+                }
+            }
+            self.next_ifd_offset = next_ifd_offset;
+            ifds.push(ifd);
+        }
+
+        // The out-of-line IFD values (e.g. the GeoTIFF tags of images with many overviews) can
+        // extend past what we ingested. In a COG, they directly follow the IFDs, so fetch the rest
+        // of the header in one more read instead of chunk by chunk as those values get read
+        let ingested_bytes = source.ingested_bytes_at_open() as u64;
+        let header_end = match self.structural_metadata {
+            // GDAL tells us that all of those are before the image data, so we know exactly
+            // where the header ends. This is only the case once we've read up to the last IFD
+            Some(StructuralMetadata {
+                ifds_before_data: true,
+                ..
+            }) if self.is_done() => header_ranges.iter().map(|&(_, end)| end).max().unwrap_or(0),
+            _ => contiguous_header_end(header_ranges, ingested_bytes, source.max_range_gap()),
+        };
+        if header_end > ingested_bytes {
+            source
+                .prefetch(ingested_bytes, (header_end - ingested_bytes) as usize)
+                .await?;
+        }
+        // Values which are elsewhere in the file (e.g. the GeoKeyDirectory params of a TIFF
+        // that was edited after its creation) are all fetched at once rather than one round trip
+        // each as they get decoded
+        let fetched_end = std::cmp::max(header_end, ingested_bytes);
+        metadata_ranges.retain(|&(_, end)| end > fetched_end);
+        source.prefetch_ranges(metadata_ranges).await?;
+        Ok(ifds)
+    }
+}
+
 #[derive(Debug)]
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
 pub struct TIFFReader {
     pub ifds: Vec<ImageFileDirectory>,
+    /// The GDAL structural metadata, for COGs created by GDAL
+    pub structural_metadata: Option<StructuralMetadata>,
     #[cfg_attr(feature = "json", serde(skip_serializing))]
     pub source: Source,
+    /// The IFDs that weren't read yet, see `open_from_source_with_max_ifds`
+    #[cfg_attr(feature = "json", serde(skip_serializing))]
+    pub remaining_ifds: IFDChain,
 }
 
 impl TIFFReader {
@@ -563,7 +905,21 @@ impl TIFFReader {
         let reader = Self::open_from_source(source).await?;
         Ok(reader)
     }
-    pub async fn open_from_source(mut source: Source) -> Result<TIFFReader, Error> {
+    pub async fn open_from_source(source: Source) -> Result<TIFFReader, Error> {
+        Self::open_from_source_with_max_ifds(source, usize::MAX).await
+    }
+
+    /// Same as `open_from_source`, but only reads the first `max_ifds` IFDs. The following ones
+    /// can be read later through `remaining_ifds`
+    pub async fn open_from_source_with_max_ifds(
+        source: Source,
+        max_ifds: usize,
+    ) -> Result<TIFFReader, Error> {
+        // Ingest the start of the file in a single read. For a COG, this usually contains all of the
+        // IFDs, which are then read from the chunk cache
+        let ingested_bytes = source.ingested_bytes_at_open();
+        source.prefetch(0, ingested_bytes).await?;
+
         // Byte order & magic number check
         let byte_order: ByteOrder = {
             let mut buf = [0u8; 2];
@@ -577,7 +933,7 @@ impl TIFFReader {
             }
         }?;
         let variant: TIFFVariant = {
-            let magic_number = read_u16(&mut source, 2, byte_order).await?;
+            let magic_number = read_u16(&source, 2, byte_order).await?;
             match magic_number {
                 42 => Ok(TIFFVariant::Classic),
                 43 => Ok(TIFFVariant::BigTiff),
@@ -588,38 +944,221 @@ impl TIFFReader {
             }
         }?;
 
-        let initial_ifd_offset: u64 = variant
-            .read_initial_ifd_offset(&mut source, byte_order)
-            .await?;
+        let initial_ifd_offset: u64 = variant.read_initial_ifd_offset(&source, byte_order).await?;
+        let structural_metadata = StructuralMetadata::read(&source, variant.header_size()).await?;
 
-        // Read ifds
-        let ifds: Vec<ImageFileDirectory> = {
-            let mut ifds = vec![];
-            let mut ifd_offset = initial_ifd_offset;
-            // TODO: Infinite loop detection ?
-            while ifd_offset > 0 {
-                let (ifd, next_ifd_offset) = variant
-                    .read_image_file_directory(&mut source, ifd_offset, byte_order)
-                    .await?;
-                ifd_offset = next_ifd_offset;
-                ifds.push(ifd);
-            }
-            ifds
+        let mut remaining_ifds = IFDChain {
+            variant,
+            byte_order,
+            structural_metadata,
+            next_ifd_offset: initial_ifd_offset,
         };
-
-        Ok(TIFFReader { ifds, source })
+        let ifds = remaining_ifds.read_ifds(&source, max_ifds).await?;
+        Ok(TIFFReader {
+            ifds,
+            structural_metadata,
+            source,
+            remaining_ifds,
+        })
     }
 
     /// This will fully read + decode all ifd entries in the file
-    pub async fn fully_read_ifds(&mut self) -> Result<Vec<Vec<FullyDecodedIFDEntry>>, Error> {
+    pub async fn fully_read_ifds(&self) -> Result<Vec<Vec<FullyDecodedIFDEntry>>, Error> {
         let mut fully_decoded_ifds: Vec<Vec<FullyDecodedIFDEntry>> = vec![];
         for ifd in self.ifds.iter() {
             let mut decoded_entries = vec![];
             for e in ifd.entries.iter() {
-                decoded_entries.push(e.read(&mut self.source).await?);
+                decoded_entries.push(e.read(&self.source).await?);
             }
             fully_decoded_ifds.push(decoded_entries);
         }
         Ok(fully_decoded_ifds)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::{
+        contiguous_header_end, ByteOrder, IFDEntryMetadata, IFDTag, IFDType, IFDValue,
+        ImageFileDirectory, LazyU64Array, OffsetOrInlineValue, TIFFReader, LAZY_ARRAY_PAGE_LEN,
+    };
+    use crate::errors::Error;
+    use crate::sources::{Source, CHUNK_SIZE};
+    use std::collections::HashMap;
+    use std::sync::Mutex;
+    use tokio::sync::OnceCell;
+
+    #[tokio::test]
+    async fn test_ifd_tag_lookup() {
+        let mut file_data = vec![0u8; 8];
+        file_data.extend(1.5f64.to_le_bytes());
+        file_data.extend(2.5f64.to_le_bytes());
+        let filename = std::env::temp_dir().join(format!(
+            "acog_test_ifd_tag_lookup_{}.bin",
+            std::process::id()
+        ));
+        std::fs::write(&filename, &file_data).unwrap();
+        let source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+        let entry = |tag, field_type, count, offset_or_value| IFDEntryMetadata {
+            tag,
+            field_type,
+            count,
+            offset_or_value,
+            byte_order: ByteOrder::LittleEndian,
+            value: OnceCell::new(),
+        };
+        let ifd = ImageFileDirectory::new(vec![
+            entry(
+                IFDTag::ImageWidth,
+                IFDType::Short,
+                1,
+                OffsetOrInlineValue::FourBytesInlineValue([42, 0, 0, 0]),
+            ),
+            entry(
+                IFDTag::ModelPixelScaleTag,
+                IFDType::Double,
+                2,
+                OffsetOrInlineValue::Offset(8),
+            ),
+        ]);
+
+        assert!(!ifd.entries[1].value.initialized());
+        assert_eq!(
+            ifd.get_vec_double_tag_value(&source, IFDTag::ModelPixelScaleTag)
+                .await
+                .unwrap(),
+            vec![1.5, 2.5]
+        );
+        // The decoded value is kept, so it's not read again
+        assert!(ifd.entries[1].value.initialized());
+        assert!(matches!(
+            ifd.get_tag_value_ref(&source, IFDTag::ModelPixelScaleTag)
+                .await
+                .unwrap(),
+            IFDValue::Double(_)
+        ));
+        assert_eq!(
+            ifd.get_u64_tag_value(&source, IFDTag::ImageWidth)
+                .await
+                .unwrap(),
+            42
+        );
+        assert!(matches!(
+            ifd.get_tag_value(&source, IFDTag::ImageLength).await,
+            Err(Error::RequiredTagNotFound(IFDTag::ImageLength))
+        ));
+        assert!(matches!(
+            ifd.get_vec_short_tag_value(&source, IFDTag::ModelPixelScaleTag)
+                .await,
+            Err(Error::TagHasWrongType(IFDTag::ModelPixelScaleTag, _))
+        ));
+        std::fs::remove_file(&filename).unwrap();
+    }
+
+    #[tokio::test]
+    async fn test_lazy_u64_array() {
+        let len = 2 * LAZY_ARRAY_PAGE_LEN + 10;
+        let values: Vec<u64> = (0..len as u64).map(|v| v * 3).collect();
+        let mut file_data = vec![0u8; 100];
+        for v in &values {
+            file_data.extend((*v as u32).to_le_bytes());
+        }
+        let filename = std::env::temp_dir().join(format!(
+            "acog_test_lazy_u64_array_{}.bin",
+            std::process::id()
+        ));
+        std::fs::write(&filename, &file_data).unwrap();
+        let source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+        let array = LazyU64Array {
+            len,
+            location: Some((100, IFDType::Long, ByteOrder::LittleEndian)),
+            pages: Mutex::new(HashMap::new()),
+        };
+
+        // Only the first and last pages are read
+        assert_eq!(
+            array.get_many(&source, &[len - 1, 1]).await.unwrap(),
+            vec![values[len - 1], values[1]]
+        );
+        assert_eq!(array.pages.lock().unwrap().len(), 2);
+        assert_eq!(
+            array.get(&source, LAZY_ARRAY_PAGE_LEN).await.unwrap(),
+            values[LAZY_ARRAY_PAGE_LEN]
+        );
+        assert_eq!(array.pages.lock().unwrap().len(), 3);
+        assert!(array.get(&source, len).await.is_err());
+
+        let known = LazyU64Array::from_values(values.clone());
+        assert_eq!(
+            known.get_many(&source, &[0, len - 1]).await.unwrap(),
+            vec![values[0], values[len - 1]]
+        );
+        std::fs::remove_file(&filename).unwrap();
+    }
+
+    #[tokio::test]
+    async fn test_open_header_larger_than_chunk_cache() {
+        // A single IFD followed by an out-of-line value of 12 chunks, while the chunk cache holds 8
+        let nvalues = 12 * CHUNK_SIZE / 8;
+        let mut file_data = vec![];
+        file_data.extend(b"II*\0");
+        file_data.extend(8u32.to_le_bytes());
+        file_data.extend(1u16.to_le_bytes());
+        file_data.extend(33922u16.to_le_bytes());
+        file_data.extend(12u16.to_le_bytes());
+        file_data.extend((nvalues as u32).to_le_bytes());
+        file_data.extend(26u32.to_le_bytes());
+        file_data.extend(0u32.to_le_bytes());
+        for i in 0..nvalues {
+            file_data.extend((i as f64).to_le_bytes());
+        }
+        let filename = std::env::temp_dir().join(format!(
+            "acog_test_open_header_larger_than_chunk_cache_{}.bin",
+            std::process::id()
+        ));
+        std::fs::write(&filename, &file_data).unwrap();
+        let mut source = Source::new_from_source_spec(filename.to_str().unwrap())
+            .await
+            .unwrap();
+        source.set_chunk_cache_max_bytes(8 * CHUNK_SIZE);
+        source.set_ingested_bytes_at_open(4 * CHUNK_SIZE);
+
+        // One read for the ingested bytes, one for the rest of the header
+        let reader = TIFFReader::open_from_source(source).await.unwrap();
+        assert_eq!(reader.ifds.len(), 1);
+        assert!(reader.source.get_stats().contains("read_counts=2"));
+        // The prefetch of the rest of the header didn't evict the IFD
+        let mut ifd_data = [0u8; 18];
+        reader.source.read_exact(8, &mut ifd_data).await.unwrap();
+        assert_eq!(ifd_data, file_data[8..26]);
+        assert!(reader.source.get_stats().contains("read_counts=2"));
+        std::fs::remove_file(&filename).unwrap();
+    }
+
+    #[test]
+    fn test_contiguous_header_end() {
+        // Everything fits in the ingested bytes
+        assert_eq!(
+            contiguous_header_end(vec![(8, 8), (200, 300)], 1000, 16),
+            1000
+        );
+        // The tile offsets follow the IFD, but some image data is far away
+        assert_eq!(
+            contiguous_header_end(
+                vec![(8, 8), (900, 5000), (5010, 9000), (100000, 100010)],
+                1000,
+                16
+            ),
+            9000
+        );
+        // Not contiguous with the ingested bytes
+        assert_eq!(
+            contiguous_header_end(vec![(8, 8), (2000, 3000)], 1000, 16),
+            1000
+        );
+    }
+}
@@ -1,6 +1,5 @@
-use crate::errors::Error;
 /// Low-level byte conversion functions
-use std::mem::size_of;
+use crate::errors::Error;
 
 #[derive(Debug, Clone, Copy)]
 #[cfg_attr(feature = "json", derive(serde::Serialize))]
@@ -126,13 +125,65 @@ pub fn decode_vec<T, F, const N: usize>(
 where
     F: Fn([u8; N], ByteOrder) -> T,
 {
-    let mut out = vec![];
-    let type_size: usize = size_of::<T>();
-    for i in 0..count {
-        out.push(decode_fn(
-            buf[i * type_size..(i + 1) * type_size].try_into().unwrap(),
-            byte_order,
-        ))
+    buf[..count * N]
+        .chunks_exact(N)
+        .map(|v| decode_fn(v.try_into().unwrap(), byte_order))
+        .collect()
+}
+
+/// Decodes `buf` as an array of unsigned integers of `int_size` (2, 4 or 8) bytes, widened to u64
+///
+/// This is used for large arrays like TileOffsets, so the byte order is matched once for the
+/// whole array rather than per element, which lets the compiler vectorise the loops
+pub fn decode_uint_vec_to_u64(buf: &[u8], int_size: usize, byte_order: ByteOrder) -> Vec<u64> {
+    let values = buf.chunks_exact(int_size);
+    match (int_size, byte_order) {
+        (2, ByteOrder::LittleEndian) => values
+            .map(|v| u16::from_le_bytes([v[0], v[1]]) as u64)
+            .collect(),
+        (2, ByteOrder::BigEndian) => values
+            .map(|v| u16::from_be_bytes([v[0], v[1]]) as u64)
+            .collect(),
+        (4, ByteOrder::LittleEndian) => values
+            .map(|v| u32::from_le_bytes(v.try_into().unwrap()) as u64)
+            .collect(),
+        (4, ByteOrder::BigEndian) => values
+            .map(|v| u32::from_be_bytes(v.try_into().unwrap()) as u64)
+            .collect(),
+        (8, ByteOrder::LittleEndian) => values
+            .map(|v| u64::from_le_bytes(v.try_into().unwrap()))
+            .collect(),
+        (8, ByteOrder::BigEndian) => values
+            .map(|v| u64::from_be_bytes(v.try_into().unwrap()))
+            .collect(),
+        _ => panic!("Unsupported integer size: {}", int_size),
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::{decode_u16, decode_uint_vec_to_u64, decode_vec, ByteOrder};
+
+    #[test]
+    fn test_decode_uint_vec_to_u64() {
+        let values: Vec<u64> = vec![0, 1, 258, 65535];
+        for byte_order in [ByteOrder::LittleEndian, ByteOrder::BigEndian] {
+            for int_size in [2, 4, 8] {
+                let buf: Vec<u8> = values
+                    .iter()
+                    .flat_map(|v| match byte_order {
+                        ByteOrder::LittleEndian => v.to_le_bytes()[..int_size].to_vec(),
+                        ByteOrder::BigEndian => v.to_be_bytes()[8 - int_size..].to_vec(),
+                    })
+                    .collect();
+                assert_eq!(decode_uint_vec_to_u64(&buf, int_size, byte_order), values);
+            }
+        }
+        // Same as decoding elements one by one
+        let buf = [1, 2, 3, 4, 5, 6];
+        assert_eq!(
+            decode_vec(&buf, 3, decode_u16, ByteOrder::BigEndian),
+            vec![258, 772, 1286]
+        );
     }
-    out
 }
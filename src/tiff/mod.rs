@@ -2,5 +2,6 @@ pub mod cog;
 mod compression;
 pub mod geo_keys;
 pub mod georef;
+pub mod ghost;
 pub mod ifd;
 pub mod low_level;
@@ -1,5 +1,5 @@
 use crate::epsg::spheroid_3857::{EARTH_RADIUS_METERS, TOP_LEFT_METERS};
-use crate::tiff::cog::ImageRect;
+use crate::tiff::cog::{ImageRect, Overview};
 use crate::tiff::georef::Georeference;
 use crate::Error;
 use crate::COG;
@@ -39,15 +39,21 @@ trait OverviewGeoreferenceCollection {
     fn georeferences_for_overview(&self) -> Vec<Georeference>;
 }
 
-impl OverviewGeoreferenceCollection for COG {
+/// A COG along with all of its overviews, which are needed to plan tiles
+struct COGOverviews<'a> {
+    cog: &'a COG,
+    overviews: Vec<&'a Overview>,
+}
+
+impl OverviewGeoreferenceCollection for COGOverviews<'_> {
     fn georeference(&self) -> &Georeference {
-        &self.georeference
+        &self.cog.georeference
     }
 
     fn georeferences_for_overview(&self) -> Vec<Georeference> {
         self.overviews
             .iter()
-            .map(|o| self.compute_georeference_for_overview(o))
+            .map(|o| self.cog.compute_georeference_for_overview(o))
             .collect()
     }
 }
@@ -76,12 +82,34 @@ pub struct TileData {
     pub data: Vec<u8>,
     #[allow(dead_code)]
     overview_index: usize,
+    nbands: u64,
+}
+
+impl TileData {
+    /// The shape of `data`, packed as HwC. Tiles have the same bands as the COG
+    pub fn shape(&self) -> [usize; 3] {
+        [TILE_SIZE as usize, TILE_SIZE as usize, self.nbands as usize]
+    }
+}
+
+pub async fn extract_tile(cog: &COG, tile_coords: TMSTileCoords) -> Result<TileData, Error> {
+    let mut tiles = extract_tiles(cog, &[tile_coords]).await?;
+    Ok(tiles.remove(0))
 }
 
-pub async fn extract_tile(cog: &mut COG, tile_coords: TMSTileCoords) -> Result<TileData, Error> {
+/// What needs to be read from the COG to produce a given tile
+struct TilePlan {
+    tile_coords: TMSTileCoords,
+    overview_index: usize,
+    overview_georef: Georeference,
+    // None if the tile is out of the image
+    overview_area_rect: Option<ImageRect>,
+}
+
+fn plan_tile(cog: &COGOverviews, tile_coords: TMSTileCoords) -> Result<TilePlan, Error> {
     let overview_index = find_best_overview(cog, tile_coords.z);
-    let overview = &cog.overviews[overview_index];
-    let overview_georef = cog.compute_georeference_for_overview(overview);
+    let overview = cog.overviews[overview_index];
+    let overview_georef = cog.cog.compute_georeference_for_overview(overview);
 
     let nbands = overview.nbands;
     if nbands < 3 {
@@ -107,35 +135,91 @@ pub async fn extract_tile(cog: &mut COG, tile_coords: TMSTileCoords) -> Result<T
         i_to: std::cmp::min(overview.height, overview_area_ul.y as u64),
     };
 
-    // Out of image tile => return transparent
-    if overview_area_rect.j_to <= overview_area_rect.j_from
+    // Out of image tile => nothing to read
+    let overview_area_rect = if overview_area_rect.j_to <= overview_area_rect.j_from
         || overview_area_rect.i_to <= overview_area_rect.i_from
     {
-        // TODO: Add test for this (out of image tile should return transparent)
-        return Ok(TileData {
-            data: vec![0_u8; (TILE_SIZE * TILE_SIZE * 3) as usize],
-            overview_index,
-        });
+        None
+    } else {
+        Some(overview_area_rect)
+    };
+    Ok(TilePlan {
+        tile_coords,
+        overview_index,
+        overview_georef,
+        overview_area_rect,
+    })
+}
+
+/// Extracts multiple tiles at once. This reads all the overview areas required by the tiles in one
+/// go, so overview tiles shared by multiple output tiles are only read once
+pub async fn extract_tiles(
+    cog: &COG,
+    tiles_coords: &[TMSTileCoords],
+) -> Result<Vec<TileData>, Error> {
+    let cog_overviews = COGOverviews {
+        cog,
+        overviews: cog.overviews().await?,
+    };
+    let plans = tiles_coords
+        .iter()
+        .map(|tile_coords| plan_tile(&cog_overviews, *tile_coords))
+        .collect::<Result<Vec<TilePlan>, Error>>()?;
+
+    let mut tiles_data: Vec<Option<TileData>> = tiles_coords.iter().map(|_| None).collect();
+    for (overview_index, overview) in cog_overviews.overviews.iter().enumerate() {
+        // Indices (in `plans`) of the tiles that need to read from this overview
+        let plan_indices: Vec<usize> = (0..plans.len())
+            .filter(|i| {
+                plans[*i].overview_index == overview_index && plans[*i].overview_area_rect.is_some()
+            })
+            .collect();
+        if plan_indices.is_empty() {
+            continue;
+        }
+        let rects: Vec<ImageRect> = plan_indices
+            .iter()
+            .map(|i| plans[*i].overview_area_rect.clone().unwrap())
+            .collect();
+        let overview_areas_data = overview
+            .reader(&cog.source)
+            .await?
+            .read_image_parts(&cog.source, &rects)
+            .await?;
+        for (i, overview_area_data) in plan_indices.iter().zip(overview_areas_data) {
+            tiles_data[*i] = Some(warp_tile(&plans[*i], overview.nbands, &overview_area_data)?);
+        }
     }
-    let overview_area_data = overview
-        .make_reader(&mut cog.source)
-        .await?
-        .read_image_part(&mut cog.source, &overview_area_rect)
-        .await?;
 
+    Ok(plans
+        .iter()
+        .zip(tiles_data)
+        .map(|(plan, tile_data)| {
+            // TODO: Add test for this (out of image tile should return transparent)
+            tile_data.unwrap_or_else(|| TileData {
+                data: vec![0_u8; (TILE_SIZE * TILE_SIZE * cog.nbands()) as usize],
+                overview_index: plan.overview_index,
+                nbands: cog.nbands(),
+            })
+        })
+        .collect())
+}
+
+/// Produces the tile described by `plan` from the overview area data that was read for it
+fn warp_tile(plan: &TilePlan, nbands: u64, overview_area_data: &[u8]) -> Result<TileData, Error> {
+    let tile_coords = &plan.tile_coords;
+    let overview_area_rect = plan.overview_area_rect.as_ref().unwrap();
     // For each pixel in the output tile, interpolate its value from the overview_area_data we
     // just read
-    // RGB image
-    let mut tile_data: Vec<u8> = vec![0; (TILE_SIZE * TILE_SIZE * 3) as usize];
+    let mut tile_data: Vec<u8> = vec![0; (TILE_SIZE * TILE_SIZE * nbands) as usize];
     {
-        let warper = Warper::new(&overview_georef)?;
+        let warper = Warper::new(&plan.overview_georef)?;
         for i in 0..TILE_SIZE {
             // TODO: Given we assert PlanarConfiguration, can use some memcpy below
             for j in 0..TILE_SIZE {
                 // TODO: Naive nearest neighbor => replace by bilinear (or make this selectable)
                 // Compute the 3857/projeced position of that pixel
-                let overview_pixel = warper.project_tile_pixel(&tile_coords, j as f64, i as f64);
-
+                let overview_pixel = warper.project_tile_pixel(tile_coords, j as f64, i as f64);
                 // If we are outside of the overview area rect, leave pixels black.
                 // Note that we have a small 'margin' of one pixel to avoid black borders on the side
                 // of some tiles
@@ -159,9 +243,11 @@ pub async fn extract_tile(cog: &mut COG, tile_coords: TMSTileCoords) -> Result<T
                 // We need to flip i here because i, j are in TMS coordinates with i/y growing north
                 // but in raster space, y is growing south
                 let i = TILE_SIZE - i - 1;
-                for b in 0..3 {
-                    tile_data[(i * TILE_SIZE * 3 + j * 3 + b) as usize] = overview_area_data
-                        [(overview_area_y as u64 * overview_area_rect.width() * nbands
+                for b in 0..nbands {
+                    tile_data[(i * TILE_SIZE * nbands + j * nbands + b) as usize] =
+                        overview_area_data[(overview_area_y as u64
+                            * overview_area_rect.width()
+                            * nbands
                             + overview_area_x as u64 * nbands
                             + b) as usize];
                 }
@@ -171,7 +257,8 @@ pub async fn extract_tile(cog: &mut COG, tile_coords: TMSTileCoords) -> Result<T
 
     Ok(TileData {
         data: tile_data,
-        overview_index,
+        overview_index: plan.overview_index,
+        nbands,
     })
 }
 
@@ -413,11 +500,11 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_full_tile_3857() {
         // Tests extracting a tile that is fully covered by the image - which is already in 3857
-        let mut cog = crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
             .await
             .unwrap();
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
             .await
             .unwrap();
 
@@ -450,11 +537,11 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_full_tile_3857_bigtiff() {
         // Tests extracting a tile that is fully covered by the image - which is already in 3857
-        let mut cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_bigtiff.tif")
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_bigtiff.tif")
             .await
             .unwrap();
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
             .await
             .unwrap();
 
@@ -487,11 +574,11 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_deflate() {
         // DEFLATE compressed file
-        let mut cog = crate::COG::open("example_data/example_1_cog_deflate.tif")
+        let cog = crate::COG::open("example_data/example_1_cog_deflate.tif")
             .await
             .unwrap();
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
             .await
             .unwrap();
 
@@ -524,7 +611,7 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_full_tile_ch1903() {
         // Tests extracting a tile that is fully covered by the image which is in CH1903+
-        let mut cog = crate::COG::open("example_data/example_1_cog_nocompress.tif")
+        let cog = crate::COG::open("example_data/example_1_cog_nocompress.tif")
             .await
             .unwrap();
         // The image should be in CH1903+. Note that we check mostly to avoid wrongly using an
@@ -532,7 +619,7 @@ mod tests {
         // https://epsg.io/2056
         assert_eq!(cog.georeference.crs, Crs::Unknown(2056));
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
             .await
             .unwrap();
 
@@ -567,7 +654,7 @@ mod tests {
     async fn test_extract_tile_local_file_full_tile_4326() {
         // Tests extracting a tile that is fully covered by the image which is in 4326,
         // which means it also has UnitOfMeasure::Degree
-        let mut cog = crate::COG::open("example_data/marina_1_cog_nocompress.tif")
+        let cog = crate::COG::open("example_data/marina_1_cog_nocompress.tif")
             .await
             .unwrap();
         // The image should be in 4326. Note that we check mostly to avoid wrongly using an
@@ -575,10 +662,9 @@ mod tests {
         assert_eq!(cog.georeference.crs, Crs::Unknown(4326));
         assert_eq!(cog.georeference.unit, UnitOfMeasure::Degree);
 
-        let tile_data =
-            super::extract_tile(&mut cog, TMSTileCoords::from_zxy(21, 1726623, 1100526))
-                .await
-                .unwrap();
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(21, 1726623, 1100526))
+            .await
+            .unwrap();
 
         // To update this test, you can output the tile by uncommenting the following. You can
         // use the utils/extract_tile_rio_tiler.py to compare this tile to what riotiler
@@ -610,12 +696,11 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_full_tile_multiple_overviews() {
         // Test extracting a tile that requires looking at an overview > 0
-        let mut cog =
-            crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
-                .await
-                .unwrap();
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress_blocksize_256.tif")
+            .await
+            .unwrap();
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(17, 68710, 45698))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(17, 68710, 45698))
             .await
             .unwrap();
         // This should have read from the second overview - not the full res image
@@ -650,11 +735,11 @@ mod tests {
     #[tokio::test]
     async fn test_extract_tile_local_file_partial_tile() {
         // Tests extracting a tile that is only partially covered by the image
-        let mut cog = crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
             .await
             .unwrap();
         // This specific tiles also covers the `margin_px` logic we have in `extract_tile``
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549689, 365591))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549689, 365591))
             .await
             .unwrap();
 
@@ -684,12 +769,66 @@ mod tests {
         assert_eq!(tile_data.data, expected.data);
     }
 
+    #[tokio::test]
+    async fn test_extract_tiles_local_file() {
+        // Tests extracting multiple tiles at once gives the same result as extracting them one by one
+        let cog = crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
+            .await
+            .unwrap();
+        let tiles_data = super::extract_tiles(
+            &cog,
+            &[
+                TMSTileCoords::from_zxy(20, 549687, 365589),
+                TMSTileCoords::from_zxy(20, 549689, 365591),
+            ],
+        )
+        .await
+        .unwrap();
+        assert_eq!(tiles_data.len(), 2);
+
+        let expected = crate::ppm::read_ppm(
+            "example_data/tests_expected/example_1_cog_3857_nocompress__20_549687_365589.ppm",
+        )
+        .unwrap();
+        assert_eq!(tiles_data[0].data, expected.data);
+        let expected = crate::ppm::read_ppm(
+            "example_data/tests_expected/example_1_cog_3857_nocompress__20_549689_365591.ppm",
+        )
+        .unwrap();
+        assert_eq!(tiles_data[1].data, expected.data);
+    }
+
+    #[tokio::test]
+    async fn test_extract_tile_shared_cog() {
+        // Tests that a single opened COG can serve concurrent tile requests
+        let cog = std::sync::Arc::new(
+            crate::COG::open("example_data/example_1_cog_3857_nocompress.tif")
+                .await
+                .unwrap(),
+        );
+        let tasks = (0..4).map(|_| {
+            let cog = cog.clone();
+            tokio::spawn(async move {
+                super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+                    .await
+                    .unwrap()
+            })
+        });
+        let expected = crate::ppm::read_ppm(
+            "example_data/tests_expected/example_1_cog_3857_nocompress__20_549687_365589.ppm",
+        )
+        .unwrap();
+        for tile_data in futures::future::join_all(tasks).await {
+            assert_eq!(tile_data.unwrap().data, expected.data);
+        }
+    }
+
     #[tokio::test]
     async fn test_extract_tile_minio() {
-        let mut cog = crate::COG::open("/vsis3/public/example_1_cog_3857_nocompress.tif")
+        let cog = crate::COG::open("/vsis3/public/example_1_cog_3857_nocompress.tif")
             .await
             .unwrap();
-        let tile_data = super::extract_tile(&mut cog, TMSTileCoords::from_zxy(20, 549687, 365589))
+        let tile_data = super::extract_tile(&cog, TMSTileCoords::from_zxy(20, 549687, 365589))
             .await
             .unwrap();
 